@@ -1,23 +1,61 @@
+import os
+import sys
+import json
 import nltk
 import logging
 import asyncio
 from indexer import Indexer
-from pydantic import BaseModel
+from array import array
+from pydantic import BaseModel, Field
 from storage import MinimaStore
 from async_queue import AsyncQueue
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
 from contextlib import asynccontextmanager
-from fastapi_utilities import repeat_every
-from async_loop import index_loop, crawl_loop
+from concurrent.futures import ThreadPoolExecutor
+from async_loop import INDEX_QUEUE_SIZE
+from fs_watcher import WATCH_MODE
+from scheduler import IndexingScheduler
+from query_limiter import QueryLimiter
+from embedding_batcher import EmbeddingBatcher
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 indexer = Indexer()
 router = APIRouter()
-async_queue = AsyncQueue()
+async_queue = AsyncQueue(maxsize=INDEX_QUEUE_SIZE)
 MinimaStore.create_db_and_tables()
 
+# With a file watcher running the full crawl is only a low-frequency reconciliation pass
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get(
+    "RECONCILE_INTERVAL_SECONDS",
+    str(60 * 20 if WATCH_MODE == "off" else 60 * 60 * 6)
+))
+scheduler = IndexingScheduler(async_queue, indexer, RECONCILE_INTERVAL_SECONDS)
+
+# Query embeddings run in their own pool, so they neither block the event loop nor wait behind indexing
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", "4"))
+# Requests served at the same time, and requests allowed to wait for a slot before 503 is returned
+QUERY_CONCURRENCY = int(os.environ.get("QUERY_CONCURRENCY", "64"))
+QUERY_QUEUE_SIZE = int(os.environ.get("QUERY_QUEUE_SIZE", "100"))
+query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+query_limiter = QueryLimiter(QUERY_CONCURRENCY, QUERY_QUEUE_SIZE)
+
+# Concurrent query embeddings are collected for up to this long, or until the batch is full,
+# and then embedded in one forward pass
+EMBED_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_SIZE = int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32"))
+# Maximum number of chunks one /query request may ask for
+QUERY_MAX_K = int(os.environ.get("QUERY_MAX_K", "50"))
+# Maximum number of texts in one /embeddings request
+EMBEDDINGS_MAX_TEXTS = int(os.environ.get("EMBEDDINGS_MAX_TEXTS", "256"))
+embedding_batcher = EmbeddingBatcher(
+    indexer.embed_queries,
+    query_executor,
+    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+    max_batch_size=EMBED_BATCH_MAX_SIZE
+)
+
 def init_loader_dependencies():
     nltk.download('punkt')
     nltk.download('punkt_tab')
@@ -32,20 +70,65 @@ class Query(BaseModel):
     query: str
 
 
+class QueryFilter(BaseModel):
+    # Folder or file, as on the host (LOCAL_FILES_PATH) or in the container
+    path_prefix: str | None = None
+    # For example [".md", ".pdf"]
+    extensions: list[str] | None = None
+    # Markdown frontmatter (or other metadata) fields that must have the given value
+    frontmatter: dict[str, str | int | float | bool] | None = None
+
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = Field(4, ge=1, le=QUERY_MAX_K)
+    # Minimum cosine similarity of a chunk to the query
+    score_threshold: float | None = None
+    filter: QueryFilter | None = None
+    # Budget for the chunk texts of the response, in UTF-8 bytes
+    max_bytes: int | None = Field(None, ge=1)
+    # Also return all chunk texts joined into one "output" string, as earlier versions did
+    include_output: bool = False
+
+
+class EmbeddingsRequest(BaseModel):
+    texts: list[str]
+
+
 @router.post(
     "/query", 
     response_description='Query local data storage',
 )
-async def query(request: Query):
-    logger.info(f"Received query: {query}")
-    try:
-        result = indexer.find(request.query)
-        logger.info(f"Found {len(result)} results for query: {query}")
-        logger.info(f"Results: {result}")
-        return {"result": result}
-    except Exception as e:
-        logger.error(f"Error in processing query: {e}")
-        return {"error": str(e)}
+async def query(request: SearchRequest):
+    """
+    Search the indexed files. Returns the best k chunks, each with its text, score, link
+    to the file and position in it, and the list of files they came from.
+    """
+    logger.info(f"Received query: {request.query}")
+    async with query_limiter.slot():
+        try:
+            query_filter = None
+            if request.filter is not None:
+                query_filter = indexer.build_filter(
+                    path_prefix=request.filter.path_prefix,
+                    extensions=request.filter.extensions,
+                    fields=request.filter.frontmatter
+                )
+            result = await indexer.afind(
+                request.query,
+                embedding_batcher,
+                k=request.k,
+                score_threshold=request.score_threshold,
+                query_filter=query_filter,
+                max_bytes=request.max_bytes,
+                include_output=request.include_output
+            )
+            logger.info(f"Found {len(result.get('chunks', []))} results for query: {request.query}")
+            logger.debug(f"Results: {result}")
+            return {"result": result}
+        except Exception as e:
+            logger.error(f"Error in processing query: {e}")
+            return {"error": str(e)}
 
 
 @router.post(
@@ -54,28 +137,92 @@ async def query(request: Query):
 )
 async def embedding(request: Query):
     logger.info(f"Received embedding request: {request}")
-    try:
-        result = indexer.embed(request.query)
-        logger.info(f"Found {len(result)} results for query: {request.query}")
-        return {"result": result}
-    except Exception as e:
-        logger.error(f"Error in processing embedding: {e}")
-        return {"error": str(e)}    
+    async with query_limiter.slot():
+        try:
+            result = await indexer.aembed(request.query, embedding_batcher)
+            logger.info(f"Found {len(result)} results for query: {request.query}")
+            return {"result": result}
+        except Exception as e:
+            logger.error(f"Error in processing embedding: {e}")
+            return {"error": str(e)}
+
+
+@router.post(
+    "/embeddings",
+    response_description='Get embeddings for many texts',
+)
+async def embeddings(request: EmbeddingsRequest, http_request: Request):
+    """
+    Embed a batch of texts. With "Accept: application/octet-stream" the vectors are returned
+    as little-endian float32 rows; X-Embedding-Count and X-Embedding-Dimension give the shape
+    and X-Embedding-Errors maps the index of every failed text (a zero row) to its error.
+    Otherwise the response is JSON with an embedding or an error per text.
+    """
+    if len(request.texts) > EMBEDDINGS_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {EMBEDDINGS_MAX_TEXTS} texts per request")
+    logger.info(f"Received embeddings request for {len(request.texts)} texts")
+    async with query_limiter.slot():
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(query_executor, indexer.embed_many, request.texts)
+
+    errors = {str(i): error for i, (_, error) in enumerate(results) if error is not None}
+    if "application/octet-stream" not in http_request.headers.get("accept", ""):
+        return {
+            "results": [
+                {"embedding": vector} if error is None else {"error": error}
+                for vector, error in results
+            ]
+        }
+
+    dimension = next((len(vector) for vector, _ in results if vector is not None), 0)
+    payload = array("f")
+    for vector, _ in results:
+        payload.extend(vector if vector is not None else [0.0] * dimension)
+    if sys.byteorder == "big":
+        payload.byteswap()
+    return Response(
+        content=payload.tobytes(),
+        media_type="application/octet-stream",
+        headers={
+            "X-Embedding-Count": str(len(results)),
+            "X-Embedding-Dimension": str(dimension),
+            "X-Embedding-Errors": json.dumps(errors),
+        }
+    )
+
+
+@router.get(
+    "/index_version",
+    response_description='Token that changes whenever indexed content changes',
+)
+async def index_version():
+    return {"index_version": indexer.index_version}
+
+
+@router.get(
+    "/status",
+    response_description='Indexing state, backlog and ETA',
+)
+async def status():
+    return {
+        **scheduler.status(),
+        "index_version": indexer.index_version,
+        "embedding_cache": indexer.embedding_cache.stats(),
+        "queries": query_limiter.stats(),
+        "embedding_batches": embedding_batcher.stats(),
+    }
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    tasks = [
-        asyncio.create_task(crawl_loop(async_queue)),
-        asyncio.create_task(index_loop(async_queue, indexer))
-    ]
-    await schedule_reindexing()
+    scheduler.start()
     try:
         yield
     finally:
-        for task in tasks:
-            task.cancel()
-        await asyncio.gather(*tasks, return_exceptions=True)
+        await scheduler.stop()
+        indexer.shutdown()
+        await indexer.async_qdrant.close()
+        query_executor.shutdown(wait=False)
 
 
 def create_app() -> FastAPI:
@@ -87,20 +234,4 @@ def create_app() -> FastAPI:
     app.include_router(router)
     return app
 
-async def trigger_re_indexer():
-    logger.info("Reindexing triggered")
-    try:
-        await asyncio.gather(
-            crawl_loop(async_queue),
-            index_loop(async_queue, indexer)
-        )
-        logger.info("reindexing finished")
-    except Exception as e:
-        logger.error(f"error in scheduled reindexing {e}")
-
-
-@repeat_every(seconds=60*20)
-async def schedule_reindexing():
-    await trigger_re_indexer()
-
 app = create_app()
\ No newline at end of file
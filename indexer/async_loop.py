@@ -1,84 +1,466 @@
 import os
+import time
 import uuid
 import asyncio
 import logging
-from indexer import Indexer
+from typing import List
+from collections import deque
+from indexer import Indexer, PreparedFile
+from storage import MinimaStore, IndexingStatus
+from async_queue import AsyncQueue, PRIORITY_BULK, PRIORITY_RECENT
+from crawler import CRAWL_SNAPSHOT_PATH, StatSnapshot, scan_tree
+from langchain.schema import Document
 from concurrent.futures import ThreadPoolExecutor
-from ragignore_utils import load_ragignore, should_ignore_path
+from ragignore_utils import RagIgnore
 
 logger = logging.getLogger(__name__)
 executor = ThreadPoolExecutor()
+# Embedding batches go through a single worker so the model runs one forward pass at a time
+embed_executor = ThreadPoolExecutor(max_workers=1)
 
 CONTAINER_PATH = os.environ.get("CONTAINER_PATH")
+# Maximum number of pending messages before crawls wait for the index loop to catch up
+INDEX_QUEUE_SIZE = int(os.environ.get("INDEX_QUEUE_SIZE", "10000"))
+# Files modified within this many seconds are indexed ahead of the bulk backfill
+INDEX_RECENT_SECONDS = int(os.environ.get("INDEX_RECENT_SECONDS", str(60 * 60 * 24)))
+# Up to this many queued file messages are checked against the store in one transaction
+STORE_CHECK_BATCH_SIZE = int(os.environ.get("STORE_CHECK_BATCH_SIZE", "500"))
 AVAILABLE_EXTENSIONS = [".pdf", ".xls", "xlsx", ".doc", ".docx", ".txt", ".md", ".csv", ".ppt", ".pptx"]
 
 
-async def crawl_loop(async_queue):
+def is_indexable(path: str, ragignore: RagIgnore) -> bool:
+    """Whether a file passes the .ragignore patterns and has a supported extension."""
+    if ragignore.is_path_ignored(path):
+        logger.debug(f"Skipping ignored file: {path}")
+        return False
+    if not any(path.endswith(ext) for ext in AVAILABLE_EXTENSIONS):
+        logger.debug(f"Skipping unsupported extension: {path}")
+        return False
+    return True
+
+
+# Until a crawl has completed in this process, queued work from a previous run may have
+# been lost, so the first crawl enqueues every file instead of only the changed ones
+_crawled_since_start = False
+
+
+async def crawl_loop(async_queue: AsyncQueue, done: asyncio.Future | None = None):
+    """
+    Crawl CONTAINER_PATH and enqueue new or changed files, followed by the aggregate
+    and stop messages. done, if given, is resolved once the index loop has processed
+    everything this crawl enqueued.
+    """
+    global _crawled_since_start
     logger.info(f"Starting crawl loop with path: {CONTAINER_PATH}")
-    
-    # Load .ragignore patterns
-    ignore_patterns = load_ragignore(CONTAINER_PATH)
-    if ignore_patterns:
-        logger.info(f"Loaded {len(ignore_patterns)} patterns from .ragignore")
-    
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    # Files stored from now on may be missing from the listing, so the purge keeps them
+    crawl_started = time.time()
+
+    # Load .ragignore patterns, nested .ragignore files are picked up while scanning
+    ragignore = RagIgnore(CONTAINER_PATH)
+
+    previous = await loop.run_in_executor(executor, StatSnapshot.load, CRAWL_SNAPSHOT_PATH, CONTAINER_PATH)
+    snapshot = await loop.run_in_executor(
+        executor, scan_tree, CONTAINER_PATH, ragignore, AVAILABLE_EXTENSIONS, previous
+    )
+    # Files whose indexing failed are retried even though their mtime did not change
+    invalidated = set(await loop.run_in_executor(executor, MinimaStore.select_invalidated))
+    compare_to_previous = previous is not None and _crawled_since_start
+
     existing_file_paths: list[str] = []
-    for root, dirs, files in os.walk(CONTAINER_PATH):
-        # Filter directories that should be ignored
-        dirs[:] = [d for d in dirs if not should_ignore_path(os.path.join(root, d), ignore_patterns)]
-        logger.info(f"Processing folder: {root}")
-        logger.info(f"Found directories: {dirs}")
-        logger.info(f"Found files: {files}")
-        for file in files:
-            path = os.path.join(root, file)
-            
-            # Skip files that match ignore patterns
-            if should_ignore_path(path, ignore_patterns):
-                logger.info(f"Skipping ignored file: {path}")
-                continue
-                
-            # Skip files with unsupported extensions
-            if not any(file.endswith(ext) for ext in AVAILABLE_EXTENSIONS):
-                logger.info(f"Skipping unsupported extension: {file} in {root}")
-                continue
-            message = {
-                "path": path,
-                "file_id": str(uuid.uuid4()),
-                "last_updated_seconds": round(os.path.getmtime(path)),
-                "type": "file"
-            }
-            existing_file_paths.append(path)
-            async_queue.enqueue(message)
-            logger.info(f"File enqueued: {path} with id {message['file_id']}")
-            logger.info(f"Queue size now: {async_queue.size()}")
+    enqueued = 0
+    recent_since = time.time() - INDEX_RECENT_SECONDS
+    for path, rel_path, last_updated_seconds in snapshot.files():
+        if ragignore.is_ignored(rel_path):
+            logger.debug(f"Skipping ignored file: {path}")
+            continue
+        existing_file_paths.append(path)
+        if compare_to_previous and path not in invalidated and previous.mtime(path) == last_updated_seconds:
+            continue
+        message = {
+            "path": path,
+            "file_id": str(uuid.uuid4()),
+            "last_updated_seconds": last_updated_seconds,
+            "type": "file"
+        }
+        priority = PRIORITY_RECENT if last_updated_seconds >= recent_since else PRIORITY_BULK
+        # Waits while the queue is full, so memory does not grow with the size of the corpus
+        await async_queue.put(message, priority)
+        enqueued += 1
+        logger.debug(f"File enqueued: {path} with id {message['file_id']}")
+
+    try:
+        await loop.run_in_executor(executor, snapshot.save, CRAWL_SNAPSHOT_PATH)
+    except OSError as e:
+        logger.warning(f"Unable to save crawl snapshot to {CRAWL_SNAPSHOT_PATH}: {e}")
+    _crawled_since_start = True
+    logger.info(
+        f"Crawled {len(snapshot.dirs)} folders and {len(existing_file_paths)} files in "
+        f"{time.monotonic() - start:.1f} seconds, enqueued {enqueued} files. Queue size now: {async_queue.size()}"
+    )
 
     # After processing all directories, send the aggregate and stop messages
     aggregate_message = {
         "existing_file_paths": existing_file_paths,
+        "crawl_started": crawl_started,
         "type": "all_files"
     }
     async_queue.enqueue(aggregate_message)
-    async_queue.enqueue({"type": "stop"})
+    async_queue.enqueue({"type": "stop", "done": done})
+
+
+class IndexingStats:
+    """Tracks indexing throughput so hardware can be sized from the logs."""
+
+    def __init__(self, report_interval: int = 30):
+        self.report_interval = report_interval
+        self.reset()
+
+    # Window over which the current indexing rate is measured
+    RATE_WINDOW_SECONDS = 60
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.files = 0
+        self.chunks = 0
+        self._recent_files: deque[float] = deque()
+
+    def record_file(self):
+        self.files += 1
+        self._recent_files.append(time.monotonic())
+
+    def record_chunks(self, count: int):
+        self.chunks += count
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-6)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.elapsed
+
+    @property
+    def recent_files_per_second(self) -> float:
+        """Files per second over the last RATE_WINDOW_SECONDS, unaffected by idle time before that."""
+        window_start = time.monotonic() - self.RATE_WINDOW_SECONDS
+        while self._recent_files and self._recent_files[0] < window_start:
+            self._recent_files.popleft()
+        return len(self._recent_files) / min(self.RATE_WINDOW_SECONDS, self.elapsed)
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        logger.info(
+            f"Indexing throughput: {self.files} files ({self.files_per_second:.2f} files/sec), "
+            f"{self.chunks} chunks ({self.chunks_per_second:.2f} chunks/sec) in {self.elapsed:.1f} seconds"
+        )
+
+
+class ChunkBatcher:
+    """
+    Packs chunks from many files into embedding batches of similar token length.
+
+    Chunks are buffered until `window` batches worth have arrived, then sorted by token
+    count and cut into batches bounded by chunk count and by padded token count (chunks
+    times the longest chunk of the batch), so short chunks are not padded to long ones.
+    """
+
+    def __init__(self, max_chunks: int, max_tokens: int, window: int = 1):
+        self.max_chunks = max(1, max_chunks)
+        self.max_tokens = max_tokens
+        self.window = max(1, window)
+        self._pending: List[tuple[Document, int]] = []
+        self._tokens = 0
+
+    def add(self, documents: List[Document], token_counts: List[int]):
+        self._pending.extend(zip(documents, token_counts))
+        self._tokens += sum(token_counts)
 
+    def ready(self) -> bool:
+        return (
+            len(self._pending) >= self.max_chunks * self.window
+            or self._tokens >= self.max_tokens * self.window
+        )
 
-async def index_loop(async_queue, indexer: Indexer):
+    def take(self) -> List[tuple[List[Document], List[int]]]:
+        """Empty the buffer into batches of (chunks, token counts), shortest chunks first."""
+        pending = sorted(self._pending, key=lambda item: item[1])
+        self._pending = []
+        self._tokens = 0
+        batches: List[List[tuple[Document, int]]] = []
+        batch: List[tuple[Document, int]] = []
+        for document, tokens in pending:
+            # Sorted, so this chunk is the longest of the batch and sets its padded length.
+            # A batch always takes one chunk, so an oversized chunk cannot stall the batcher
+            if batch and (len(batch) >= self.max_chunks or (len(batch) + 1) * tokens > self.max_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append((document, tokens))
+        if batch:
+            batches.append(batch)
+        return [([doc for doc, _ in batch], [tokens for _, tokens in batch]) for batch in batches]
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class IndexPipeline:
+    """
+    Loads and chunks several files concurrently while a single embedding worker
+    consumes fixed-size batches of chunks and upserts them to Qdrant in bulk.
+    """
+
+    def __init__(self, async_queue, indexer: Indexer, persistent: bool = False, stats: IndexingStats | None = None):
+        self.async_queue = async_queue
+        self.indexer = indexer
+        self.persistent = persistent
+        self.stats = stats or IndexingStats(report_interval=indexer.config.INDEX_STATS_INTERVAL)
+        self.batcher = ChunkBatcher(
+            max_chunks=indexer.config.INDEX_BATCH_SIZE,
+            max_tokens=indexer.config.INDEX_BATCH_TOKENS,
+            window=indexer.config.INDEX_BUCKET_BATCHES
+        )
+        # Files whose chunks wait in the batcher, by the id() of each chunk, and how many of
+        # their chunks are not stored yet, by path. A file is finished once all its chunks
+        # are stored, unless one of its batches failed.
+        self._chunk_files: dict[int, PreparedFile] = {}
+        self._unstored: dict[str, int] = {}
+        self._failed: set[str] = set()
+        # Paths from their store check until they are finished. A newer message for such a
+        # path waits in _deferred, then in _ready, so that two versions of a file never work
+        # out their stale chunks from the same stored hashes.
+        self._in_flight: set[str] = set()
+        self._deferred: dict[str, dict] = {}
+        self._ready: List[dict] = []
+        self._load_slots = asyncio.Semaphore(indexer.config.INDEX_LOAD_CONCURRENCY)
+        self._loads: set[asyncio.Task] = set()
+        # A non-file message dequeued while collecting a batch of file messages
+        self._held = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        logger.info("Starting pipelined index loop")
+        self.stats.reset()
+        while True:
+            if self._ready:
+                ready, self._ready = self._ready, []
+                await self._schedule_files(ready)
+                continue
+            if self._held is None and self.async_queue.size() == 0:
+                if self._loads:
+                    await asyncio.wait(self._loads, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if len(self.batcher):
+                    await self._flush()
+                    continue
+                logger.debug("No files to index. Waiting for new files.")
+                await asyncio.sleep(1)
+                continue
+            if self._held is not None:
+                message, self._held = self._held, None
+            else:
+                message = await self.async_queue.dequeue()
+            logger.debug(f"Processing message: {message}")
+            try:
+                if message["type"] == "file":
+                    await self._schedule_files(await self._collect_files(message))
+                elif message["type"] == "delete":
+                    await self._drain()
+                    await loop.run_in_executor(executor, self.indexer.remove, message)
+                elif message["type"] == "all_files":
+                    await self._drain()
+                    await loop.run_in_executor(executor, self.indexer.purge, message)
+                elif message["type"] == "stop":
+                    await self._drain()
+                    self.stats.report(force=True)
+                    _resolve(message)
+                    if not self.persistent:
+                        break
+                    self.stats.reset()
+            except Exception as e:
+                logger.error(f"Error in processing message: {e}")
+                logger.error(f"Failed to process message: {message}")
+
+    async def _collect_files(self, message) -> List[dict]:
+        """Take the file messages queued right behind message, up to STORE_CHECK_BATCH_SIZE."""
+        messages = [message]
+        while len(messages) < STORE_CHECK_BATCH_SIZE and self.async_queue.size() > 0:
+            next_message = await self.async_queue.dequeue()
+            if next_message["type"] != "file":
+                self._held = next_message
+                break
+            messages.append(next_message)
+        return messages
+
+    async def _schedule_files(self, messages: List[dict]):
+        loop = asyncio.get_running_loop()
+        # The queue coalesces paths, but a path may have been queued again after it was taken
+        messages = list({message["path"]: message for message in messages}.values())
+        for message in messages:
+            if message["path"] in self._in_flight:
+                logger.debug(f"Deferring {message['path']} until its previous version is stored")
+                self._deferred[message["path"]] = message
+        messages = [message for message in messages if message["path"] not in self._in_flight]
+        if not messages:
+            return
+        statuses = await loop.run_in_executor(
+            executor,
+            MinimaStore.check_needs_indexing_batch,
+            {message["path"]: message["last_updated_seconds"] for message in messages}
+        )
+        for message in messages:
+            indexing_status = statuses[message["path"]]
+            if indexing_status == IndexingStatus.no_need_reindexing:
+                logger.debug(f"Skipping {message['path']}, no indexing required. timestamp didn't change")
+                self.stats.record_file()
+                continue
+            self._in_flight.add(message["path"])
+            # Wait for a free load slot before starting more loads
+            await self._load_slots.acquire()
+            task = asyncio.create_task(self._load(message, indexing_status))
+            self._loads.add(task)
+            task.add_done_callback(self._loads.discard)
+        self.stats.report()
+
+    async def _load(self, message, indexing_status: IndexingStatus):
+        loop = asyncio.get_running_loop()
+        try:
+            prepared = await loop.run_in_executor(executor, self.indexer.prepare, message, indexing_status)
+        except Exception as e:
+            logger.error(f"Error loading {message['path']}: {e}")
+            prepared = None
+        finally:
+            self._load_slots.release()
+        self.stats.record_file()
+        if prepared is None:
+            self._release(message["path"])
+        elif not prepared.documents:
+            await self._finish(prepared)
+            self._release(prepared.path)
+        else:
+            for doc in prepared.documents:
+                self._chunk_files[id(doc)] = prepared
+            self._unstored[prepared.path] = len(prepared.documents)
+            self.batcher.add(prepared.documents, prepared.token_counts)
+            if self.batcher.ready():
+                await self._flush()
+        self.stats.report()
+
+    async def _finish(self, prepared: PreparedFile):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(executor, self.indexer.finish, prepared)
+        except Exception as e:
+            logger.error(f"Failed to finish indexing {prepared.path}: {e}")
+            await loop.run_in_executor(executor, MinimaStore.invalidate, [prepared.path])
+
+    def _release(self, path: str):
+        self._in_flight.discard(path)
+        self._failed.discard(path)
+        message = self._deferred.pop(path, None)
+        if message is not None:
+            self._ready.append(message)
+
+    async def _flush(self):
+        for batch, token_counts in self.batcher.take():
+            await self._embed(batch, token_counts)
+
+    async def _embed(self, batch: List[Document], token_counts: List[int]):
+        loop = asyncio.get_running_loop()
+        prepared_files = [self._chunk_files.pop(id(doc)) for doc in batch]
+        try:
+            ids = await loop.run_in_executor(embed_executor, self.indexer.add_documents, batch, token_counts)
+            self.stats.record_chunks(len(ids))
+            logger.info(f"Embedded and upserted batch of {len(ids)} chunks of up to {token_counts[-1]} tokens")
+        except Exception as e:
+            files = list({doc.metadata.get("file_path") for doc in batch})
+            logger.error(f"Failed to embed batch of {len(batch)} chunks from {files}: {e}")
+            self._failed.update(prepared.path for prepared in prepared_files)
+            # Make sure the next crawl indexes these files again instead of trusting their hashes
+            await loop.run_in_executor(executor, MinimaStore.invalidate, files)
+        for prepared in prepared_files:
+            self._unstored[prepared.path] -= 1
+            if self._unstored[prepared.path] == 0:
+                # Released only now, a new version must not be loaded while old chunks are pending
+                del self._unstored[prepared.path]
+                if prepared.path not in self._failed:
+                    await self._finish(prepared)
+                self._release(prepared.path)
+
+    async def _drain(self):
+        while self._loads or len(self.batcher) or self._ready:
+            if self._ready:
+                ready, self._ready = self._ready, []
+                await self._schedule_files(ready)
+            if self._loads:
+                await asyncio.gather(*self._loads, return_exceptions=True)
+            if len(self.batcher):
+                await self._flush()
+
+
+def _resolve(stop_message: dict):
+    done = stop_message.get("done")
+    if done is not None and not done.done():
+        done.set_result(None)
+
+
+async def index_loop(
+        async_queue,
+        indexer: Indexer,
+        persistent: bool = False,
+        stats: IndexingStats | None = None,
+):
+    """
+    Consume the queue until a stop message arrives. A persistent loop treats stop
+    messages as the end of a crawl and keeps serving watcher events afterwards.
+    """
+    if indexer.config.INDEXING_MODE == "pipelined":
+        await IndexPipeline(async_queue, indexer, persistent=persistent, stats=stats).run()
+    else:
+        await sequential_index_loop(async_queue, indexer, persistent=persistent, stats=stats)
+
+
+async def sequential_index_loop(
+        async_queue,
+        indexer: Indexer,
+        persistent: bool = False,
+        stats: IndexingStats | None = None,
+):
+    stats = stats or IndexingStats(report_interval=indexer.config.INDEX_STATS_INTERVAL)
     loop = asyncio.get_running_loop()
     logger.info("Starting index loop")
     while True:
         if async_queue.size() == 0:
-            logger.info("No files to index. Indexing stopped, all files indexed.")
+            logger.debug("No files to index. Indexing stopped, all files indexed.")
             await asyncio.sleep(1)
             continue
         message = await async_queue.dequeue()
-        logger.info(f"Processing message: {message}")
+        logger.debug(f"Processing message: {message}")
         try:
             if message["type"] == "file":
                 await loop.run_in_executor(executor, indexer.index, message)
+                stats.record_file()
+                stats.report()
+            elif message["type"] == "delete":
+                await loop.run_in_executor(executor, indexer.remove, message)
             elif message["type"] == "all_files":
                 await loop.run_in_executor(executor, indexer.purge, message)
             elif message["type"] == "stop":
-                break
+                stats.report(force=True)
+                _resolve(message)
+                if not persistent:
+                    break
+                stats.reset()
         except Exception as e:
             logger.error(f"Error in processing message: {e}")
             logger.error(f"Failed to process message: {message}")
-        await asyncio.sleep(1)
 
@@ -2,40 +2,116 @@ import asyncio
 
 from collections import deque
 
+# Priority lanes, lower values are dequeued first
+PRIORITY_HIGH = 0  # files touched by users, reported by the file watcher
+PRIORITY_RECENT = 1  # recently modified files found by a crawl
+PRIORITY_BULK = 2  # backfill of everything else
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_RECENT, PRIORITY_BULK)
+
+
 class AsyncQueueDequeueInterrupted(Exception):
-  
+
     def __init__(self, message="AsyncQueue dequeue was interrupted"):
         self.message = message
         super().__init__(self.message)
 
 class AsyncQueue:
+    """
+    Bounded queue of indexing messages with priority lanes.
+
+    Messages carrying a "path" are coalesced: while a message for a path is pending,
+    a newer one for the same path replaces it instead of being queued twice, and it
+    moves to the higher of both priorities. Other messages (aggregates, stop markers)
+    are queued as they are, in order within their lane.
+    """
 
-    def __init__(self):
-        self._data = deque([])
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        # Lane entries are (path, None) for coalescable messages, (None, message) otherwise
+        self._lanes = {priority: deque([]) for priority in PRIORITIES}
+        # path -> (message, priority) of pending coalescable messages
+        self._pending: dict[str, tuple[dict, int]] = {}
+        self._size = 0
         self._presense_of_data = asyncio.Event()
+        self._presense_of_space = asyncio.Event()
+        self._presense_of_space.set()
 
-    def enqueue(self, value):
-        self._data.append(value)
+    @staticmethod
+    def _newest(current: dict, value: dict) -> dict:
+        if current.get("type") == "file" and value.get("type") == "file":
+            if current.get("last_updated_seconds", 0) > value.get("last_updated_seconds", 0):
+                return current
+        return value
 
-        if len(self._data) == 1:
+    def _coalesce(self, path: str, value: dict, priority: int) -> bool:
+        pending = self._pending.get(path)
+        if pending is None:
+            return False
+        current, current_priority = pending
+        if priority < current_priority:
+            # Promote: the entry left in the lower lane is skipped when it is reached
+            self._lanes[priority].append((path, None))
+        self._pending[path] = (self._newest(current, value), min(priority, current_priority))
+        return True
+
+    def enqueue(self, value, priority: int = PRIORITY_BULK):
+        """Add a message without waiting for space, used for control messages and watcher events."""
+        path = value.get("path") if isinstance(value, dict) else None
+        if path is not None:
+            if self._coalesce(path, value, priority):
+                return
+            self._pending[path] = (value, priority)
+            self._lanes[priority].append((path, None))
+        else:
+            self._lanes[priority].append((None, value))
+        self._size += 1
+
+        if self._size == 1:
             self._presense_of_data.set()
+        if self.maxsize and self._size >= self.maxsize:
+            self._presense_of_space.clear()
+
+    async def put(self, value, priority: int = PRIORITY_BULK):
+        """Add a message, waiting while the queue is full. Coalesced messages never wait."""
+        path = value.get("path") if isinstance(value, dict) else None
+        if path is not None and self._coalesce(path, value, priority):
+            return
+        while self.maxsize and self._size >= self.maxsize:
+            await self._presense_of_space.wait()
+        self.enqueue(value, priority)
+
+    def _pop(self):
+        for priority in PRIORITIES:
+            lane = self._lanes[priority]
+            while lane:
+                path, value = lane.popleft()
+                if path is None:
+                    return value
+                pending = self._pending.get(path)
+                if pending is not None and pending[1] == priority:
+                    del self._pending[path]
+                    return pending[0]
+        return None
 
     async def dequeue(self):
         await self._presense_of_data.wait()
 
-        if len(self._data) < 1:
+        if self._size < 1:
             raise AsyncQueueDequeueInterrupted("AsyncQueue was dequeue was interrupted")
 
-        result = self._data.popleft()
+        result = self._pop()
+        self._size -= 1
 
-        if not self._data:
+        if not self._size:
             self._presense_of_data.clear()
+        if not self.maxsize or self._size < self.maxsize:
+            self._presense_of_space.set()
 
         return result
 
     def size(self):
-        result = len(self._data)
+        result = self._size
         return result
 
     def shutdown(self):
-        self._presense_of_data.set()
\ No newline at end of file
+        self._presense_of_data.set()
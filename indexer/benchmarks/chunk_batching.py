@@ -0,0 +1,114 @@
+"""
+Throughput of embedding batches in arrival order versus batches bucketed by token length.
+
+Embeds a mixed corpus (short table rows, sentences and paragraphs longer than the model's
+maximum sequence length, shuffled together as they arrive from many files) twice:
+in fixed-size batches in arrival order, as the indexer did before, and through the
+pipeline's ChunkBatcher, which sorts a window of chunks by token count first. Reports
+chunks/sec and padding overhead (padded tokens / real tokens) of both.
+
+    python benchmarks/chunk_batching.py --backend torch
+    python benchmarks/chunk_batching.py --backend onnx --corpus /usr/src/app/local_files
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_backends import WORDS, create_embeddings
+from async_loop import ChunkBatcher
+from langchain.schema import Document
+
+
+def mixed_corpus(corpus: str | None, limit: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    texts = []
+    if corpus:
+        for root, _, files in os.walk(corpus):
+            for name in files:
+                if name.endswith((".txt", ".md", ".csv")):
+                    with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                        content = f.read()
+                    size = rng.choice([100, 500, 2000])
+                    texts.extend(content[i:i + size] for i in range(0, len(content), size) if content[i:i + size].strip())
+    while len(texts) < limit:
+        # Table rows, sentences, paragraphs
+        words = rng.choice([rng.randint(3, 12), rng.randint(20, 60), rng.randint(150, 400)])
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+    rng.shuffle(texts)
+    return texts[:limit]
+
+
+def tokenizer_of(embeddings):
+    client = getattr(embeddings, "_client", None)
+    if client is not None:
+        return client.tokenizer, client.max_seq_length
+    return embeddings.tokenizer, embeddings.max_seq_length
+
+
+def run(name, embeddings, batches, real_tokens):
+    padded = sum(len(counts) * max(counts) for _, counts in batches)
+    start = time.perf_counter()
+    for texts, _ in batches:
+        embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    chunks = sum(len(texts) for texts, _ in batches)
+    print(
+        f"{name:>9}: {chunks / elapsed:8.1f} chunks/sec  {len(batches)} batches  "
+        f"padding overhead {padded / real_tokens:.2f}x"
+    )
+    return chunks / elapsed
+
+
+def main(args):
+    embeddings = create_embeddings(args.backend, args)
+    tokenizer, max_seq_length = tokenizer_of(embeddings)
+    texts = mixed_corpus(args.corpus, args.limit, args.seed)
+    lengths = [len(ids) for ids in tokenizer(texts, verbose=False)["input_ids"]]
+    # Longer chunks are truncated (or split by the indexer) to the maximum sequence length
+    counts = [min(length, max_seq_length) for length in lengths]
+    real_tokens = sum(counts)
+    print(
+        f"model {args.model}, backend {args.backend}, {len(texts)} chunks, "
+        f"{sum(length > max_seq_length for length in lengths)} longer than {max_seq_length} tokens"
+    )
+
+    # Warm up
+    embeddings.embed_documents(texts[:args.batch_size])
+    arrival = [
+        (texts[i:i + args.batch_size], counts[i:i + args.batch_size])
+        for i in range(0, len(texts), args.batch_size)
+    ]
+    batcher = ChunkBatcher(max_chunks=args.batch_size, max_tokens=args.batch_tokens, window=args.window)
+    bucketed = []
+    documents = [Document(page_content=text) for text in texts]
+    for i in range(0, len(documents), args.batch_size):
+        batcher.add(documents[i:i + args.batch_size], counts[i:i + args.batch_size])
+        if batcher.ready():
+            bucketed.extend(batcher.take())
+    bucketed.extend(batcher.take())
+    bucketed = [([doc.page_content for doc in batch], batch_counts) for batch, batch_counts in bucketed]
+
+    before = run("arrival", embeddings, arrival, real_tokens)
+    after = run("bucketed", embeddings, bucketed, real_tokens)
+    print(f"speedup {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL_ID", "sentence-transformers/all-mpnet-base-v2"))
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=os.environ.get("EMBEDDING_BACKEND", "torch"))
+    parser.add_argument("--corpus", help="folder with .txt/.md/.csv files, synthetic texts are used otherwise")
+    parser.add_argument("--limit", type=int, default=2000, help="number of chunks")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("INDEX_BATCH_SIZE", "64")))
+    parser.add_argument("--batch-tokens", type=int, default=int(os.environ.get("INDEX_BATCH_TOKENS", "16384")))
+    parser.add_argument("--window", type=int, default=int(os.environ.get("INDEX_BUCKET_BATCHES", "8")))
+    parser.add_argument("--quantization", default=os.environ.get("ONNX_QUANTIZATION", "avx2"))
+    parser.add_argument("--onnx-dir", default=os.environ.get("ONNX_MODEL_DIR", "/indexer/storage/onnx"))
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
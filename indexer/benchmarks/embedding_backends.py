@@ -0,0 +1,136 @@
+"""
+Parity check and benchmark of the embedding backends.
+
+Embeds the same texts with the PyTorch model (EMBEDDING_BACKEND=torch) and the int8
+ONNX export (EMBEDDING_BACKEND=onnx), each in its own process so that peak RSS is
+measured per backend. Reports chunks/sec and peak RSS, and the cosine similarity of
+the two vectors of every text. Exits non-zero when the lowest cosine similarity is
+below --threshold, so it can gate a model or backend change.
+
+    python benchmarks/embedding_backends.py --model sentence-transformers/all-mpnet-base-v2
+    python benchmarks/embedding_backends.py --corpus /usr/src/app/local_files --limit 2000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "index query vector document policy release customer report budget schedule "
+    "meeting contract invoice design review latency storage network service model "
+    "quarter revenue incident backup migration cluster deploy feature request"
+).split()
+
+
+def load_texts(corpus: str | None, limit: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    texts = []
+    if corpus:
+        for root, _, files in os.walk(corpus):
+            for name in files:
+                if not name.endswith((".txt", ".md")):
+                    continue
+                with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                    content = f.read()
+                # Roughly the default CHUNK_SIZE
+                texts.extend(content[i:i + 500] for i in range(0, len(content), 500) if content[i:i + 500].strip())
+                if len(texts) >= limit:
+                    return texts[:limit]
+    while len(texts) < limit:
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 120))))
+    return texts
+
+
+def create_embeddings(backend: str, args):
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(
+            model_id=args.model,
+            cache_dir=args.onnx_dir,
+            quantization=args.quantization,
+            intra_op_threads=args.intra_op_threads,
+            inter_op_threads=args.inter_op_threads,
+            batch_size=args.batch_size
+        )
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    if args.intra_op_threads > 0:
+        torch.set_num_threads(args.intra_op_threads)
+    if args.inter_op_threads > 0:
+        torch.set_num_interop_threads(args.inter_op_threads)
+    return HuggingFaceEmbeddings(
+        model_name=args.model,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": False, "batch_size": args.batch_size}
+    )
+
+
+def worker(args):
+    texts = load_texts(args.corpus, args.limit, args.seed)
+    embeddings = create_embeddings(args.worker, args)
+    embeddings.embed_documents(texts[:args.batch_size])
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    np.save(args.out, vectors)
+    # ru_maxrss is in KB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"chunks_per_second": len(texts) / elapsed, "peak_rss_mb": peak_rss_mb}))
+
+
+def main(args):
+    results, vectors = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("torch", "onnx"):
+            out = os.path.join(tmp, f"{backend}.npy")
+            command = [sys.executable, os.path.abspath(__file__), "--worker", backend, "--out", out] + sys.argv[1:]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                sys.exit(f"{backend} backend failed")
+            results[backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+            vectors[backend] = np.load(out)
+
+    a, b = vectors["torch"], vectors["onnx"]
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    print(f"model {args.model}, {len(a)} texts, batch size {args.batch_size}, quantization {args.quantization}")
+    for backend, result in results.items():
+        print(f"{backend:>6}: {result['chunks_per_second']:8.1f} chunks/sec  peak RSS {result['peak_rss_mb']:8.0f} MB")
+    print(
+        f"speedup {results['onnx']['chunks_per_second'] / results['torch']['chunks_per_second']:.2f}x, "
+        f"cosine similarity min {cosine.min():.4f}  p1 {np.percentile(cosine, 1):.4f}  mean {cosine.mean():.4f}"
+    )
+    if cosine.min() < args.threshold:
+        print(f"FAIL: cosine similarity below {args.threshold}")
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL_ID", "sentence-transformers/all-mpnet-base-v2"))
+    parser.add_argument("--corpus", help="folder with .txt/.md files, synthetic texts are used otherwise")
+    parser.add_argument("--limit", type=int, default=1000, help="number of texts")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--quantization", default=os.environ.get("ONNX_QUANTIZATION", "avx2"))
+    parser.add_argument("--onnx-dir", default=os.environ.get("ONNX_MODEL_DIR", "/indexer/storage/onnx"))
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=0.98, help="minimum cosine similarity per text")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.worker:
+        worker(parsed)
+    else:
+        main(parsed)
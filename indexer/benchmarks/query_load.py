@@ -0,0 +1,90 @@
+"""
+Load test for the indexer query endpoints.
+
+Runs a number of concurrent clients against a running indexer, each sending requests
+back to back, and reports throughput and latency percentiles. A client that gets a 503
+counts it as rejected and keeps going. Requires httpx (pip install httpx).
+
+    python benchmarks/query_load.py --url http://localhost:8001 --clients 50 --requests 20
+    python benchmarks/query_load.py --endpoint embedding --clients 50 --requests 20
+
+Compare runs before and after a change with the same query set; with --repeat-queries
+the same few questions are sent over and over, which exercises the embedding cache.
+"""
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+QUERIES = [
+    "How do I configure the indexer?",
+    "What is the refund policy for annual plans?",
+    "Summarize the onboarding checklist",
+    "Which services depend on the payments database?",
+    "Where are the quarterly sales numbers?",
+    "Explain the incident response process",
+    "What changed in the latest release notes?",
+    "Who owns the data retention policy?",
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def client(http, url, endpoint, count, repeat_queries, rng, latencies, statuses):
+    for i in range(count):
+        query = rng.choice(QUERIES[:2] if repeat_queries else QUERIES) + ("" if repeat_queries else f" ({rng.random():.6f})")
+        start = time.perf_counter()
+        try:
+            response = await http.post(f"{url}/{endpoint}", json={"query": query})
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    latencies, statuses = [], {}
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http:
+        # Warm up the model and the connection pool
+        await http.post(f"{args.url}/{args.endpoint}", json={"query": QUERIES[0]})
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client(http, args.url, args.endpoint, args.requests, args.repeat_queries, random.Random(rng.random()), latencies, statuses)
+            for _ in range(args.clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"{args.clients} clients x {args.requests} requests to /{args.endpoint} in {elapsed:.1f} s")
+    print(f"throughput: {total / elapsed:.1f} req/s, statuses: {statuses}")
+    print(
+        f"latency ms: mean {statistics.mean(latencies) * 1000:.0f}  "
+        f"p50 {percentile(latencies, 0.50) * 1000:.0f}  "
+        f"p90 {percentile(latencies, 0.90) * 1000:.0f}  "
+        f"p99 {percentile(latencies, 0.99) * 1000:.0f}  "
+        f"max {latencies[-1] * 1000:.0f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--endpoint", choices=["query", "embedding"], default="query")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--repeat-queries", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for .ragignore matching.
+
+Compares the per-path cost of the previous fnmatch loop (every pattern against every
+path component) with the compiled matcher, for growing pattern sets.
+
+    python benchmarks/ragignore_bench.py --paths 20000 --patterns 10 100 1000
+"""
+import os
+import sys
+import time
+import random
+import fnmatch
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ragignore_utils import RagIgnore  # noqa: E402
+
+
+def legacy_should_ignore_path(path, ignore_patterns):
+    base_name = os.path.basename(path)
+    norm_path = os.path.normpath(path)
+    for pattern in ignore_patterns:
+        if base_name == pattern or fnmatch.fnmatch(base_name, pattern):
+            return True
+        for part in Path(norm_path).parts:
+            if part == pattern or fnmatch.fnmatch(part, pattern):
+                return True
+    return False
+
+
+def make_patterns(count, rng):
+    kinds = [
+        lambda i: f"build{i}",
+        lambda i: f"*.tmp{i}",
+        lambda i: f"cache{i}/",
+        lambda i: f"/docs{i}/private",
+        lambda i: f"**/generated{i}/**",
+        lambda i: f"!keep{i}.md",
+    ]
+    return [rng.choice(kinds)(i) for i in range(count)]
+
+
+def make_paths(count, rng, depth=6):
+    names = [f"dir{i}" for i in range(50)]
+    paths = []
+    for i in range(count):
+        parts = [rng.choice(names) for _ in range(rng.randint(1, depth))]
+        parts.append(f"file{i}.{rng.choice(['md', 'pdf', 'txt', 'tmp3'])}")
+        paths.append("/".join(parts))
+    return paths
+
+
+def measure(fn, paths):
+    start = time.perf_counter()
+    for path in paths:
+        fn(path)
+    return (time.perf_counter() - start) / len(paths) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=int, default=20000)
+    parser.add_argument("--patterns", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    paths = make_paths(args.paths, rng)
+    print(f"{'patterns':>10} {'legacy us/path':>16} {'compiled us/path':>18} {'speedup':>9}")
+    for count in args.patterns:
+        patterns = make_patterns(count, rng)
+        ragignore = RagIgnore("/nonexistent", patterns=patterns)
+        legacy = measure(lambda p: legacy_should_ignore_path(p, patterns), paths)
+        # While walking only the entry itself is checked, ignored parents are never descended into
+        compiled = measure(ragignore.is_ignored, paths)
+        print(f"{count:>10} {legacy:>16.2f} {compiled:>18.2f} {legacy / compiled:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
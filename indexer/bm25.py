@@ -0,0 +1,52 @@
+import re
+import hashlib
+from collections import Counter
+
+from qdrant_client.http.models import SparseVector
+
+# Name of the sparse vector of every point, Qdrant multiplies its values by the IDF of
+# each term (Modifier.IDF), so documents only carry the term frequency part of BM25
+SPARSE_VECTOR_NAME = "bm25"
+
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# Average number of terms per chunk, about what the default CHUNK_SIZE of 500 characters gives
+AVERAGE_LENGTH = 100
+
+# Words, numbers and compounds like ERR-4012, v2.3.1, config.yaml or max_seq_length
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_./:][^\W_]+)*")
+SEPARATOR_PATTERN = re.compile(r"[-_./:]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms of a text; compounds are kept whole and also split into their parts."""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        parts = SEPARATOR_PATTERN.split(term)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def term_index(term: str) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def document_vector(text: str) -> SparseVector:
+    terms = tokenize(text)
+    length_norm = K1 * (1 - B + B * len(terms) / AVERAGE_LENGTH)
+    weights: dict[int, float] = {}
+    for term, frequency in Counter(terms).items():
+        index = term_index(term)
+        # Two terms with the same index add up, as if they were one term
+        weights[index] = weights.get(index, 0.0) + frequency * (K1 + 1) / (frequency + length_norm)
+    return SparseVector(indices=list(weights), values=list(weights.values()))
+
+
+def query_vector(text: str) -> SparseVector:
+    indices = sorted({term_index(term) for term in tokenize(text)})
+    return SparseVector(indices=indices, values=[1.0] * len(indices))
@@ -0,0 +1,164 @@
+from dataclasses import dataclass, replace
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    HnswConfigDiff,
+    Modifier,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SparseVectorParams,
+    VectorParams,
+)
+
+from bm25 import SPARSE_VECTOR_NAME
+
+QUANTIZATION_TYPES = ("none", "scalar", "binary")
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    Storage and search settings of the Qdrant collection. Quantized vectors are kept in
+    RAM and searched first; the best oversampling * k candidates are then rescored
+    with the original float32 vectors, which can stay on disk.
+    """
+    # none, scalar (int8, 4x smaller) or binary (1 bit per dimension, 32x smaller)
+    quantization: str = "none"
+    # Keep float32 vectors and payloads memory-mapped on disk instead of in RAM
+    on_disk_vectors: bool = False
+    on_disk_payload: bool = True
+    # HNSW graph: edges per node and candidates considered while building it
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    # Search: candidates considered (None for Qdrant's default), and how many quantized
+    # candidates per requested result are rescored with the original vectors
+    search_ef: int | None = None
+    oversampling: float | None = None
+    rescore: bool = True
+
+    def __post_init__(self):
+        if self.quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unsupported quantization {self.quantization}, expected one of {QUANTIZATION_TYPES}")
+
+    def vectors_config(self, size: int, distance: Distance = Distance.COSINE) -> VectorParams:
+        return VectorParams(size=size, distance=distance, on_disk=self.on_disk_vectors)
+
+    def hnsw_config(self) -> HnswConfigDiff:
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_config(self) -> ScalarQuantization | BinaryQuantization | None:
+        if self.quantization == "scalar":
+            # The 0.99 quantile keeps outliers from stretching the int8 range
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self) -> SearchParams | None:
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if self.search_ef is None and quantization is None:
+            return None
+        return SearchParams(hnsw_ef=self.search_ef, quantization=quantization)
+
+    def ram_bytes(self, points: int, dimension: int) -> int:
+        """Rough RAM used by the vectors of a collection, without the HNSW graph and payloads."""
+        total = 0 if self.on_disk_vectors else points * dimension * 4
+        if self.quantization == "scalar":
+            total += points * dimension
+        elif self.quantization == "binary":
+            total += points * dimension // 8
+        return total
+
+
+PROFILES = {
+    # float32 vectors in RAM and payloads on disk, Qdrant's defaults and how collections
+    # were created before profiles
+    "default": CollectionProfile(),
+    # float32 vectors memory-mapped from disk, for collections larger than RAM
+    "on_disk": CollectionProfile(on_disk_vectors=True),
+    # int8 vectors in RAM, originals on disk for rescoring, about 4x less memory
+    "scalar": CollectionProfile(quantization="scalar", on_disk_vectors=True, oversampling=2.0),
+    # 1 bit per dimension in RAM, about 32x less memory; needs more rescoring and works best
+    # with models of 768 or more dimensions
+    "binary": CollectionProfile(quantization="binary", on_disk_vectors=True, oversampling=3.0),
+}
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() == "true"
+
+
+# How the environment overrides of each setting are parsed
+_PARSERS = {
+    "quantization": str.lower,
+    "on_disk_vectors": _parse_bool,
+    "on_disk_payload": _parse_bool,
+    "hnsw_m": int,
+    "hnsw_ef_construct": int,
+    "search_ef": int,
+    "oversampling": float,
+    "rescore": _parse_bool,
+}
+
+
+def resolve_profile(name: str, **overrides: str) -> CollectionProfile:
+    """
+    Look up a profile by name and override single settings with the given environment
+    strings, empty strings keep the profile's value.
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Unknown collection profile {name}, expected one of {list(PROFILES)}")
+    values = {key: _PARSERS[key](value) for key, value in overrides.items() if value != ""}
+    return replace(PROFILES[name], **values)
+
+
+def create_collection(
+        qdrant: QdrantClient,
+        name: str,
+        size: int,
+        profile: CollectionProfile,
+        distance: Distance = Distance.COSINE,
+        sparse: bool = False,
+):
+    """Create a collection with the profile, with the BM25 sparse vector when sparse is set."""
+    qdrant.create_collection(
+        collection_name=name,
+        vectors_config=profile.vectors_config(size, distance),
+        # Qdrant computes the IDF of every term from the collection at query time, so
+        # keyword scores stay correct as documents are added and deleted
+        sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)} if sparse else None,
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config(),
+        on_disk_payload=profile.on_disk_payload,
+    )
+
+
+def describe_mismatch(qdrant: QdrantClient, name: str, profile: CollectionProfile) -> list[str]:
+    """Settings of an existing collection that differ from the profile."""
+    config = qdrant.get_collection(name).config
+    vectors = config.params.vectors
+    quantization = "none"
+    if isinstance(config.quantization_config, ScalarQuantization):
+        quantization = "scalar"
+    elif isinstance(config.quantization_config, BinaryQuantization):
+        quantization = "binary"
+    actual = {
+        "quantization": quantization,
+        "on_disk_vectors": bool(getattr(vectors, "on_disk", False)),
+        "on_disk_payload": bool(config.params.on_disk_payload),
+        "hnsw_m": config.hnsw_config.m,
+        "hnsw_ef_construct": config.hnsw_config.ef_construct,
+    }
+    return [
+        f"{key}={value} (profile: {getattr(profile, key)})"
+        for key, value in actual.items()
+        if value != getattr(profile, key)
+    ]
@@ -0,0 +1,117 @@
+"""
+Remove orphaned points from the Qdrant collection.
+
+Earlier versions deleted chunks by a payload key that was never written, so purged
+and re-indexed files left their old vectors behind. This one-off command scans the
+collection and deletes every point that does not belong to the current index:
+
+- points of files that are no longer in the indexer store
+- points of indexed files whose id is not one of the file's current chunk ids
+- all points of files indexed before chunk hashes were tracked; those files are
+  marked for re-indexing by the next crawl
+
+Stop the indexer first, chunks stored by a crawl running at the same time could be
+deleted as orphans. Then run it in a one-off container of the indexer service:
+
+    docker compose run --rm indexer python compact.py [--dry-run]
+"""
+import json
+import logging
+import argparse
+from functools import lru_cache
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import FieldCondition, Filter, MatchAny, PointIdsList
+
+from storage import MinimaStore
+from indexer import Config, Indexer, DELETE_BATCH_SIZE, FILE_PATH_KEY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCROLL_PAGE_SIZE = 1000
+
+
+def compact(dry_run: bool = False) -> dict[str, int]:
+    config = Config()
+    qdrant = QdrantClient(host=config.QDRANT_BOOTSTRAP, port=config.QDRANT_PORT)
+    stored = MinimaStore.select_chunk_hashes()
+    logger.info(f"{len(stored)} files in the indexer store")
+
+    @lru_cache(maxsize=4096)
+    def expected_ids(path: str) -> frozenset[str]:
+        return frozenset(Indexer.point_id(path, chunk_hash) for chunk_hash in json.loads(stored[path]))
+
+    counts = {"scanned": 0, "removed_files": 0, "stale_chunks": 0, "missing_path": 0}
+    legacy_paths: set[str] = set()
+    orphans: list = []
+
+    def flush():
+        if orphans and not dry_run:
+            qdrant.delete(
+                collection_name=config.QDRANT_COLLECTION,
+                points_selector=PointIdsList(points=list(orphans)),
+                wait=True
+            )
+        orphans.clear()
+
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=config.QDRANT_COLLECTION,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=[FILE_PATH_KEY],
+            with_vectors=False
+        )
+        for point in points:
+            counts["scanned"] += 1
+            path = (point.payload or {}).get("metadata", {}).get("file_path")
+            if path is None:
+                counts["missing_path"] += 1
+                orphans.append(point.id)
+            elif path not in stored:
+                counts["removed_files"] += 1
+                orphans.append(point.id)
+            elif stored[path] is None:
+                legacy_paths.add(path)
+            elif str(point.id) not in expected_ids(path):
+                counts["stale_chunks"] += 1
+                orphans.append(point.id)
+        # Deleting already scanned points does not move the scroll offset, which is a point id
+        if len(orphans) >= DELETE_BATCH_SIZE:
+            flush()
+        if offset is None:
+            break
+        logger.info(f"Scanned {counts['scanned']} points")
+    flush()
+
+    counts["legacy_files"] = len(legacy_paths)
+    if legacy_paths and not dry_run:
+        # Their point ids are random, so duplicates left by re-indexing cannot be told apart
+        paths = sorted(legacy_paths)
+        for start in range(0, len(paths), DELETE_BATCH_SIZE):
+            qdrant.delete(
+                collection_name=config.QDRANT_COLLECTION,
+                points_selector=Filter(
+                    must=[FieldCondition(key=FILE_PATH_KEY, match=MatchAny(any=paths[start:start + DELETE_BATCH_SIZE]))]
+                ),
+                wait=True
+            )
+        MinimaStore.invalidate(paths)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove orphaned points from the Qdrant collection")
+    parser.add_argument("--dry-run", action="store_true", help="only count the points that would be removed")
+    args = parser.parse_args()
+    MinimaStore.create_db_and_tables()
+    result = compact(dry_run=args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    logger.info(
+        f"{action} {result['removed_files']} points of deleted files, {result['stale_chunks']} stale chunks "
+        f"and {result['missing_path']} points without a file path out of {result['scanned']} points. "
+        f"{result['legacy_files']} files indexed without chunk hashes were "
+        f"{'found' if args.dry_run else 'cleared and marked for re-indexing'}."
+    )
@@ -0,0 +1,150 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator
+from ragignore_utils import RAGIGNORE_FILE_NAME, RagIgnore
+
+logger = logging.getLogger(__name__)
+
+CRAWL_WORKERS = int(os.environ.get("CRAWL_WORKERS", "8"))
+CRAWL_SNAPSHOT_PATH = os.environ.get("CRAWL_SNAPSHOT_PATH", "/indexer/storage/crawl_snapshot.json")
+# Reuse the cached listing of directories whose mtime did not change, which only changes
+# when entries are added, removed or renamed. Files are still stat'ed on every crawl,
+# because editing a file in place does not change its directory's mtime.
+CRAWL_TRUST_DIR_MTIME = os.environ.get("CRAWL_TRUST_DIR_MTIME", "true").lower() == "true"
+
+SNAPSHOT_VERSION = 2
+
+
+@dataclass
+class DirSnapshot:
+    mtime_ns: int
+    # file name -> mtime in seconds, only files with a supported extension
+    files: dict[str, int] = field(default_factory=dict)
+    # names of all subdirectories, ignore patterns are applied while walking
+    dirs: list[str] = field(default_factory=list)
+    has_ragignore: bool = False
+
+
+class StatSnapshot:
+    """Stat results of a crawl, keyed by directory path relative to the crawl root."""
+
+    def __init__(self, root: str, dirs: dict[str, DirSnapshot] | None = None):
+        self.root = root
+        self.dirs: dict[str, DirSnapshot] = dirs or {}
+
+    def files(self) -> Iterator[tuple[str, str, int]]:
+        """Yield (path, path relative to the root, mtime) for every file in the snapshot."""
+        for rel_dir, entry in self.dirs.items():
+            for name, mtime in entry.files.items():
+                rel_path = os.path.join(rel_dir, name)
+                yield os.path.join(self.root, rel_path), rel_path, mtime
+
+    def mtime(self, path: str) -> int | None:
+        rel_dir, name = os.path.split(os.path.relpath(path, self.root))
+        entry = self.dirs.get(rel_dir)
+        return entry.files.get(name) if entry else None
+
+    @staticmethod
+    def load(path: str, root: str) -> "StatSnapshot | None":
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable crawl snapshot {path}: {e}")
+            return None
+        if data.get("version") != SNAPSHOT_VERSION or data.get("root") != root:
+            logger.info(f"Crawl snapshot {path} is outdated, starting from scratch")
+            return None
+        dirs = {
+            rel_dir: DirSnapshot(mtime_ns=mtime_ns, files=files, dirs=subdirs, has_ragignore=has_ragignore)
+            for rel_dir, (mtime_ns, files, subdirs, has_ragignore) in data["dirs"].items()
+        }
+        return StatSnapshot(root, dirs)
+
+    def save(self, path: str):
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "root": self.root,
+            "dirs": {
+                rel_dir: [entry.mtime_ns, entry.files, entry.dirs, entry.has_ragignore]
+                for rel_dir, entry in self.dirs.items()
+            }
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+def _restat_files(dir_path: str, previous: DirSnapshot) -> DirSnapshot:
+    """The previous listing of an unchanged directory, with the current mtime of every file."""
+    entry = DirSnapshot(mtime_ns=previous.mtime_ns, dirs=previous.dirs, has_ragignore=previous.has_ragignore)
+    for name in previous.files:
+        try:
+            entry.files[name] = round(os.stat(os.path.join(dir_path, name)).st_mtime)
+        except FileNotFoundError:
+            # Deleted after the directory was stat'ed, the next crawl lists it again
+            continue
+    return entry
+
+
+def _scan_dir(root: str, rel_dir: str, previous: DirSnapshot | None, extensions: list[str]) -> DirSnapshot | None:
+    dir_path = os.path.join(root, rel_dir)
+    try:
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        if CRAWL_TRUST_DIR_MTIME and previous is not None and previous.mtime_ns == mtime_ns:
+            return _restat_files(dir_path, previous)
+        entry = DirSnapshot(mtime_ns=mtime_ns)
+        with os.scandir(dir_path) as it:
+            for dir_entry in it:
+                if dir_entry.is_dir(follow_symlinks=False):
+                    entry.dirs.append(dir_entry.name)
+                elif dir_entry.name == RAGIGNORE_FILE_NAME:
+                    entry.has_ragignore = True
+                elif any(dir_entry.name.endswith(ext) for ext in extensions) and dir_entry.is_file():
+                    # DirEntry caches the stat result, so no separate getmtime call is needed
+                    entry.files[dir_entry.name] = round(dir_entry.stat().st_mtime)
+        return entry
+    except OSError as e:
+        logger.warning(f"Unable to scan {dir_path}: {e}")
+        return None
+
+
+def scan_tree(
+        root: str,
+        ragignore: RagIgnore,
+        extensions: list[str],
+        previous: StatSnapshot | None = None,
+        workers: int = CRAWL_WORKERS,
+) -> StatSnapshot:
+    """
+    Walk the tree below root with parallel os.scandir workers, one task per directory.
+    Ignored directories are not descended into, nested .ragignore files are loaded into
+    ragignore as their directories are scanned.
+    """
+    snapshot = StatSnapshot(root)
+    previous_dirs = previous.dirs if previous else {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, root, "", previous_dirs.get(""), extensions): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                entry = future.result()
+                if entry is None:
+                    continue
+                snapshot.dirs[rel_dir] = entry
+                if entry.has_ragignore and rel_dir:
+                    ragignore.load_nested(rel_dir)
+                for name in entry.dirs:
+                    child = os.path.join(rel_dir, name)
+                    # Ancestors were already checked before being descended into
+                    if ragignore.is_ignored(child, is_dir=True):
+                        continue
+                    pending[pool.submit(_scan_dir, root, child, previous_dirs.get(child), extensions)] = child
+    return snapshot
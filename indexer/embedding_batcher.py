@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into batched model calls.
+
+    Texts are collected until max_batch_size are waiting or the oldest has waited
+    max_wait_ms, then embedded with a single embed_many call in executor. Every caller
+    gets its own vector back; identical texts within a batch are embedded once.
+    """
+
+    def __init__(
+            self,
+            embed_many: Callable[[List[str]], List[List[float]]],
+            executor: Executor,
+            max_wait_ms: float,
+            max_batch_size: int,
+    ):
+        self.embed_many = embed_many
+        self.executor = executor
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running: set[asyncio.Task] = set()
+        self.batches = 0
+        self.texts = 0
+        self.batch_sizes: Counter[int] = Counter()
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size or self.max_wait_ms <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            # Requests cancelled while waiting (client went away) are not embedded
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if batch:
+                task = asyncio.ensure_future(self._run(batch))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.texts += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.embed_many, texts)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> dict:
+        return {
+            "max_wait_ms": self.max_wait_ms,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": max(self.batch_sizes, default=0),
+            # batch size -> number of batches of that size
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
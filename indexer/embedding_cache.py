@@ -0,0 +1,159 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry overhead of the key, OrderedDict node and bytes object
+ENTRY_OVERHEAD_BYTES = 200
+# The disk cache is trimmed to its maximum size once every this many writes
+DISK_TRIM_INTERVAL = 1000
+
+
+class EmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (model id, normalized text), bounded by entry
+    count and by bytes. The model id names the model, backend and quantization that made
+    the vectors. Vectors are kept as float32 bytes. With a path, entries are also written
+    to an SQLite file so they survive restarts; that file is cleared when it was written
+    for a different model id.
+    """
+
+    def __init__(self, model_id: str, max_entries: int, max_bytes: int, path: str | None = None, max_disk_entries: int = 0):
+        self.model_id = model_id or ""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self._entries: OrderedDict[bytes, bytes] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._disk_writes = 0
+        self._disk = self._open_disk(path) if path and max_entries > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # Case is kept, cased models embed "Apple" and "apple" differently
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_id}\0{self.normalize(text)}".encode("utf-8"), digest_size=16).digest()
+
+    def _open_disk(self, path: str) -> sqlite3.Connection | None:
+        try:
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            row = connection.execute("SELECT value FROM meta WHERE name = 'model_id'").fetchone()
+            if row is None or row[0] != self.model_id:
+                if row is not None:
+                    logger.info(f"Embedding model changed from {row[0]} to {self.model_id}, clearing {path}")
+                connection.execute("DELETE FROM embeddings")
+                connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('model_id', ?)", (self.model_id,))
+            connection.commit()
+            return connection
+        except sqlite3.Error as e:
+            logger.error(f"Unable to open embedding cache {path}, using memory only: {e}")
+            return None
+
+    def _remember(self, key: bytes, vector: bytes):
+        """Insert into the in-memory LRU, caller holds the lock."""
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous) + ENTRY_OVERHEAD_BYTES
+        self._entries[key] = vector
+        self._bytes += len(vector) + ENTRY_OVERHEAD_BYTES
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted) + ENTRY_OVERHEAD_BYTES
+
+    def get(self, text: str) -> List[float] | None:
+        if not self.enabled:
+            return None
+        key = self._key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            elif self._disk is not None:
+                row = self._disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = row[0]
+                    self.disk_hits += 1
+                    self._disk.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._disk.commit()
+                    self._remember(key, vector)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return array("f", vector).tolist()
+
+    def put(self, text: str, embedding: List[float]):
+        if not self.enabled:
+            return
+        key = self._key(text)
+        vector = array("f", embedding).tobytes()
+        with self._lock:
+            self._remember(key, vector)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    (key, vector, time.time())
+                )
+                self._disk_writes += 1
+                if self.max_disk_entries > 0 and self._disk_writes % DISK_TRIM_INTERVAL == 0:
+                    self._disk.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+                self._disk.commit()
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        embedding = self.get(text)
+        if embedding is None:
+            embedding = compute(text)
+            self.put(text, embedding)
+        return embedding
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM embeddings")
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "model_id": self.model_id,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._disk is not None,
+            }
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from async_loop import CONTAINER_PATH, executor, is_indexable
+from async_queue import AsyncQueue, PRIORITY_HIGH
+from ragignore_utils import RAGIGNORE_FILE_NAME, RagIgnore
+
+logger = logging.getLogger(__name__)
+
+# "inotify" uses native filesystem events, "polling" periodically stats the tree
+# (for network shares where inotify does not work), "off" disables watching
+WATCH_MODE = os.environ.get("WATCH_MODE", "inotify").lower()
+# Events for the same path within this window are collapsed into one indexing request
+WATCH_DEBOUNCE_SECONDS = float(os.environ.get("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_POLL_INTERVAL = int(os.environ.get("WATCH_POLL_INTERVAL", "60"))
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+class _ForwardingEventHandler(FileSystemEventHandler):
+    """Hands watchdog events, which arrive on the observer thread, over to the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, callback):
+        self.loop = loop
+        self.callback = callback
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        self.loop.call_soon_threadsafe(self.callback, event)
+
+
+class FileWatcher:
+    """
+    Watches CONTAINER_PATH and enqueues only created, modified, deleted or moved paths.
+    Bursts of events for the same path are debounced into a single message.
+    """
+
+    def __init__(self, async_queue: AsyncQueue, root: str = CONTAINER_PATH):
+        self.async_queue = async_queue
+        self.root = root
+        self.ragignore = RagIgnore(root)
+        self._pending: dict[str, tuple[str, bool, float]] = {}
+        self._observer = None
+
+    def _start_observer(self, loop: asyncio.AbstractEventLoop):
+        handler = _ForwardingEventHandler(loop, self._on_event)
+        if WATCH_MODE == "inotify":
+            try:
+                observer = Observer()
+                observer.schedule(handler, self.root, recursive=True)
+                observer.start()
+                self._observer = observer
+                logger.info(f"Watching {self.root} for file changes")
+                return
+            except OSError as e:
+                logger.warning(f"Native file watching unavailable ({e}), falling back to polling")
+        observer = PollingObserver(timeout=WATCH_POLL_INTERVAL)
+        observer.schedule(handler, self.root, recursive=True)
+        observer.start()
+        self._observer = observer
+        logger.info(f"Polling {self.root} for file changes every {WATCH_POLL_INTERVAL} seconds")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _record(self, path: str, action: str, is_directory: bool):
+        self._pending[path] = (action, is_directory, time.monotonic())
+
+    def _on_event(self, event: FileSystemEvent):
+        if event.is_directory and event.event_type in ("modified", "closed"):
+            # Directory modifications are followed by events for the entries themselves
+            return
+        if RAGIGNORE_FILE_NAME in (os.path.basename(event.src_path), os.path.basename(getattr(event, "dest_path", ""))):
+            self.ragignore = RagIgnore(self.root)
+        if event.event_type == "moved":
+            self._record(event.src_path, DELETE, event.is_directory)
+            self._record(event.dest_path, UPSERT, event.is_directory)
+        elif event.event_type == "deleted":
+            self._record(event.src_path, DELETE, event.is_directory)
+        else:
+            self._record(event.src_path, UPSERT, event.is_directory)
+
+    def _take_settled(self) -> list[tuple[str, str, bool]]:
+        """Pop paths that have seen no new events for the debounce window."""
+        now = time.monotonic()
+        settled = [
+            (path, action, is_directory)
+            for path, (action, is_directory, last_seen) in self._pending.items()
+            if now - last_seen >= WATCH_DEBOUNCE_SECONDS
+        ]
+        for path, _, _ in settled:
+            del self._pending[path]
+        return settled
+
+    def _file_message(self, path: str) -> dict | None:
+        if not is_indexable(path, self.ragignore):
+            return None
+        try:
+            last_updated_seconds = round(os.path.getmtime(path))
+        except FileNotFoundError:
+            return {"path": path, "type": "delete"}
+        return {
+            "path": path,
+            "file_id": str(uuid.uuid4()),
+            "last_updated_seconds": last_updated_seconds,
+            "type": "file"
+        }
+
+    def _build_messages(self, settled: list[tuple[str, str, bool]]) -> list[dict]:
+        messages = []
+        for path, action, is_directory in settled:
+            if action == DELETE:
+                messages.append({"path": path, "type": "delete"})
+            elif is_directory:
+                # Files created before the new directory was watched produce no events
+                for root, _, files in os.walk(path):
+                    for file in files:
+                        message = self._file_message(os.path.join(root, file))
+                        if message:
+                            messages.append(message)
+            else:
+                message = self._file_message(path)
+                if message:
+                    messages.append(message)
+        return messages
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._start_observer(loop)
+        try:
+            while True:
+                await asyncio.sleep(max(WATCH_DEBOUNCE_SECONDS / 2, 0.1))
+                settled = self._take_settled()
+                if not settled:
+                    continue
+                messages = await loop.run_in_executor(executor, self._build_messages, settled)
+                for message in messages:
+                    # Changes made by users skip ahead of any crawl backlog and never wait for space
+                    self.async_queue.enqueue(message, PRIORITY_HIGH)
+                    logger.info(f"Change detected, enqueued {message['type']} for {message['path']}")
+        finally:
+            self.stop()
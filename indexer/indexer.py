@@ -1,107 +1,53 @@
 import os
+import copy
 import uuid
+import hashlib
 import torch
 import logging
 import time
-from datetime import datetime
-import yaml
-from dataclasses import dataclass
-from typing import List, Dict
-from pathlib import Path
-
-from qdrant_client import QdrantClient
-from langchain_qdrant import QdrantVectorStore
+import queue
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from typing import Iterator, List, Dict
+from pathlib import Path, PurePosixPath
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from langchain_huggingface import HuggingFaceEmbeddings
-from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue
+from langchain_core.embeddings import Embeddings
+from qdrant_client.http.models import (
+    Filter, FieldCondition, Fusion, FusionQuery, MatchAny, MatchValue, PointIdsList, PointStruct, Prefetch,
+    SetPayload, SetPayloadOperation
+)
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders.text import TextLoader
 from langchain.schema import Document
+from pebble import ProcessPool, ProcessExpired
 
-from langchain_community.document_loaders import (
-    TextLoader,
-    CSVLoader,
-    Docx2txtLoader,
-    UnstructuredExcelLoader,
-    PyMuPDFLoader,
-    UnstructuredPowerPointLoader,
-)
-
+import bm25
 from storage import MinimaStore, IndexingStatus
+from embedding_cache import EmbeddingCache
+from collection_profile import CollectionProfile, create_collection, describe_mismatch, resolve_profile
+from embedding_batcher import EmbeddingBatcher
+from parsing import EXTENSIONS_TO_LOADERS, init_worker, iter_chunk_batches, parse_file, stream_file
 
 logger = logging.getLogger(__name__)
 
+# Namespace for deterministic Qdrant point ids derived from file path and chunk hash
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2f8e-3a0b-5d4e-9b7a-2c8d1e4f5a6b")
+# Payload key of the source file path, document metadata is nested under "metadata"
+FILE_PATH_KEY = "metadata.file_path"
+# Every directory above the file and its extension, so searches can be limited to a
+# folder or file type with an indexed match instead of a prefix scan
+PARENTS_KEY = "metadata.parents"
+EXTENSION_KEY = "metadata.extension"
+KEYWORD_INDEXES = (FILE_PATH_KEY, PARENTS_KEY, EXTENSION_KEY)
+# Maximum number of paths or point ids per delete or payload update request
+DELETE_BATCH_SIZE = 512
 
-class MinimaTextLoader(TextLoader):
-    """Custom loader for Markdown files that extracts YAML frontmatter."""
-    
-    def __init__(self, file_path: str, **kwargs):
-        super().__init__(file_path, **kwargs)
-    
-    def _parse_frontmatter(self, content: str) -> tuple[dict, str]:
-        """Extract and parse YAML frontmatter from content."""
-        if not content.startswith('---\n'):
-            return {}, content
-            
-        # Find the end of frontmatter
-        parts = content.split('---\n', 2)
-        if len(parts) < 3:
-            return {}, content
-            
-        try:
-            frontmatter = yaml.safe_load(parts[1])
-            if not isinstance(frontmatter, dict):
-                return {}, content
-                
-            # Clean metadata dictionary
-            cleaned_frontmatter = {}
-            
-            # Handle dates specially
-            for key in ['created', 'updated']:
-                if key in frontmatter and frontmatter[key]:
-                    try:
-                        dt = datetime.fromisoformat(str(frontmatter[key]).replace(' ', 'T'))
-                        cleaned_frontmatter[key] = dt.isoformat()
-                    except ValueError:
-                        pass
-            
-            # Handle all other fields
-            for key, value in frontmatter.items():
-                if key not in ['created', 'updated']:  # Skip dates as we handled them above
-                    if value not in [None, '', [], {}]:  # Skip empty/null values
-                        cleaned_frontmatter[key] = value
-            
-            return cleaned_frontmatter, parts[2]
-        except yaml.YAMLError:
-            return {}, content
-    
-    def load(self) -> List[Document]:
-        """Load and process the file."""
-        with open(self.file_path, encoding=self.encoding) as f:
-            content = f.read()
-        
-        if self.file_path.endswith('.md'):
-            metadata, content = self._parse_frontmatter(content)
-        else:
-            metadata = {}
-            
-        metadata['file_path'] = self.file_path
-        
-        return [Document(page_content=content, metadata=metadata)]
 
 @dataclass
 class Config:
-    EXTENSIONS_TO_LOADERS = {
-        ".pdf": PyMuPDFLoader,
-        ".pptx": UnstructuredPowerPointLoader,
-        ".ppt": UnstructuredPowerPointLoader,
-        ".xls": UnstructuredExcelLoader,
-        ".xlsx": UnstructuredExcelLoader,
-        ".docx": Docx2txtLoader,
-        ".doc": Docx2txtLoader,
-        ".txt": TextLoader,
-        ".md": MinimaTextLoader,
-        ".csv": CSVLoader,
-    }
+    EXTENSIONS_TO_LOADERS = EXTENSIONS_TO_LOADERS
     
     DEVICE = torch.device(
         "mps" if torch.backends.mps.is_available() else
@@ -117,6 +63,58 @@ class Config:
     QDRANT_PORT = int(os.environ.get("REMOTE_QDRANT_PORT", "6333"))
     EMBEDDING_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID")
     EMBEDDING_SIZE = os.environ.get("EMBEDDING_SIZE")
+
+    # Qdrant collection configuration
+    # Storage and search profile: default, on_disk, scalar or binary (see collection_profile.py).
+    # The settings below override single values of the profile, empty keeps the profile's
+    QDRANT_PROFILE = os.environ.get("QDRANT_PROFILE", "default").lower()
+    QDRANT_QUANTIZATION = os.environ.get("QDRANT_QUANTIZATION", "")
+    QDRANT_ON_DISK_VECTORS = os.environ.get("QDRANT_ON_DISK_VECTORS", "")
+    QDRANT_ON_DISK_PAYLOAD = os.environ.get("QDRANT_ON_DISK_PAYLOAD", "")
+    QDRANT_HNSW_M = os.environ.get("QDRANT_HNSW_M", "")
+    QDRANT_HNSW_EF_CONSTRUCT = os.environ.get("QDRANT_HNSW_EF_CONSTRUCT", "")
+    QDRANT_SEARCH_EF = os.environ.get("QDRANT_SEARCH_EF", "")
+    QDRANT_OVERSAMPLING = os.environ.get("QDRANT_OVERSAMPLING", "")
+    QDRANT_RESCORE = os.environ.get("QDRANT_RESCORE", "")
+
+    def collection_profile(self) -> CollectionProfile:
+        return resolve_profile(
+            self.QDRANT_PROFILE,
+            quantization=self.QDRANT_QUANTIZATION,
+            on_disk_vectors=self.QDRANT_ON_DISK_VECTORS,
+            on_disk_payload=self.QDRANT_ON_DISK_PAYLOAD,
+            hnsw_m=self.QDRANT_HNSW_M,
+            hnsw_ef_construct=self.QDRANT_HNSW_EF_CONSTRUCT,
+            search_ef=self.QDRANT_SEARCH_EF,
+            oversampling=self.QDRANT_OVERSAMPLING,
+            rescore=self.QDRANT_RESCORE
+        )
+
+    def embedding_identity(self) -> str:
+        # The same model gives slightly different vectors per backend and quantization
+        return f"{self.EMBEDDING_MODEL_ID}|{self.EMBEDDING_BACKEND}|{self.ONNX_QUANTIZATION}"
+
+    # Retrieval configuration
+    # "hybrid" fuses dense vector search with a BM25 keyword index, which finds exact
+    # identifiers, error codes and acronyms, "dense" only uses the embeddings
+    RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid").lower()
+    # How dense and keyword results are merged: "rrf" (reciprocal rank fusion) or "dbsf"
+    # (scores normalized per result list and summed)
+    HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "rrf").lower()
+    # Candidates taken from each of the dense and keyword searches before fusion
+    HYBRID_PREFETCH_LIMIT = int(os.environ.get("HYBRID_PREFETCH_LIMIT", "20"))
+
+    # Embedding backend configuration
+    # "torch" runs the full precision sentence-transformers model, "onnx" an int8
+    # quantized ONNX Runtime export of the same model (CPU only)
+    EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+    # Instruction set the int8 model is quantized for: avx2, avx512, avx512_vnni or arm64
+    ONNX_QUANTIZATION = os.environ.get("ONNX_QUANTIZATION", "avx2").lower()
+    ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "/indexer/storage/onnx")
+    # Threads used inside a single operator and across independent operators of the
+    # graph, 0 keeps the library default
+    EMBEDDING_INTRA_OP_THREADS = int(os.environ.get("EMBEDDING_INTRA_OP_THREADS", "0"))
+    EMBEDDING_INTER_OP_THREADS = int(os.environ.get("EMBEDDING_INTER_OP_THREADS", "0"))
     
     # Chunking configuration
     CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "500"))
@@ -130,13 +128,103 @@ class Config:
     PDF_CHUNK_SIZE = int(os.environ.get("PDF_CHUNK_SIZE", str(CHUNK_SIZE)))
     DOC_CHUNK_SIZE = int(os.environ.get("DOC_CHUNK_SIZE", str(CHUNK_SIZE)))
 
+    # Indexing pipeline configuration
+    # "pipelined" packs chunks from many files into shared embedding batches,
+    # "sequential" indexes one file per executor call
+    INDEXING_MODE = os.environ.get("INDEXING_MODE", "pipelined").lower()
+    # Number of files loaded and chunked concurrently, at least one per parser process
+    INDEX_LOAD_CONCURRENCY = int(os.environ.get("INDEX_LOAD_CONCURRENCY", str(max(4, os.cpu_count() or 1))))
+    # Maximum number of chunks per embedding batch
+    INDEX_BATCH_SIZE = int(os.environ.get("INDEX_BATCH_SIZE", "64"))
+    # Maximum number of tokens per embedding batch, counting padding
+    INDEX_BATCH_TOKENS = int(os.environ.get("INDEX_BATCH_TOKENS", "16384"))
+    # Chunks are buffered until this many batches worth have arrived, then sorted by
+    # token count so that every batch holds chunks of similar length
+    INDEX_BUCKET_BATCHES = int(os.environ.get("INDEX_BUCKET_BATCHES", "8"))
+    # What to do with chunks longer than the model's maximum sequence length, which the
+    # model would silently truncate: "split" them at token boundaries or only "warn"
+    OVERSIZED_CHUNKS = os.environ.get("OVERSIZED_CHUNKS", "split").lower()
+    # How often (in seconds) indexing throughput is reported
+    INDEX_STATS_INTERVAL = int(os.environ.get("INDEX_STATS_INTERVAL", "30"))
+
+    # Document parsing configuration
+    # Number of parser processes, 0 parses in the indexing threads instead
+    PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+    # Parsing a single file is aborted, and its worker killed, after this many seconds
+    PARSE_TIMEOUT_SECONDS = int(os.environ.get("PARSE_TIMEOUT_SECONDS", "300"))
+    # Address space limit per parser process in MB, 0 disables the limit
+    PARSE_MEMORY_LIMIT_MB = int(os.environ.get("PARSE_MEMORY_LIMIT_MB", "4096"))
+    # Parser processes are replaced after this many files to release leaked memory
+    PARSE_MAX_TASKS_PER_WORKER = int(os.environ.get("PARSE_MAX_TASKS_PER_WORKER", "100"))
+    # Files of at least this size are loaded, chunked, embedded and upserted batch by
+    # batch instead of being loaded into memory at once
+    STREAM_THRESHOLD_MB = int(os.environ.get("STREAM_THRESHOLD_MB", "32"))
+
+    # Query embedding cache configuration
+    # Maximum number of cached query embeddings, 0 disables the cache
+    EMBEDDING_CACHE_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_ENTRIES", "10000"))
+    EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "64"))
+    # SQLite file that keeps cached embeddings across restarts, empty for memory only
+    EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")
+    EMBEDDING_CACHE_DISK_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_DISK_ENTRIES", "100000"))
+
+@dataclass
+class PreparedFile:
+    """
+    New chunks of a file that still have to be embedded, and what is recorded once all of
+    them are stored. Until then the store keeps the previous hashes, so a file whose
+    chunks never made it to Qdrant is indexed again by the next crawl.
+    """
+    path: str
+    documents: List[Document]
+    content_hash: str
+    chunk_hashes: List[str]
+    # Token counts of the documents, in the same order, for the batcher
+    token_counts: List[int] = field(default_factory=list)
+    # Points of chunks that are no longer in the file
+    removed_ids: List[str] = field(default_factory=list)
+    # Metadata of the chunks that are already stored, by point id, whose position in the
+    # file may have moved
+    unchanged_metadata: Dict[str, dict] = field(default_factory=dict)
+
+
 class Indexer:
     def __init__(self):
         self.config = Config()
+        self.collection_profile = self.config.collection_profile()
         self.qdrant = self._initialize_qdrant()
+        self.async_qdrant = self._initialize_async_qdrant()
         self.embed_model = self._initialize_embeddings()
-        self.document_store = self._setup_collection()
+        self.max_seq_length = self._initialize_max_seq_length()
+        # Chunks are counted from the loading threads while the embedding thread uses the
+        # model's tokenizer, a fast tokenizer must not be used from two threads at once
+        self._tokenizer = copy.deepcopy(self._model_tokenizer())
+        self._tokenizer_lock = threading.Lock()
+        # [CLS] and [SEP] (or their equivalents) count against the maximum sequence length
+        self._special_tokens = self._tokenizer.num_special_tokens_to_add()
+        self.embedding_cache = self._initialize_embedding_cache()
+        self._setup_collection()
         self.text_splitter = self._initialize_text_splitter()
+        self.parse_pool = self._initialize_parse_pool()
+        # Started with the first streamed file; files are streamed from several loading threads
+        self._stream_manager = None
+        self._stream_manager_lock = threading.Lock()
+        # Streamed files are embedded from the loading threads, this keeps them from
+        # competing with the batch embedding worker for the model
+        self._embed_lock = threading.Lock()
+        # Changes whenever chunks are written or deleted, so that the llm service can tell
+        # its cached answers are stale. The boot id covers changes made while stopped.
+        self.boot_id = uuid.uuid4().hex[:12]
+        self._index_changes = 0
+        self._index_changes_lock = threading.Lock()
+
+    @property
+    def index_version(self) -> str:
+        return f"{self.boot_id}:{self._index_changes}"
+
+    def _bump_index_version(self):
+        with self._index_changes_lock:
+            self._index_changes += 1
 
     def _initialize_qdrant(self) -> QdrantClient:
         return QdrantClient(
@@ -144,11 +232,62 @@ class Indexer:
             port=self.config.QDRANT_PORT
         )
 
-    def _initialize_embeddings(self) -> HuggingFaceEmbeddings:
+    def _initialize_async_qdrant(self) -> AsyncQdrantClient:
+        return AsyncQdrantClient(
+            host=self.config.QDRANT_BOOTSTRAP,
+            port=self.config.QDRANT_PORT
+        )
+
+    def _initialize_embeddings(self) -> Embeddings:
+        if self.config.EMBEDDING_BACKEND == "onnx":
+            # Imported here so the torch backend does not need optimum and onnxruntime
+            from onnx_embeddings import OnnxEmbeddings
+            return OnnxEmbeddings(
+                model_id=self.config.EMBEDDING_MODEL_ID,
+                cache_dir=self.config.ONNX_MODEL_DIR,
+                quantization=self.config.ONNX_QUANTIZATION,
+                intra_op_threads=self.config.EMBEDDING_INTRA_OP_THREADS,
+                inter_op_threads=self.config.EMBEDDING_INTER_OP_THREADS,
+                batch_size=self.config.INDEX_BATCH_SIZE
+            )
+        if self.config.EMBEDDING_BACKEND != "torch":
+            raise ValueError(f"Unsupported EMBEDDING_BACKEND {self.config.EMBEDDING_BACKEND}, expected torch or onnx")
+
+        if self.config.EMBEDDING_INTRA_OP_THREADS > 0:
+            torch.set_num_threads(self.config.EMBEDDING_INTRA_OP_THREADS)
+        if self.config.EMBEDDING_INTER_OP_THREADS > 0:
+            try:
+                torch.set_num_interop_threads(self.config.EMBEDDING_INTER_OP_THREADS)
+            except RuntimeError as e:
+                # Only possible before torch started any parallel work
+                logger.warning(f"Unable to set inter-op threads: {e}")
         return HuggingFaceEmbeddings(
             model_name=self.config.EMBEDDING_MODEL_ID,
             model_kwargs={'device': self.config.DEVICE},
-            encode_kwargs={'normalize_embeddings': False}
+            # One forward pass per pipeline batch
+            encode_kwargs={'normalize_embeddings': False, 'batch_size': self.config.INDEX_BATCH_SIZE}
+        )
+
+    def _model_tokenizer(self):
+        if isinstance(self.embed_model, HuggingFaceEmbeddings):
+            return self.embed_model._client.tokenizer
+        return self.embed_model.tokenizer
+
+    def _initialize_max_seq_length(self) -> int:
+        if isinstance(self.embed_model, HuggingFaceEmbeddings):
+            max_seq_length = self.embed_model._client.max_seq_length
+        else:
+            max_seq_length = self.embed_model.max_seq_length
+        # Without a sentence-transformers limit the tokenizer's own limit applies
+        return max_seq_length or self._model_tokenizer().model_max_length
+
+    def _initialize_embedding_cache(self) -> EmbeddingCache:
+        return EmbeddingCache(
+            model_id=self.config.embedding_identity(),
+            max_entries=self.config.EMBEDDING_CACHE_ENTRIES,
+            max_bytes=self.config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+            path=self.config.EMBEDDING_CACHE_PATH or None,
+            max_disk_entries=self.config.EMBEDDING_CACHE_DISK_ENTRIES
         )
 
     def _initialize_text_splitter(self) -> RecursiveCharacterTextSplitter:
@@ -169,37 +308,70 @@ class Indexer:
             separators=separators
         )
 
-    def _setup_collection(self) -> QdrantVectorStore:
+    def _initialize_parse_pool(self) -> ProcessPool | None:
+        if self.config.PARSE_WORKERS <= 0:
+            return None
+        # Spawned workers do not inherit the embedding model, CUDA state or open clients
+        return ProcessPool(
+            max_workers=self.config.PARSE_WORKERS,
+            max_tasks=self.config.PARSE_MAX_TASKS_PER_WORKER,
+            initializer=init_worker,
+            initargs=(self.config.PARSE_MEMORY_LIMIT_MB,),
+            context=multiprocessing.get_context("spawn")
+        )
+
+    def shutdown(self):
+        if self.parse_pool is not None:
+            self.parse_pool.stop()
+            self.parse_pool.join()
+        with self._stream_manager_lock:
+            if self._stream_manager is not None:
+                self._stream_manager.shutdown()
+                self._stream_manager = None
+
+    def _setup_collection(self) -> None:
         if not self.qdrant.collection_exists(self.config.QDRANT_COLLECTION):
-            self.qdrant.create_collection(
-                collection_name=self.config.QDRANT_COLLECTION,
-                vectors_config=VectorParams(
-                    size=self.config.EMBEDDING_SIZE,
-                    distance=Distance.COSINE
-                ),
+            create_collection(
+                self.qdrant,
+                self.config.QDRANT_COLLECTION,
+                size=int(self.config.EMBEDDING_SIZE),
+                profile=self.collection_profile,
+                sparse=self.config.RETRIEVAL_MODE == "hybrid"
             )
-        self.qdrant.create_payload_index(
-            collection_name=self.config.QDRANT_COLLECTION,
-            field_name="fpath",
-            field_schema="keyword"
-        )
-        return QdrantVectorStore(
-            client=self.qdrant,
-            collection_name=self.config.QDRANT_COLLECTION,
-            embedding=self.embed_model,
+        else:
+            mismatch = describe_mismatch(self.qdrant, self.config.QDRANT_COLLECTION, self.collection_profile)
+            if mismatch:
+                logger.warning(
+                    f"Collection {self.config.QDRANT_COLLECTION} does not match the {self.config.QDRANT_PROFILE} "
+                    f"profile: {', '.join(mismatch)}. Run migrate_collection.py to rebuild it"
+                )
+        collection = self.qdrant.get_collection(self.config.QDRANT_COLLECTION)
+        self.hybrid = (
+            self.config.RETRIEVAL_MODE == "hybrid"
+            and bm25.SPARSE_VECTOR_NAME in (collection.config.params.sparse_vectors or {})
         )
+        if self.config.RETRIEVAL_MODE == "hybrid" and not self.hybrid:
+            logger.warning(
+                f"Collection {self.config.QDRANT_COLLECTION} has no {bm25.SPARSE_VECTOR_NAME} keyword index, "
+                f"searching embeddings only. Run migrate_collection.py to add it"
+            )
+        payload_schema = collection.payload_schema
+        for key in KEYWORD_INDEXES:
+            if key not in payload_schema:
+                self.qdrant.create_payload_index(
+                    collection_name=self.config.QDRANT_COLLECTION,
+                    field_name=key,
+                    field_schema="keyword"
+                )
+        if "fpath" in payload_schema:
+            # Left over from earlier versions, no point ever had this key
+            self.qdrant.delete_payload_index(
+                collection_name=self.config.QDRANT_COLLECTION,
+                field_name="fpath"
+            )
 
-    def _create_loader(self, file_path: str):
-        file_extension = Path(file_path).suffix.lower()
-        loader_class = self.config.EXTENSIONS_TO_LOADERS.get(file_extension)
-        
-        if not loader_class:
-            raise ValueError(f"Unsupported file type: {file_extension}")
-        
-        return loader_class(file_path=file_path)
-
-    def _get_file_specific_splitter(self, file_path: str) -> RecursiveCharacterTextSplitter:
-        """Create a text splitter optimized for a specific file type."""
+    def _get_file_specific_chunking(self, file_path: str) -> tuple[int, List[str]]:
+        """Select the chunk size and separators optimized for a specific file type."""
         file_extension = Path(file_path).suffix.lower()
         chunk_size = self.config.CHUNK_SIZE
         
@@ -240,114 +412,608 @@ class Indexer:
             elif file_extension in [".doc", ".docx"]:
                 chunk_size = self.config.DOC_CHUNK_SIZE
                 
-        return RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=self.config.CHUNK_OVERLAP,
-            separators=separators
+        return chunk_size, separators
+
+    def _parse(self, file_path: str) -> List[tuple[str, dict]]:
+        # Split with a file-specific strategy and size
+        chunk_size, separators = self._get_file_specific_chunking(file_path)
+        args = (file_path, chunk_size, self.config.CHUNK_OVERLAP, separators)
+        if self.parse_pool is None:
+            return parse_file(*args)
+
+        future = self.parse_pool.schedule(parse_file, args=args, timeout=self.config.PARSE_TIMEOUT_SECONDS)
+        try:
+            return future.result()
+        except TimeoutError:
+            raise TimeoutError(f"parsing took longer than {self.config.PARSE_TIMEOUT_SECONDS} seconds, worker killed")
+        except ProcessExpired as e:
+            raise RuntimeError(f"parser process died with exit code {e.exitcode}")
+
+    def _load_documents(self, file_path: str) -> List[Document]:
+        documents = [
+            Document(page_content=page_content, metadata=metadata)
+            for page_content, metadata in self._parse(file_path)
+        ]
+        if not documents:
+            logger.warning(f"No documents loaded from {file_path}")
+            return []
+
+        for doc in documents:
+            doc.metadata.update(self.path_metadata(file_path))
+        return documents
+
+    @staticmethod
+    def path_metadata(file_path: str) -> Dict[str, any]:
+        """Metadata every chunk of a file gets, used by search filters."""
+        path = PurePosixPath(file_path)
+        return {
+            "file_path": file_path,
+            "parents": [str(parent) for parent in reversed(path.parents) if parent != PurePosixPath(path.anchor)],
+            "extension": path.suffix.lower(),
+        }
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+    @staticmethod
+    def _assign_chunk_ids(path: str, documents: List[Document], occurrences: Dict[str, int] | None = None) -> List[str]:
+        """
+        Hash every chunk and give it a point id derived from the file path and that hash,
+        so unchanged chunks keep their ids across re-indexing. Repeated chunks within a
+        file are told apart by their occurrence number, pass the same occurrences dict
+        when a file is processed in several batches.
+        """
+        chunk_hashes = []
+        occurrences = {} if occurrences is None else occurrences
+        for doc in documents:
+            digest = hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=16).hexdigest()
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            chunk_hash = f"{digest}:{occurrence}"
+            chunk_hashes.append(chunk_hash)
+            doc.id = Indexer.point_id(path, chunk_hash)
+        return chunk_hashes
+
+    @staticmethod
+    def point_id(path: str, chunk_hash: str) -> str:
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{path}\0{chunk_hash}"))
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Number of tokens of every text as the embedding model sees it, special tokens included."""
+        if not texts:
+            return []
+        with self._tokenizer_lock:
+            input_ids = self._tokenizer(texts, add_special_tokens=True, truncation=False, verbose=False)["input_ids"]
+        return [len(ids) for ids in input_ids]
+
+    def _split_text(self, text: str) -> List[tuple[int, str]]:
+        """
+        Split a text into pieces that fit the model, cutting between words where possible.
+        Returns the character offset of every piece within text along with the piece.
+        """
+        limit = self.max_seq_length - self._special_tokens
+        with self._tokenizer_lock:
+            offsets = self._tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+        pieces = []
+        start = 0
+        while start < len(offsets):
+            end = min(start + limit, len(offsets))
+            if end < len(offsets):
+                # Back off to a token that starts a new word, a word split into two pieces
+                # would be tokenized differently
+                boundary = end
+                while boundary > start + limit // 2 and offsets[boundary][0] == offsets[boundary - 1][1]:
+                    boundary -= 1
+                if boundary > start + limit // 2:
+                    end = boundary
+            pieces.append((offsets[start][0], text[offsets[start][0]:offsets[end - 1][1]]))
+            start = end
+        return pieces
+
+    def _fit_to_model(self, path: str, documents: List[Document]) -> tuple[List[Document], List[int]]:
+        """
+        Count the tokens of every chunk. CHUNK_SIZE is measured in characters, so a chunk can
+        be longer than the model's maximum sequence length, and the model would only embed its
+        beginning. Such chunks are split into several (OVERSIZED_CHUNKS=split) or logged (warn).
+        """
+        token_counts = self.count_tokens([doc.page_content for doc in documents])
+        oversized = sum(count > self.max_seq_length for count in token_counts)
+        if not oversized:
+            return documents, token_counts
+        if self.config.OVERSIZED_CHUNKS != "split" or not self._tokenizer.is_fast:
+            logger.warning(
+                f"{path}: {oversized} chunks exceed the maximum sequence length of {self.max_seq_length} "
+                f"tokens and will be truncated, lower the chunk size"
+            )
+            return documents, [min(count, self.max_seq_length) for count in token_counts]
+
+        logger.info(f"{path}: splitting {oversized} chunks longer than {self.max_seq_length} tokens")
+        fitted = []
+        for doc, count in zip(documents, token_counts):
+            if count <= self.max_seq_length:
+                fitted.append(doc)
+                continue
+            for offset, piece in self._split_text(doc.page_content):
+                metadata = dict(doc.metadata)
+                if "start_index" in metadata:
+                    metadata["start_index"] += offset
+                fitted.append(Document(page_content=piece, metadata=metadata))
+        return fitted, [min(count, self.max_seq_length) for count in self.count_tokens([doc.page_content for doc in fitted])]
+
+    def add_documents(self, documents: List[Document], token_counts: List[int] | None = None) -> List[str]:
+        """
+        Embed and upsert a batch of chunks (possibly from many files) in a single call.
+        Chunks are embedded shortest first, so that the model pads each of its batches to
+        chunks of similar length, and the vectors are matched back to their chunks.
+        """
+        ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+        lengths = token_counts or [len(doc.page_content) for doc in documents]
+        order = sorted(range(len(documents)), key=lengths.__getitem__)
+        with self._embed_lock:
+            sorted_vectors = self.embed_model.embed_documents([documents[i].page_content for i in order])
+        vectors: List[List[float] | None] = [None] * len(documents)
+        for i, vector in zip(order, sorted_vectors):
+            vectors[i] = vector
+        # Payload layout of langchain's Qdrant store, which the llm service's retriever reads back
+        self.qdrant.upsert(
+            collection_name=self.config.QDRANT_COLLECTION,
+            points=[
+                PointStruct(
+                    id=point_id,
+                    vector=self._point_vector(vector, doc.page_content),
+                    payload={"page_content": doc.page_content, "metadata": doc.metadata}
+                )
+                for point_id, vector, doc in zip(ids, vectors, documents)
+            ],
+            wait=True
         )
+        self._bump_index_version()
+        return ids
+
+    def _point_vector(self, dense: List[float], text: str):
+        if not self.hybrid:
+            return dense
+        # Written together with the embedding, so the keyword index follows every
+        # upsert and delete of a chunk
+        return {"": dense, bm25.SPARSE_VECTOR_NAME: bm25.document_vector(text)}
 
-    def _process_file(self, loader) -> List[str]:
+    def prepare(self, message: Dict[str, any], indexing_status: IndexingStatus | None = None) -> PreparedFile | None:
+        """
+        Check whether a file needs indexing and load it into chunks without embedding them.
+        Only chunks that are not already stored are returned; once they are, finish deletes
+        the chunks that disappeared from the file and records its hashes. None when there
+        is nothing to index. Pass indexing_status when the file was already checked with
+        MinimaStore.check_needs_indexing_batch.
+        """
+        path, file_id, last_updated_seconds = message["path"], message["file_id"], message["last_updated_seconds"]
+        logger.info(f"Preparing file: {path} (ID: {file_id})")
+        if indexing_status is None:
+            indexing_status = MinimaStore.check_needs_indexing(fpath=path, last_updated_seconds=last_updated_seconds)
+        if indexing_status == IndexingStatus.no_need_reindexing:
+            logger.info(f"Skipping {path}, no indexing required. timestamp didn't change")
+            return None
         try:
-            # Create a file-specific text splitter with appropriate strategy and size
-            text_splitter = self._get_file_specific_splitter(loader.file_path)
-                
-            documents = loader.load_and_split(text_splitter)
-            if not documents:
-                logger.warning(f"No documents loaded from {loader.file_path}")
-                return []
-
-            for doc in documents:
-                doc.metadata['file_path'] = loader.file_path
-
-            uuids = [str(uuid.uuid4()) for _ in range(len(documents))]
-            ids = self.document_store.add_documents(documents=documents, ids=uuids)
-            
-            logger.info(f"Successfully processed {len(ids)} documents from {loader.file_path}")
-            return ids
-            
+            content_hash = self._hash_file(path)
+            stored_content_hash, stored_chunk_hashes = MinimaStore.get_hashes(path)
+            if content_hash == stored_content_hash:
+                logger.info(f"Skipping {path}, timestamp changed but content is the same")
+                return None
+            logger.info(f"Indexing needed for {path} with status: {indexing_status}")
+
+            if os.path.getsize(path) >= self.config.STREAM_THRESHOLD_MB * 1024 * 1024:
+                self._index_streaming(path, indexing_status, content_hash, stored_chunk_hashes)
+                return None
+
+            documents, token_counts = self._fit_to_model(path, self._load_documents(path))
+            chunk_hashes = self._assign_chunk_ids(path, documents)
+
+            removed_ids = set()
+            if indexing_status == IndexingStatus.need_reindexing and stored_chunk_hashes is None:
+                # Indexed before chunk hashes were tracked, so the old point ids are unknown
+                logger.info(f"Removing {path} from index storage for reindexing")
+                self.remove_from_storage(files_to_remove=[path])
+                stored_ids = set()
+            else:
+                stored_ids = {self.point_id(path, chunk_hash) for chunk_hash in stored_chunk_hashes or []}
+                removed_ids = stored_ids - {doc.id for doc in documents}
+
+            new = [i for i, doc in enumerate(documents) if doc.id not in stored_ids]
+            new_documents = [documents[i] for i in new]
+            unchanged_metadata = {doc.id: doc.metadata for doc in documents if doc.id in stored_ids}
+            logger.info(
+                f"{path}: {len(new_documents)} new chunks, "
+                f"{len(documents) - len(new_documents)} unchanged chunks"
+            )
+            return PreparedFile(
+                path, new_documents, content_hash, chunk_hashes, [token_counts[i] for i in new], list(removed_ids),
+                unchanged_metadata
+            )
         except Exception as e:
-            logger.error(f"Error processing file {loader.file_path}: {str(e)}")
-            return []
+            logger.error(f"Failed to prepare file {path}: {str(e)}")
+            # The new mtime is already recorded, so without this the file would wait for its next change
+            MinimaStore.invalidate([path])
+            return None
+
+    def finish(self, prepared: PreparedFile):
+        """Delete the stale chunks of a prepared file and record its hashes, after its new chunks are stored."""
+        if prepared.removed_ids:
+            self.remove_points(prepared.removed_ids)
+        self.update_metadata(prepared.unchanged_metadata)
+        MinimaStore.update_hashes(prepared.path, prepared.content_hash, prepared.chunk_hashes)
+
+    def _stream_batches(self, file_path: str) -> Iterator[List[tuple[str, dict]]]:
+        chunk_size, separators = self._get_file_specific_chunking(file_path)
+        args = (file_path, chunk_size, self.config.CHUNK_OVERLAP, separators, self.config.INDEX_BATCH_SIZE)
+        if self.parse_pool is None:
+            yield from iter_chunk_batches(*args)
+            return
+
+        with self._stream_manager_lock:
+            if self._stream_manager is None:
+                self._stream_manager = multiprocessing.get_context("spawn").Manager()
+            manager = self._stream_manager
+        # A couple of batches in flight is enough to overlap parsing with embedding
+        batches = manager.Queue(maxsize=2)
+        future = self.parse_pool.schedule(stream_file, args=(*args, batches))
+        idle_since = time.monotonic()
+        try:
+            while True:
+                try:
+                    batch = batches.get(timeout=1)
+                except queue.Empty:
+                    if future.done():
+                        # The worker failed (or was killed) before sending the end marker
+                        future.result()
+                        raise RuntimeError("parser process exited without finishing the stream")
+                    # Time spent embedding earlier batches does not count, only waiting for the parser
+                    if time.monotonic() - idle_since > self.config.PARSE_TIMEOUT_SECONDS:
+                        raise TimeoutError(f"no chunks parsed for {self.config.PARSE_TIMEOUT_SECONDS} seconds, worker killed")
+                    continue
+                if batch is None:
+                    return
+                yield batch
+                idle_since = time.monotonic()
+        except ProcessExpired as e:
+            raise RuntimeError(f"parser process died with exit code {e.exitcode}")
+        finally:
+            # Cancelling a running task terminates its worker
+            future.cancel()
+
+    def _index_streaming(self, path: str, indexing_status: IndexingStatus, content_hash: str, stored_chunk_hashes: List[str] | None):
+        """
+        Index a large file batch by batch, so that memory use does not grow with the
+        file size. Stale chunks are only deleted once the whole file was indexed.
+        """
+        if indexing_status == IndexingStatus.need_reindexing and stored_chunk_hashes is None:
+            logger.info(f"Removing {path} from index storage for reindexing")
+            self.remove_from_storage(files_to_remove=[path])
+            stored_ids = set()
+        else:
+            stored_ids = {self.point_id(path, chunk_hash) for chunk_hash in stored_chunk_hashes or []}
+
+        chunk_hashes = []
+        occurrences: Dict[str, int] = {}
+        new_chunks = 0
+        try:
+            for batch in self._stream_batches(path):
+                documents = [Document(page_content=text, metadata=metadata) for text, metadata in batch]
+                for doc in documents:
+                    doc.metadata.update(self.path_metadata(path))
+                documents, token_counts = self._fit_to_model(path, documents)
+                chunk_hashes.extend(self._assign_chunk_ids(path, documents, occurrences))
+                new = [i for i, doc in enumerate(documents) if doc.id not in stored_ids]
+                if new:
+                    self.add_documents([documents[i] for i in new], [token_counts[i] for i in new])
+                    new_chunks += len(new)
+                self.update_metadata({doc.id: doc.metadata for doc in documents if doc.id in stored_ids})
+        except Exception:
+            # Chunks upserted so far are kept, the next crawl indexes the file again
+            MinimaStore.invalidate([path])
+            raise
+
+        removed_ids = stored_ids - {self.point_id(path, chunk_hash) for chunk_hash in chunk_hashes}
+        if removed_ids:
+            self.remove_points(list(removed_ids))
+        logger.info(
+            f"{path}: streamed {new_chunks} new chunks, "
+            f"{len(chunk_hashes) - new_chunks} unchanged chunks"
+        )
+        MinimaStore.update_hashes(path, content_hash, chunk_hashes)
 
     def index(self, message: Dict[str, any]) -> None:
         start = time.time()
-        path, file_id, last_updated_seconds = message["path"], message["file_id"], message["last_updated_seconds"]
-        logger.info(f"Processing file: {path} (ID: {file_id})")
-        indexing_status: IndexingStatus = MinimaStore.check_needs_indexing(fpath=path, last_updated_seconds=last_updated_seconds)
-        if indexing_status != IndexingStatus.no_need_reindexing:
-            logger.info(f"Indexing needed for {path} with status: {indexing_status}")
+        path = message["path"]
+        prepared = self.prepare(message)
+        if prepared is not None:
             try:
-                if indexing_status == IndexingStatus.need_reindexing:
-                    logger.info(f"Removing {path} from index storage for reindexing")
-                    self.remove_from_storage(files_to_remove=[path])
-                loader = self._create_loader(path)
-                ids = self._process_file(loader)
-                if ids:
+                if prepared.documents:
+                    ids = self.add_documents(prepared.documents, prepared.token_counts)
                     logger.info(f"Successfully indexed {path} with IDs: {ids}")
+                self.finish(prepared)
             except Exception as e:
                 logger.error(f"Failed to index file {path}: {str(e)}")
-        else:
-            logger.info(f"Skipping {path}, no indexing required. timestamp didn't change")
+                MinimaStore.invalidate([path])
         end = time.time()
         logger.info(f"Processing took {end - start} seconds for file {path}")
 
     def purge(self, message: Dict[str, any]) -> None:
         existing_file_paths: list[str] = message["existing_file_paths"]
-        files_to_remove = MinimaStore.find_removed_files(existing_file_paths=set(existing_file_paths))
+        files_to_remove = MinimaStore.find_removed_files(
+            existing_file_paths=set(existing_file_paths), since=message.get("crawl_started")
+        )
         if len(files_to_remove) > 0:
             logger.info(f"purge processing removing old files {files_to_remove}")
             self.remove_from_storage(files_to_remove)
         else:
             logger.info("Nothing to purge")
 
+    def remove(self, message: Dict[str, any]) -> None:
+        """Remove a deleted file, or every file under a deleted directory, from the index."""
+        path = message["path"]
+        files_to_remove = MinimaStore.delete_m_docs_under(path)
+        if files_to_remove:
+            logger.info(f"Removing deleted files {files_to_remove}")
+            self.remove_from_storage(files_to_remove)
+        else:
+            logger.info(f"Nothing indexed under {path}")
+
     def remove_from_storage(self, files_to_remove: list[str]):
-        filter_conditions = Filter(
-            must=[
-                FieldCondition(
-                    key="fpath",
-                    match=MatchValue(value=fpath)
-                )
-                for fpath in files_to_remove
-            ]
-        )
-        response = self.qdrant.delete(
-            collection_name=self.config.QDRANT_COLLECTION,
-            points_selector=filter_conditions,
-            wait=True
-        )
-        logger.info(f"Delete response for {len(files_to_remove)} for files: {files_to_remove} is: {response}")
+        """Delete every chunk of the given files, a batch of paths per request."""
+        for start in range(0, len(files_to_remove), DELETE_BATCH_SIZE):
+            batch = files_to_remove[start:start + DELETE_BATCH_SIZE]
+            filter_conditions = Filter(
+                must=[
+                    FieldCondition(
+                        key=FILE_PATH_KEY,
+                        match=MatchAny(any=batch)
+                    )
+                ]
+            )
+            response = self.qdrant.delete(
+                collection_name=self.config.QDRANT_COLLECTION,
+                points_selector=filter_conditions,
+                wait=True
+            )
+            self._bump_index_version()
+            logger.info(f"Delete response for {len(batch)} files is: {response}")
+            logger.debug(f"Deleted chunks of files: {batch}")
+
+    def update_metadata(self, metadata: Dict[str, dict]):
+        """
+        Rewrite the metadata of stored chunks. An edit earlier in a file shifts the start_index
+        (and possibly the page) of the unchanged chunks after it, which are not upserted again.
+        """
+        point_ids = list(metadata)
+        for start in range(0, len(point_ids), DELETE_BATCH_SIZE):
+            self.qdrant.batch_update_points(
+                collection_name=self.config.QDRANT_COLLECTION,
+                update_operations=[
+                    SetPayloadOperation(set_payload=SetPayload(payload={"metadata": metadata[point_id]}, points=[point_id]))
+                    for point_id in point_ids[start:start + DELETE_BATCH_SIZE]
+                ],
+                wait=True
+            )
+            self._bump_index_version()
+        if point_ids:
+            logger.info(f"Updated the metadata of {len(point_ids)} unchanged chunks")
+
+    def remove_points(self, point_ids: list[str]):
+        for start in range(0, len(point_ids), DELETE_BATCH_SIZE):
+            batch = point_ids[start:start + DELETE_BATCH_SIZE]
+            response = self.qdrant.delete(
+                collection_name=self.config.QDRANT_COLLECTION,
+                points_selector=PointIdsList(points=batch),
+                wait=True
+            )
+            self._bump_index_version()
+            logger.info(f"Delete response for {len(batch)} stale chunks is: {response}")
+
+    def _to_container_path(self, path: str) -> str:
+        if self.config.LOCAL_FILES_PATH and path.startswith(self.config.LOCAL_FILES_PATH):
+            return self.config.CONTAINER_PATH + path[len(self.config.LOCAL_FILES_PATH):]
+        return path
+
+    def _to_local_path(self, path: str) -> str:
+        return path.replace(self.config.CONTAINER_PATH, self.config.LOCAL_FILES_PATH)
+
+    def build_filter(
+            self,
+            path_prefix: str | None = None,
+            extensions: List[str] | None = None,
+            fields: Dict[str, any] | None = None,
+    ) -> Filter | None:
+        """
+        Search filter from a folder or file path (as on the host, or in the container),
+        file extensions and metadata fields such as Markdown frontmatter.
+        """
+        must = []
+        if path_prefix:
+            path = self._to_container_path(path_prefix.rstrip("/") or "/")
+            # A folder matches its files through their parents, a file its own path
+            must.append(Filter(should=[
+                FieldCondition(key=PARENTS_KEY, match=MatchValue(value=path)),
+                FieldCondition(key=FILE_PATH_KEY, match=MatchValue(value=path)),
+            ]))
+        if extensions:
+            normalized = [extension.lower() if extension.startswith(".") else f".{extension.lower()}" for extension in extensions]
+            must.append(FieldCondition(key=EXTENSION_KEY, match=MatchAny(any=normalized)))
+        for key, value in (fields or {}).items():
+            # A list field matches when any of its values does
+            must.append(FieldCondition(key=f"metadata.{key}", match=MatchValue(value=value)))
+        return Filter(must=must) if must else None
+
+    def _search_request(
+            self,
+            query: str,
+            vector: List[float],
+            k: int = 4,
+            score_threshold: float | None = None,
+            query_filter: Filter | None = None,
+    ) -> Dict[str, any]:
+        """
+        Arguments of query_points for a search. In hybrid mode the dense and keyword
+        searches run as prefetches of a single request and their results are fused.
+        score_threshold is a minimum cosine similarity; in hybrid mode it applies to the
+        dense candidates, so exact keyword matches are still found.
+        """
+        search_params = self.collection_profile.search_params()
+        if not self.hybrid:
+            return {
+                "query": vector,
+                "limit": k,
+                "score_threshold": score_threshold,
+                "query_filter": query_filter,
+                "search_params": search_params,
+                "with_payload": True,
+            }
+        prefetch_limit = max(k, self.config.HYBRID_PREFETCH_LIMIT)
+        return {
+            "prefetch": [
+                Prefetch(
+                    query=vector,
+                    limit=prefetch_limit,
+                    score_threshold=score_threshold,
+                    filter=query_filter,
+                    params=search_params
+                ),
+                Prefetch(
+                    query=bm25.query_vector(query),
+                    using=bm25.SPARSE_VECTOR_NAME,
+                    limit=prefetch_limit,
+                    filter=query_filter
+                ),
+            ],
+            "query": FusionQuery(fusion=Fusion.DBSF if self.config.HYBRID_FUSION == "dbsf" else Fusion.RRF),
+            "limit": k,
+            "with_payload": True,
+        }
+
+    def _format_results(self, points, max_bytes: int | None = None, include_output: bool = False) -> Dict[str, any]:
+        """
+        One entry per chunk with its score, source and position. Chunk texts are cut off
+        once max_bytes (UTF-8) are returned; the chunk that crosses the budget is truncated
+        and the rest are dropped.
+        """
+        chunks = []
+        links = []
+        remaining = max_bytes
+        for point in points:
+            if remaining is not None and remaining <= 0:
+                break
+            payload = point.payload or {}
+            metadata = payload.get("metadata") or {}
+            text = payload.get("page_content", "")
+            truncated = False
+            if remaining is not None:
+                encoded = text.encode("utf-8")
+                if len(encoded) > remaining:
+                    text = encoded[:remaining].decode("utf-8", errors="ignore")
+                    truncated = True
+                remaining -= len(encoded)
+            start = metadata.get("start_index")
+            link = f"file://{self._to_local_path(metadata.get('file_path', ''))}"
+            if link not in links:
+                links.append(link)
+            chunks.append({
+                "text": text,
+                "score": point.score,
+                "link": link,
+                "page": metadata.get("page"),
+                # Character offsets of the chunk within its page (PDF, slides) or the file
+                "start": start,
+                "end": start + len(payload.get("page_content", "")) if start is not None else None,
+                "truncated": truncated,
+            })
 
-    def find(self, query: str) -> Dict[str, any]:
+        logger.info(f"Found {len(chunks)} results")
+        result = {"chunks": chunks, "links": links}
+        if include_output:
+            # The joined text earlier versions returned
+            result["output"] = ". ".join(chunk["text"] for chunk in chunks)
+        return result
+
+    def find(self, query: str, k: int = 4, score_threshold: float | None = None, query_filter: Filter | None = None,
+             max_bytes: int | None = None, include_output: bool = False) -> Dict[str, any]:
         try:
             logger.info(f"Searching for: {query}")
-            found = self.document_store.search(query, search_type="similarity")
-            
-            if not found:
-                logger.info("No results found")
-                return {"links": set(), "output": ""}
-
-            links = set()
-            results = []
-            
-            for item in found:
-                path = item.metadata["file_path"].replace(
-                    self.config.CONTAINER_PATH,
-                    self.config.LOCAL_FILES_PATH
-                )
-                links.add(f"file://{path}")
-                results.append(item.page_content)
+            response = self.qdrant.query_points(
+                collection_name=self.config.QDRANT_COLLECTION,
+                **self._search_request(query, self.embed(query), k, score_threshold, query_filter)
+            )
+            return self._format_results(response.points, max_bytes, include_output)
+        except Exception as e:
+            logger.error(f"Search failed: {str(e)}")
+            return {"error": "Unable to find anything for the given query"}
 
-            output = {
-                "links": links,
-                "output": ". ".join(results)
-            }
-            
-            logger.info(f"Found {len(found)} results")
-            return output
-            
+    async def afind(self, query: str, batcher: EmbeddingBatcher, k: int = 4, score_threshold: float | None = None,
+                    query_filter: Filter | None = None, max_bytes: int | None = None,
+                    include_output: bool = False) -> Dict[str, any]:
+        """
+        Like find, without blocking the event loop: the query is embedded through the
+        batcher and the search goes through the async Qdrant client.
+        """
+        try:
+            logger.info(f"Searching for: {query}")
+            vector = await self.aembed(query, batcher)
+            response = await self.async_qdrant.query_points(
+                collection_name=self.config.QDRANT_COLLECTION,
+                **self._search_request(query, vector, k, score_threshold, query_filter)
+            )
+            return self._format_results(response.points, max_bytes, include_output)
         except Exception as e:
             logger.error(f"Search failed: {str(e)}")
             return {"error": "Unable to find anything for the given query"}
 
     def embed(self, query: str):
-        return self.embed_model.embed_query(query)
\ No newline at end of file
+        return self.embedding_cache.get_or_compute(query, self.embed_model.embed_query)
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries in one forward pass."""
+        return self.embed_model.embed_documents(queries)
+
+    def embed_many(self, texts: List[str]) -> List[tuple[List[float] | None, str | None]]:
+        """
+        Embed many texts, cache misses in a single forward pass. Returns a (vector, error)
+        pair per text, so one bad text does not fail the others.
+        """
+        results: List[tuple[List[float] | None, str | None]] = [(None, None)] * len(texts)
+        misses = []
+        for i, text in enumerate(texts):
+            if not text.strip():
+                results[i] = (None, "empty text")
+                continue
+            cached = self.embedding_cache.get(text)
+            if cached is not None:
+                results[i] = (cached, None)
+            else:
+                misses.append(i)
+        if not misses:
+            return results
+
+        try:
+            vectors = self.embed_queries([texts[i] for i in misses])
+            embedded = [(vector, None) for vector in vectors]
+        except Exception as e:
+            # Embed one by one to find out which texts fail
+            logger.error(f"Embedding batch of {len(misses)} texts failed, retrying one by one: {e}")
+            embedded = []
+            for i in misses:
+                try:
+                    embedded.append((self.embed_model.embed_query(texts[i]), None))
+                except Exception as item_error:
+                    embedded.append((None, str(item_error)))
+        for i, (vector, error) in zip(misses, embedded):
+            results[i] = (vector, error)
+            if vector is not None:
+                self.embedding_cache.put(texts[i], vector)
+        return results
+
+    async def aembed(self, query: str, batcher: EmbeddingBatcher) -> List[float]:
+        """Embed a query, coalescing cache misses with concurrent requests into batches."""
+        embedding = self.embedding_cache.get(query)
+        if embedding is None:
+            embedding = await batcher.embed(query)
+            self.embedding_cache.put(query, embedding)
+        return embedding
\ No newline at end of file
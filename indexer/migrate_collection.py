@@ -0,0 +1,151 @@
+"""
+Rebuild the Qdrant collection with another collection profile, without re-embedding.
+
+Stored vectors and payloads are copied into a new collection created with the profile
+(QDRANT_PROFILE and the QDRANT_* overrides, or --profile), together with the payload
+indexes. With RETRIEVAL_MODE=hybrid the BM25 keyword vectors are computed from the
+stored chunk texts on the way, which adds hybrid search to an existing collection.
+Chunks indexed before search filters existed get their folder and extension metadata.
+
+REMOTE_QDRANT_COLLECTION then becomes an alias of the new collection, which the
+indexer and the llm service use like the collection itself. The first migration
+replaces the original collection with the alias. Later migrations switch the alias
+atomically and delete the previous collection unless --keep-old is given.
+
+Stop the indexer while migrating. Points it writes during the copy would be lost:
+
+    docker compose stop indexer
+    docker compose run --rm indexer python migrate_collection.py --profile scalar [--dry-run]
+    docker compose start indexer
+
+Set QDRANT_PROFILE to the same profile so that searches use its settings.
+"""
+import time
+import logging
+import argparse
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    PointStruct,
+)
+
+from bm25 import SPARSE_VECTOR_NAME, document_vector
+from collection_profile import PROFILES, CollectionProfile, create_collection
+from indexer import Config, Indexer, KEYWORD_INDEXES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 256
+
+
+def resolve_collection(qdrant: QdrantClient, name: str) -> tuple[str, bool]:
+    """The collection behind name, and whether name is an alias."""
+    for alias in qdrant.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name, True
+    return name, False
+
+
+def point_vector(point, sparse: bool):
+    # The dense vector is unnamed, but comes in a dict when the point has a sparse vector too
+    dense = point.vector.get("") if isinstance(point.vector, dict) else point.vector
+    if not sparse:
+        return dense
+    return {"": dense, SPARSE_VECTOR_NAME: document_vector((point.payload or {}).get("page_content", ""))}
+
+
+def point_payload(point) -> dict:
+    payload = point.payload or {}
+    metadata = payload.get("metadata") or {}
+    if "file_path" in metadata and "parents" not in metadata:
+        payload = {**payload, "metadata": {**metadata, **Indexer.path_metadata(metadata["file_path"])}}
+    return payload
+
+
+def copy_points(qdrant: QdrantClient, source: str, target: str, batch_size: int, sparse: bool) -> int:
+    copied = 0
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        if points:
+            qdrant.upsert(
+                collection_name=target,
+                points=[PointStruct(id=point.id, vector=point_vector(point, sparse), payload=point_payload(point)) for point in points],
+                wait=True
+            )
+            copied += len(points)
+            logger.info(f"Copied {copied} points")
+        if offset is None:
+            return copied
+
+
+def migrate(profile_name: str, profile: CollectionProfile, batch_size: int, keep_old: bool, dry_run: bool):
+    config = Config()
+    qdrant = QdrantClient(host=config.QDRANT_BOOTSTRAP, port=config.QDRANT_PORT)
+    alias = config.QDRANT_COLLECTION
+    source, is_alias = resolve_collection(qdrant, alias)
+    info = qdrant.get_collection(source)
+    vectors = info.config.params.vectors
+    points = qdrant.count(collection_name=source, exact=True).count
+    sparse = config.RETRIEVAL_MODE == "hybrid"
+    target = f"{alias}_{profile_name}_{time.strftime('%Y%m%d%H%M%S')}"
+    float32_mb = points * vectors.size * 4 / 1024 / 1024
+    profile_mb = profile.ram_bytes(points, vectors.size) / 1024 / 1024
+    logger.info(
+        f"Migrating {points} points of {source} ({vectors.size} dimensions) to {target}: {profile}, "
+        f"{'with' if sparse else 'without'} {SPARSE_VECTOR_NAME} keyword index. "
+        f"Vectors in RAM: about {float32_mb:.0f} MB as float32, {profile_mb:.0f} MB with the new profile"
+    )
+    if dry_run:
+        return
+
+    create_collection(qdrant, target, size=vectors.size, profile=profile, distance=vectors.distance, sparse=sparse)
+    for field_name, schema in info.payload_schema.items():
+        qdrant.create_payload_index(collection_name=target, field_name=field_name, field_schema=schema.data_type)
+    for field_name in KEYWORD_INDEXES:
+        if field_name not in info.payload_schema:
+            qdrant.create_payload_index(collection_name=target, field_name=field_name, field_schema="keyword")
+    copied = copy_points(qdrant, source, target, batch_size, sparse)
+    stored = qdrant.count(collection_name=target, exact=True).count
+    if stored != points:
+        raise RuntimeError(f"{target} holds {stored} points instead of {points}, {source} was left in place")
+
+    if is_alias:
+        qdrant.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=alias)),
+        ])
+        if not keep_old:
+            qdrant.delete_collection(source)
+    else:
+        # An alias cannot have the name of a collection, so the original has to go first
+        qdrant.delete_collection(source)
+        qdrant.update_collection_aliases(change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=alias)),
+        ])
+    logger.info(f"Copied {copied} points, {alias} now points to {target}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=list(PROFILES), help="defaults to QDRANT_PROFILE with the QDRANT_* overrides")
+    parser.add_argument("--batch-size", type=int, default=COPY_BATCH_SIZE, help="points per copy request")
+    parser.add_argument("--keep-old", action="store_true", help="keep the previous collection when an alias is switched")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be migrated")
+    args = parser.parse_args()
+    if args.profile:
+        name, selected = args.profile, PROFILES[args.profile]
+    else:
+        name, selected = Config.QDRANT_PROFILE, Config().collection_profile()
+    migrate(name, selected, args.batch_size, args.keep_old, args.dry_run)
@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from huggingface_hub import snapshot_download
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+QUANTIZATION_TARGETS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformers model exported to ONNX and dynamically quantized to int8, run on
+    CPU with ONNX Runtime. Pooling, normalization and the maximum sequence length are
+    read from the model's sentence-transformers configuration, so vectors match those of
+    HuggingFaceEmbeddings up to quantization error.
+
+    The exported model is cached under cache_dir and only built on first use of a model.
+    """
+
+    def __init__(
+            self,
+            model_id: str,
+            cache_dir: str,
+            quantization: str = "avx2",
+            intra_op_threads: int = 0,
+            inter_op_threads: int = 0,
+            batch_size: int = 32,
+    ):
+        if quantization not in QUANTIZATION_TARGETS:
+            raise ValueError(f"Unsupported ONNX quantization target {quantization}, expected one of {QUANTIZATION_TARGETS}")
+        self.model_id = model_id
+        self.batch_size = batch_size
+        source_dir = Path(model_id) if os.path.isdir(model_id) else Path(snapshot_download(model_id))
+        self.pooling, self.normalize, self.max_seq_length = self._read_sentence_transformers_config(source_dir)
+        model_dir = Path(cache_dir) / model_id.replace("/", "__") / quantization
+        if not (model_dir / QUANTIZED_FILE_NAME).is_file():
+            self._export(model_id, model_dir, quantization)
+
+        import onnxruntime
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 keeps the ONNX Runtime defaults, one intra-op thread per physical core
+        session_options.intra_op_num_threads = intra_op_threads
+        session_options.inter_op_num_threads = inter_op_threads
+        session_options.execution_mode = (
+            onnxruntime.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 else onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.max_seq_length or self.tokenizer.model_max_length
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir,
+            file_name=QUANTIZED_FILE_NAME,
+            provider="CPUExecutionProvider",
+            session_options=session_options
+        )
+        logger.info(
+            f"Loaded int8 ONNX model for {model_id} ({quantization}, pooling={self.pooling}, "
+            f"normalize={self.normalize}, intra_op_threads={intra_op_threads}, inter_op_threads={inter_op_threads})"
+        )
+
+    @staticmethod
+    def _read_sentence_transformers_config(source_dir: Path) -> tuple[str, bool, int | None]:
+        pooling, normalize, max_seq_length = "mean", False, None
+        modules_path = source_dir / "modules.json"
+        if modules_path.is_file():
+            modules = json.loads(modules_path.read_text())
+            normalize = any(module["type"].endswith("Normalize") for module in modules)
+            for module in modules:
+                pooling_config_path = source_dir / module["path"] / "config.json"
+                if module["type"].endswith("Pooling") and pooling_config_path.is_file():
+                    pooling_config = json.loads(pooling_config_path.read_text())
+                    if pooling_config.get("pooling_mode_cls_token"):
+                        pooling = "cls"
+                    elif pooling_config.get("pooling_mode_max_tokens"):
+                        pooling = "max"
+        st_config_path = source_dir / "sentence_bert_config.json"
+        if st_config_path.is_file():
+            max_seq_length = json.loads(st_config_path.read_text()).get("max_seq_length")
+        return pooling, normalize, max_seq_length
+
+    @staticmethod
+    def _export(model_id: str, model_dir: Path, quantization: str):
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        logger.info(f"Exporting {model_id} to ONNX and quantizing it for {quantization}, this is done once")
+        # Built next to the final location and moved into place, an interrupted export is redone
+        tmp_dir = model_dir.with_name(model_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        export_dir = tmp_dir / "fp32"
+        model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+        model.save_pretrained(export_dir)
+
+        quantization_config = getattr(AutoQuantizationConfig, quantization)(is_static=False, per_channel=False)
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        quantizer.quantize(save_dir=tmp_dir, quantization_config=quantization_config)
+        model.config.save_pretrained(tmp_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(tmp_dir)
+        shutil.rmtree(export_dir)
+        shutil.rmtree(model_dir, ignore_errors=True)
+        os.replace(tmp_dir, model_dir)
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[..., None].astype(token_embeddings.dtype)
+        if self.pooling == "max":
+            return np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np"
+        )
+        outputs = self.model(**inputs)
+        embeddings = self._pool(np.asarray(outputs.last_hidden_state), inputs["attention_mask"])
+        if self.normalize:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Same preprocessing as HuggingFaceEmbeddings
+        texts = [text.replace("\n", " ") for text in texts]
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
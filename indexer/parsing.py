@@ -0,0 +1,212 @@
+import yaml
+import logging
+from datetime import datetime
+from typing import Iterator, List
+from pathlib import Path
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import (
+    TextLoader,
+    CSVLoader,
+    Docx2txtLoader,
+    UnstructuredExcelLoader,
+    PyMuPDFLoader,
+    UnstructuredPowerPointLoader,
+)
+
+# Document parsing runs in worker processes, so this module must stay free of
+# torch, Qdrant and database imports to keep the workers small and quick to spawn.
+
+logger = logging.getLogger(__name__)
+
+
+class MinimaTextLoader(TextLoader):
+    """Custom loader for Markdown files that extracts YAML frontmatter."""
+
+    def __init__(self, file_path: str, **kwargs):
+        super().__init__(file_path, **kwargs)
+
+    def _parse_frontmatter(self, content: str) -> tuple[dict, str]:
+        """Extract and parse YAML frontmatter from content."""
+        if not content.startswith('---\n'):
+            return {}, content
+
+        # Find the end of frontmatter
+        parts = content.split('---\n', 2)
+        if len(parts) < 3:
+            return {}, content
+
+        try:
+            frontmatter = yaml.safe_load(parts[1])
+            if not isinstance(frontmatter, dict):
+                return {}, content
+
+            # Clean metadata dictionary
+            cleaned_frontmatter = {}
+
+            # Handle dates specially
+            for key in ['created', 'updated']:
+                if key in frontmatter and frontmatter[key]:
+                    try:
+                        dt = datetime.fromisoformat(str(frontmatter[key]).replace(' ', 'T'))
+                        cleaned_frontmatter[key] = dt.isoformat()
+                    except ValueError:
+                        pass
+
+            # Handle all other fields
+            for key, value in frontmatter.items():
+                if key not in ['created', 'updated']:  # Skip dates as we handled them above
+                    if value not in [None, '', [], {}]:  # Skip empty/null values
+                        cleaned_frontmatter[key] = value
+
+            return cleaned_frontmatter, parts[2]
+        except yaml.YAMLError:
+            return {}, content
+
+    def load(self) -> List[Document]:
+        """Load and process the file."""
+        with open(self.file_path, encoding=self.encoding) as f:
+            content = f.read()
+
+        if self.file_path.endswith('.md'):
+            metadata, content = self._parse_frontmatter(content)
+        else:
+            metadata = {}
+
+        metadata['file_path'] = self.file_path
+
+        return [Document(page_content=content, metadata=metadata)]
+
+    def lazy_load(self) -> Iterator[Document]:
+        # TextLoader.lazy_load would skip the frontmatter handling of load
+        yield from self.load()
+
+
+EXTENSIONS_TO_LOADERS = {
+    ".pdf": PyMuPDFLoader,
+    ".pptx": UnstructuredPowerPointLoader,
+    ".ppt": UnstructuredPowerPointLoader,
+    ".xls": UnstructuredExcelLoader,
+    ".xlsx": UnstructuredExcelLoader,
+    ".docx": Docx2txtLoader,
+    ".doc": Docx2txtLoader,
+    ".txt": TextLoader,
+    ".md": MinimaTextLoader,
+    ".csv": CSVLoader,
+}
+
+
+def create_loader(file_path: str):
+    file_extension = Path(file_path).suffix.lower()
+    loader_class = EXTENSIONS_TO_LOADERS.get(file_extension)
+
+    if not loader_class:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+    return loader_class(file_path=file_path)
+
+
+def init_worker(memory_limit_mb: int):
+    """Cap the address space of a parse worker, so a runaway parser fails with MemoryError."""
+    if memory_limit_mb <= 0:
+        return
+    import resource
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def parse_file(file_path: str, chunk_size: int, chunk_overlap: int, separators: List[str]) -> List[tuple[str, dict]]:
+    """
+    Load and split a file. Only (text, metadata) pairs are returned, so that results
+    crossing the process boundary stay small and picklable.
+    """
+    loader = create_loader(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=separators,
+        # Character offset of every chunk within its page (or the whole text)
+        add_start_index=True
+    )
+    return [(doc.page_content, doc.metadata) for doc in loader.load_and_split(text_splitter)]
+
+
+# Plain text files are read in blocks of this many characters when streaming
+TEXT_BLOCK_SIZE = 1 << 20
+
+
+def _iter_text_blocks(file_path: str, encoding: str | None) -> Iterator[Document]:
+    """Read a plain text file in blocks cut at paragraph or line boundaries."""
+    with open(file_path, encoding=encoding) as f:
+        carry = ""
+        # Character offset of the next block within the file
+        offset = 0
+        while block := f.read(TEXT_BLOCK_SIZE):
+            text = carry + block
+            cut = text.rfind("\n\n")
+            if cut == -1:
+                cut = text.rfind("\n")
+            if cut == -1:
+                if len(text) < 4 * TEXT_BLOCK_SIZE:
+                    carry = text
+                    continue
+                cut = len(text)
+            yield Document(page_content=text[:cut], metadata={"source": file_path, "block_offset": offset})
+            offset += cut
+            carry = text[cut:]
+        if carry:
+            yield Document(page_content=carry, metadata={"source": file_path, "block_offset": offset})
+
+
+def iter_chunk_batches(
+        file_path: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        separators: List[str],
+        batch_size: int,
+) -> Iterator[List[tuple[str, dict]]]:
+    """
+    Load a file page by page (or row by row) and split every page as it arrives,
+    yielding (text, metadata) pairs in batches of at most batch_size chunks.
+    """
+    loader = create_loader(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=separators,
+        # Character offset of every chunk within its page (or the whole text)
+        add_start_index=True
+    )
+    # TextLoader.lazy_load reads the whole file into a single document
+    if type(loader) is TextLoader:
+        documents = _iter_text_blocks(file_path, loader.encoding)
+    else:
+        documents = loader.lazy_load()
+
+    batch = []
+    for document in documents:
+        for chunk in text_splitter.split_documents([document]):
+            # Offsets within a block of a streamed text file are made offsets within the file
+            block_offset = chunk.metadata.pop("block_offset", None)
+            if block_offset is not None:
+                chunk.metadata["start_index"] += block_offset
+            batch.append((chunk.page_content, chunk.metadata))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def stream_file(file_path: str, chunk_size: int, chunk_overlap: int, separators: List[str], batch_size: int, queue) -> int:
+    """
+    Worker side of streaming: put chunk batches on a (bounded, cross-process) queue,
+    followed by None. Blocks while the indexer is still embedding earlier batches.
+    """
+    chunks = 0
+    for batch in iter_chunk_batches(file_path, chunk_size, chunk_overlap, separators, batch_size):
+        queue.put(batch)
+        chunks += len(batch)
+    queue.put(None)
+    return chunks
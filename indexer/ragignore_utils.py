@@ -1,66 +1,259 @@
 import os
-import fnmatch
+import re
 import logging
-from pathlib import Path
-from typing import List, Set
+from functools import lru_cache
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
+RAGIGNORE_FILE_NAME = '.ragignore'
+
+
+def _read_patterns(ragignore_path: str) -> List[str]:
+    patterns = []
+    with open(ragignore_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            # Skip empty lines and comments
+            if not line or line.startswith('#'):
+                continue
+            patterns.append(line)
+    return patterns
+
+
 def load_ragignore(root_path: str) -> List[str]:
     """
     Loads ignore patterns from .ragignore file in the given root path.
     Returns a list of patterns to ignore.
     """
     ignore_patterns = []
-    ragignore_path = os.path.join(root_path, '.ragignore')
-    
+    ragignore_path = os.path.join(root_path, RAGIGNORE_FILE_NAME)
+
     if os.path.isfile(ragignore_path):
         logger.info(f"Found .ragignore file at {ragignore_path}")
         try:
-            with open(ragignore_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    # Skip empty lines and comments
-                    if not line or line.startswith('#'):
-                        continue
-                    ignore_patterns.append(line)
+            ignore_patterns = _read_patterns(ragignore_path)
             logger.info(f"Loaded {len(ignore_patterns)} ignore patterns from .ragignore")
         except Exception as e:
             logger.error(f"Error reading .ragignore file: {e}")
     else:
         logger.info(f"No .ragignore file found at {ragignore_path}")
-    
+
     return ignore_patterns
 
+
+def _translate_glob(glob: str) -> str:
+    """Translate a gitignore glob into a regex where only '**' crosses directory separators."""
+    out = []
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        if c == '*':
+            if glob.startswith('**', i) and (i == 0 or glob[i - 1] == '/') and (i + 2 == n or glob[i + 2] == '/'):
+                if i + 2 == n:
+                    # Trailing "/**" matches everything inside, but not the directory itself
+                    out.append('.+')
+                    i += 2
+                else:
+                    # Leading "**/" and inner "/**/" match zero or more directories
+                    out.append('(?:.*/)?')
+                    i += 3
+                continue
+            while i < n and glob[i] == '*':
+                i += 1
+            out.append('[^/]*')
+            continue
+        if c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = glob.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:end].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end + 1
+                continue
+        elif c == '\\' and i + 1 < n:
+            out.append(re.escape(glob[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+_GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+
+class _Pattern:
+    """One parsed .ragignore line."""
+
+    def __init__(self, pattern: str, index: int):
+        self.index = index
+        self.negated = False
+        if pattern.startswith('!'):
+            self.negated = True
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A slash at the start or in the middle anchors the pattern to the .ragignore directory,
+        # otherwise it matches the name of an entry at any depth
+        self.anchored = '/' in pattern
+        self.glob = pattern.lstrip('/')
+        self.literal = not _GLOB_CHARS.search(self.glob)
+
+    def regex(self) -> str:
+        # Directories are matched with a trailing slash, see IgnoreRules.match
+        return _translate_glob(self.glob) + ('/' if self.dir_only else '/?')
+
+
+def _combine(patterns: List[_Pattern]) -> Optional[re.Pattern]:
+    """
+    Combine patterns into one regex with a capture group per pattern, latest pattern first,
+    so the group that matches identifies the last matching pattern of the file.
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'({pattern.regex()})' for pattern in reversed(patterns)))
+
+
+class IgnoreRules:
+    """
+    The patterns of a single .ragignore file, compiled once.
+
+    Under gitignore semantics the last matching pattern decides. Literal names are looked
+    up in a dict, other patterns without a slash are matched against the entry name only
+    and anchored patterns against the path relative to the .ragignore directory. Each
+    lookup yields the index of its last matching pattern and the highest index wins.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        parsed = [_Pattern(pattern, index) for index, pattern in enumerate(patterns)]
+        parsed = [pattern for pattern in parsed if pattern.glob]
+
+        self._literals: dict[str, list[_Pattern]] = {}
+        for pattern in parsed:
+            if pattern.literal and not pattern.anchored:
+                self._literals.setdefault(pattern.glob, []).insert(0, pattern)
+        self._name_patterns = [p for p in parsed if not p.anchored and not p.literal]
+        self._path_patterns = [p for p in parsed if p.anchored]
+        self._name_regex = _combine(self._name_patterns)
+        self._path_regex = _combine(self._path_patterns)
+
+    @staticmethod
+    def _last_match(regex: Optional[re.Pattern], patterns: List[_Pattern], value: str) -> Optional[_Pattern]:
+        if regex is None:
+            return None
+        m = regex.fullmatch(value)
+        if m is None:
+            return None
+        return patterns[len(patterns) - m.lastindex]
+
+    def match(self, rel_path: str, is_dir: bool = False) -> Optional[bool]:
+        """
+        True if the path is ignored, False if a negated pattern re-includes it and
+        None if no pattern matches. rel_path uses '/' separators and is relative to
+        the directory of the .ragignore file.
+        """
+        name = rel_path.rpartition('/')[2]
+        suffix = '/' if is_dir else ''
+        candidates = [
+            next((p for p in self._literals.get(name, ()) if is_dir or not p.dir_only), None),
+            self._last_match(self._name_regex, self._name_patterns, name + suffix),
+            self._last_match(self._path_regex, self._path_patterns, rel_path + suffix),
+        ]
+        winner = max((p for p in candidates if p is not None), key=lambda p: p.index, default=None)
+        if winner is None:
+            return None
+        return not winner.negated
+
+
+class RagIgnore:
+    """
+    Ignore rules of a tree: the root .ragignore plus any nested .ragignore files.
+    Rules of deeper files take precedence over the rules of their parents.
+    """
+
+    def __init__(self, root: str, patterns: Optional[List[str]] = None):
+        self.root = root
+        self._rules: dict[str, Optional[IgnoreRules]] = {}
+        root_patterns = load_ragignore(root) if patterns is None else patterns
+        self._rules[''] = IgnoreRules(root_patterns) if root_patterns else None
+
+    def load_nested(self, rel_dir: str) -> None:
+        """Load the .ragignore file of a directory below the root."""
+        ragignore_path = os.path.join(self.root, rel_dir, RAGIGNORE_FILE_NAME)
+        try:
+            patterns = _read_patterns(ragignore_path)
+        except OSError:
+            patterns = []
+        except Exception as e:
+            logger.error(f"Error reading .ragignore file {ragignore_path}: {e}")
+            patterns = []
+        if patterns:
+            logger.info(f"Loaded {len(patterns)} ignore patterns from {ragignore_path}")
+        self._rules[rel_dir.replace(os.sep, '/')] = IgnoreRules(patterns) if patterns else None
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """
+        Whether an entry is ignored, assuming its parent directories are not. This is the
+        check used while walking, where ignored directories are never descended into.
+        """
+        rel_path = rel_path.replace(os.sep, '/')
+        rel_dir = rel_path
+        while True:
+            rel_dir = rel_dir.rpartition('/')[0]
+            rules = self._rules.get(rel_dir)
+            if rules is not None:
+                decision = rules.match(rel_path[len(rel_dir) + 1:] if rel_dir else rel_path, is_dir)
+                if decision is not None:
+                    return decision
+            if not rel_dir:
+                return False
+
+    def is_path_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Whether a path, absolute or relative to the root, or any of its parents is ignored."""
+        rel_path = os.path.relpath(path, self.root) if os.path.isabs(path) else path
+        parts = rel_path.replace(os.sep, '/').split('/')
+        for depth in range(1, len(parts)):
+            parent = '/'.join(parts[:depth])
+            if parent not in self._rules:
+                if os.path.isfile(os.path.join(self.root, parent, RAGIGNORE_FILE_NAME)):
+                    self.load_nested(parent)
+                else:
+                    self._rules[parent] = None
+            if self.is_ignored(parent, is_dir=True):
+                return True
+        return self.is_ignored('/'.join(parts), is_dir=is_dir)
+
+
+@lru_cache(maxsize=32)
+def _compile_patterns(ignore_patterns: tuple[str, ...]) -> IgnoreRules:
+    return IgnoreRules(list(ignore_patterns))
+
+
 def should_ignore_path(path: str, ignore_patterns: List[str]) -> bool:
     """
     Determines if a path should be ignored based on the ignore patterns.
-    Supports both exact matches and glob-style patterns.
+    The patterns are compiled once and matched against every component of the path,
+    so a matching directory also ignores everything inside it.
     """
-    # Get the relative path from the root
     if not ignore_patterns:
         return False
-    
-    # Get base name and normalized path
-    base_name = os.path.basename(path)
-    norm_path = os.path.normpath(path)
-    
-    for pattern in ignore_patterns:
-        # Check for exact directory/file name match
-        if base_name == pattern:
-            logger.debug(f"Ignoring {path} - exact match with pattern: {pattern}")
-            return True
-            
-        # Check if pattern matches the path using glob pattern
-        if fnmatch.fnmatch(base_name, pattern):
-            logger.debug(f"Ignoring {path} - glob match with pattern: {pattern}")
+
+    rules = _compile_patterns(tuple(ignore_patterns))
+    parts = [part for part in os.path.normpath(path).replace(os.sep, '/').split('/') if part]
+    for depth in range(1, len(parts) + 1):
+        is_dir = depth < len(parts)
+        if rules.match('/'.join(parts[:depth]), is_dir=is_dir):
+            logger.debug(f"Ignoring {path} - matched ignore patterns")
             return True
-            
-        # Check if any parent directory matches the pattern
-        path_parts = Path(norm_path).parts
-        for part in path_parts:
-            if part == pattern or fnmatch.fnmatch(part, pattern):
-                logger.debug(f"Ignoring {path} - directory component match: {part} with pattern: {pattern}")
-                return True
-    
     return False
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import logging
+from enum import Enum
+from indexer import Indexer
+from async_queue import AsyncQueue
+from fs_watcher import FileWatcher, WATCH_MODE
+from async_loop import IndexingStats, crawl_loop, index_loop
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerState(Enum):
+    idle = "idle"
+    crawling = "crawling"
+    indexing = "indexing"
+
+
+class IndexingScheduler:
+    """
+    Owns the indexing pipeline: exactly one index loop consuming the queue, the file
+    watcher, and periodic reconciliation crawls of which at most one runs at a time.
+    """
+
+    def __init__(self, async_queue: AsyncQueue, indexer: Indexer, reconcile_interval: int):
+        self.async_queue = async_queue
+        self.indexer = indexer
+        self.reconcile_interval = reconcile_interval
+        self.stats = IndexingStats(report_interval=indexer.config.INDEX_STATS_INTERVAL)
+        self._reconcile_lock = asyncio.Lock()
+        self._crawling = False
+        self._tasks: list[asyncio.Task] = []
+        self.reconciliations = 0
+        self.skipped_reconciliations = 0
+        self.last_reconcile_started: float | None = None
+        self.last_reconcile_finished: float | None = None
+
+    def start(self):
+        if self._tasks:
+            raise RuntimeError("Indexing scheduler is already running")
+        self._tasks.append(asyncio.create_task(
+            index_loop(self.async_queue, self.indexer, persistent=True, stats=self.stats)
+        ))
+        if WATCH_MODE != "off":
+            self._tasks.append(asyncio.create_task(FileWatcher(self.async_queue).run()))
+        self._tasks.append(asyncio.create_task(self._reconcile_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def reconcile(self) -> bool:
+        """Crawl the whole tree and wait until everything it enqueued is indexed."""
+        if self._reconcile_lock.locked():
+            self.skipped_reconciliations += 1
+            logger.info("Reconciliation already in progress, skipping")
+            return False
+        async with self._reconcile_lock:
+            logger.info("Reconciliation started")
+            self.last_reconcile_started = time.time()
+            done = asyncio.get_running_loop().create_future()
+            self._crawling = True
+            try:
+                await crawl_loop(self.async_queue, done=done)
+            finally:
+                self._crawling = False
+            await done
+            self.reconciliations += 1
+            self.last_reconcile_finished = time.time()
+            logger.info(f"Reconciliation finished in {self.last_reconcile_finished - self.last_reconcile_started:.1f} seconds")
+            return True
+
+    async def _reconcile_periodically(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"error in scheduled reindexing {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    @property
+    def state(self) -> SchedulerState:
+        if self._crawling:
+            return SchedulerState.crawling
+        if self._reconcile_lock.locked() or self.async_queue.size() > 0:
+            return SchedulerState.indexing
+        return SchedulerState.idle
+
+    def status(self) -> dict:
+        backlog = self.async_queue.size()
+        files_per_second = self.stats.recent_files_per_second
+        eta_seconds = round(backlog / files_per_second) if backlog and files_per_second > 0 else None
+        return {
+            "state": self.state.value,
+            "backlog": backlog,
+            "eta_seconds": eta_seconds,
+            "files_per_second": round(files_per_second, 2),
+            "chunks_per_second": round(self.stats.chunks_per_second, 2),
+            "indexing_mode": self.indexer.config.INDEXING_MODE,
+            "watch_mode": WATCH_MODE,
+            "reconcile_interval_seconds": self.reconcile_interval,
+            "reconciliations": self.reconciliations,
+            "skipped_reconciliations": self.skipped_reconciliations,
+            "last_reconcile_started": self.last_reconcile_started,
+            "last_reconcile_finished": self.last_reconcile_finished,
+        }
@@ -1,4 +1,7 @@
+import json
+import time
 import logging
+from sqlalchemy import bindparam, event, insert, inspect, text, update
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 
 from singleton import Singleton
@@ -16,11 +19,18 @@ class IndexingStatus(Enum):
 class MinimaDoc(SQLModel, table=True):
     fpath: str = Field(primary_key=True)
     last_updated_seconds: int | None = Field(default=None, index=True)
+    content_hash: str | None = Field(default=None)
+    # JSON encoded list of per-chunk hashes, in chunk order
+    chunk_hashes: str | None = Field(default=None)
+    # When the file was first stored, None for files stored before this was tracked
+    added_seconds: float | None = Field(default=None)
 
 
 class MinimaDocUpdate(SQLModel):
     fpath: str | None = None
     last_updated_seconds: int | None = None
+    content_hash: str | None = None
+    chunk_hashes: str | None = None
 
 
 sqlite_file_name = "/indexer/storage/database.db"
@@ -29,12 +39,42 @@ sqlite_url = f"sqlite:///{sqlite_file_name}"
 connect_args = {"check_same_thread": False}
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
+# SQLite limits the number of bound parameters per statement
+SQLITE_MAX_VARIABLES = 900
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets the crawler and the indexing threads read while a batch is being written
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Durable at checkpoints, which is enough for state that can be rebuilt by a crawl
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 
 class MinimaStore(metaclass=Singleton):
 
     @staticmethod
     def create_db_and_tables():
         SQLModel.metadata.create_all(engine)
+        MinimaStore._add_missing_columns()
+
+    @staticmethod
+    def _add_missing_columns():
+        """create_all does not alter existing tables, so add columns introduced after the table was created."""
+        table = MinimaDoc.__table__
+        existing_columns = {column["name"] for column in inspect(engine).get_columns(table.name)}
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    logger.info(f"Added column {column.name} to {table.name}")
 
     @staticmethod
     def delete_m_doc(fpath: str) -> None:
@@ -44,7 +84,22 @@ class MinimaStore(metaclass=Singleton):
             doc = results.one()
             session.delete(doc)
             session.commit()
-            print("doc deleted:", doc)
+            logger.debug(f"doc deleted: {doc}")
+
+    @staticmethod
+    def delete_m_docs_under(path: str) -> list[str]:
+        """Delete the doc for a file path, or the docs of all files below a directory path."""
+        prefix = path.rstrip("/") + "/"
+        with Session(engine) as session:
+            statement = select(MinimaDoc).where(
+                (MinimaDoc.fpath == path) | MinimaDoc.fpath.startswith(prefix, autoescape=True)
+            )
+            docs = session.exec(statement).all()
+            removed_files = [doc.fpath for doc in docs]
+            for doc in docs:
+                session.delete(doc)
+            session.commit()
+        return removed_files
 
     @staticmethod
     def select_m_doc(fpath: str) -> MinimaDoc:
@@ -52,54 +107,136 @@ class MinimaStore(metaclass=Singleton):
             statement = select(MinimaDoc).where(MinimaDoc.fpath == fpath)
             results = session.exec(statement)
             doc = results.one()
-            print("doc:", doc)
+            logger.debug(f"doc: {doc}")
             return doc
 
     @staticmethod
-    def find_removed_files(existing_file_paths: set[str]):
-        removed_files: list[str] = []
-        with Session(engine) as session:
-            statement = select(MinimaDoc)
-            results = session.exec(statement)
-            logger.debug(f"find_removed_files count found {results}")
-            for doc in results:
-                logger.debug(f"find_removed_files file {doc.fpath} checking to remove")
-                if doc.fpath not in existing_file_paths:
-                    logger.debug(f"find_removed_files file {doc.fpath} does not exist anymore, removing")
-                    removed_files.append(doc.fpath)
-        for fpath in removed_files:
-            MinimaStore.delete_m_doc(fpath)
+    def find_removed_files(existing_file_paths: set[str], since: float | None = None) -> list[str]:
+        """
+        Delete the docs of files that are not in existing_file_paths and return their paths.
+        The existing paths go into a temporary table, so the comparison is a single anti-join.
+        Docs added at or after since (the start of the crawl that listed the existing paths),
+        for example by the file watcher while the crawl was queued, are kept.
+        """
+        table = MinimaDoc.__tablename__
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TEMP TABLE IF NOT EXISTS existing_paths (fpath TEXT PRIMARY KEY)"))
+            connection.execute(text("DELETE FROM existing_paths"))
+            if existing_file_paths:
+                connection.execute(
+                    text("INSERT OR IGNORE INTO existing_paths (fpath) VALUES (:fpath)"),
+                    [{"fpath": fpath} for fpath in existing_file_paths]
+                )
+            removed_condition = f"NOT EXISTS (SELECT 1 FROM existing_paths e WHERE e.fpath = {table}.fpath)"
+            if since is not None:
+                removed_condition += f" AND ({table}.added_seconds IS NULL OR {table}.added_seconds < :since)"
+            parameters = {"since": since} if since is not None else {}
+            removed_files = list(
+                connection.execute(text(f"SELECT fpath FROM {table} WHERE {removed_condition}"), parameters).scalars()
+            )
+            if removed_files:
+                connection.execute(text(f"DELETE FROM {table} WHERE {removed_condition}"), parameters)
+            connection.execute(text("DROP TABLE existing_paths"))
+        logger.debug(f"find_removed_files removed {len(removed_files)} of the stored files")
         return removed_files
 
     @staticmethod
     def check_needs_indexing(fpath: str, last_updated_seconds: int) -> IndexingStatus:
-        indexing_status: IndexingStatus = IndexingStatus.no_need_reindexing
+        return MinimaStore.check_needs_indexing_batch({fpath: last_updated_seconds})[fpath]
+
+    @staticmethod
+    def check_needs_indexing_batch(files: dict[str, int]) -> dict[str, IndexingStatus]:
+        """
+        Check many files at once and record their new modification times, all in one
+        transaction. files maps paths to their current last_updated_seconds.
+        """
         try:
-            with Session(engine) as session:
-                statement = select(MinimaDoc).where(MinimaDoc.fpath == fpath)
-                results = session.exec(statement)
-                doc = results.first()
-                if doc is not None:
-                    logger.debug(
-                        f"file {fpath} new last updated={last_updated_seconds} old last updated: {doc.last_updated_seconds}"
+            with engine.begin() as connection:
+                stored: dict[str, int | None] = {}
+                paths = list(files)
+                for start in range(0, len(paths), SQLITE_MAX_VARIABLES):
+                    statement = select(MinimaDoc.fpath, MinimaDoc.last_updated_seconds).where(
+                        MinimaDoc.fpath.in_(paths[start:start + SQLITE_MAX_VARIABLES])
                     )
-                    if doc.last_updated_seconds < last_updated_seconds:
-                        indexing_status = IndexingStatus.need_reindexing
-                        logger.debug(f"file {fpath} needs indexing, timestamp changed")
-                        doc_update = MinimaDocUpdate(fpath=fpath, last_updated_seconds=last_updated_seconds)
-                        doc_data = doc_update.model_dump(exclude_unset=True)
-                        doc.sqlmodel_update(doc_data)
-                        session.add(doc)
-                        session.commit()
+                    stored.update((fpath, mtime) for fpath, mtime in connection.execute(statement))
+
+                statuses: dict[str, IndexingStatus] = {}
+                new_docs, changed_docs = [], []
+                now = time.time()
+                for fpath, last_updated_seconds in files.items():
+                    if fpath not in stored:
+                        statuses[fpath] = IndexingStatus.new_file
+                        new_docs.append({"fpath": fpath, "last_updated_seconds": last_updated_seconds, "added_seconds": now})
+                    elif stored[fpath] != last_updated_seconds:
+                        statuses[fpath] = IndexingStatus.need_reindexing
+                        changed_docs.append({"b_fpath": fpath, "b_last_updated_seconds": last_updated_seconds})
                     else:
-                        logger.debug(f"file {fpath} doesn't need indexing, timestamp same")
-                else:
-                    doc = MinimaDoc(fpath=fpath, last_updated_seconds=last_updated_seconds)
-                    session.add(doc)
-                    session.commit()
-                    logger.debug(f"file {fpath} needs indexing, new file")
-                    indexing_status = IndexingStatus.new_file
-            return indexing_status
+                        statuses[fpath] = IndexingStatus.no_need_reindexing
+
+                if new_docs:
+                    connection.execute(insert(MinimaDoc), new_docs)
+                if changed_docs:
+                    connection.execute(
+                        update(MinimaDoc)
+                        .where(MinimaDoc.fpath == bindparam("b_fpath"))
+                        .values(last_updated_seconds=bindparam("b_last_updated_seconds")),
+                        changed_docs
+                    )
+            logger.debug(
+                f"checked {len(files)} files: {len(new_docs)} new, {len(changed_docs)} changed, "
+                f"{len(files) - len(new_docs) - len(changed_docs)} unchanged"
+            )
+            return statuses
         except Exception as e:
-            logger.error(f"error updating file in the store {e}, skipping indexing")
-            return IndexingStatus.no_need_reindexing
+            logger.error(f"error updating files in the store {e}, skipping indexing")
+            return {fpath: IndexingStatus.no_need_reindexing for fpath in files}
+
+    @staticmethod
+    def get_hashes(fpath: str) -> tuple[str | None, list[str] | None]:
+        """Return the stored content hash and per-chunk hashes of a file, if any."""
+        with Session(engine) as session:
+            statement = select(MinimaDoc).where(MinimaDoc.fpath == fpath)
+            doc = session.exec(statement).first()
+            if doc is None:
+                return None, None
+            chunk_hashes = json.loads(doc.chunk_hashes) if doc.chunk_hashes is not None else None
+            return doc.content_hash, chunk_hashes
+
+    @staticmethod
+    def update_hashes(fpath: str, content_hash: str, chunk_hashes: list[str]) -> None:
+        with Session(engine) as session:
+            statement = select(MinimaDoc).where(MinimaDoc.fpath == fpath)
+            doc = session.exec(statement).first()
+            if doc is None:
+                logger.warning(f"file {fpath} is not in the store, hashes not recorded")
+                return
+            doc_update = MinimaDocUpdate(content_hash=content_hash, chunk_hashes=json.dumps(chunk_hashes))
+            doc.sqlmodel_update(doc_update.model_dump(exclude_unset=True))
+            session.add(doc)
+            session.commit()
+
+    @staticmethod
+    def select_chunk_hashes() -> dict[str, str | None]:
+        """Map every stored path to its JSON encoded chunk hashes, None for files indexed without them."""
+        with Session(engine) as session:
+            statement = select(MinimaDoc.fpath, MinimaDoc.chunk_hashes)
+            return {fpath: chunk_hashes for fpath, chunk_hashes in session.exec(statement)}
+
+    @staticmethod
+    def select_invalidated() -> list[str]:
+        """Paths of files marked for re-indexing by invalidate."""
+        with Session(engine) as session:
+            statement = select(MinimaDoc.fpath).where(MinimaDoc.last_updated_seconds == 0)
+            return list(session.exec(statement))
+
+    @staticmethod
+    def invalidate(fpaths: list[str]) -> None:
+        """Forget the indexed state of files so the next crawl indexes them from scratch."""
+        with Session(engine) as session:
+            statement = select(MinimaDoc).where(MinimaDoc.fpath.in_(fpaths))
+            for doc in session.exec(statement):
+                doc.last_updated_seconds = 0
+                doc.content_hash = None
+                doc.chunk_hashes = None
+                session.add(doc)
+            session.commit()
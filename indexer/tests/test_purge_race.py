@@ -0,0 +1,78 @@
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+import pytest
+from sqlmodel import SQLModel, create_engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+from storage import MinimaStore
+from async_queue import AsyncQueue, PRIORITY_BULK, PRIORITY_HIGH
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}", connect_args={"check_same_thread": False})
+    monkeypatch.setattr(storage, "engine", engine)
+    SQLModel.metadata.create_all(engine)
+    yield
+    engine.dispose()
+
+
+def stored_paths() -> set[str]:
+    return set(MinimaStore.select_chunk_hashes())
+
+
+async def crawl_with_watcher_event() -> list[str]:
+    """Queue a crawl listing only a, then a watcher event for a file created meanwhile."""
+    queue = AsyncQueue()
+    crawl_started = time.time()
+    queue.enqueue({"path": "/docs/a.txt", "last_updated_seconds": 2, "type": "file"}, PRIORITY_BULK)
+    queue.enqueue(
+        {"existing_file_paths": ["/docs/a.txt"], "crawl_started": crawl_started, "type": "all_files"},
+        PRIORITY_BULK
+    )
+    queue.enqueue({"path": "/docs/new.txt", "last_updated_seconds": 3, "type": "file"}, PRIORITY_HIGH)
+
+    processed = []
+    while queue.size():
+        message = await queue.dequeue()
+        if message["type"] == "file":
+            MinimaStore.check_needs_indexing_batch({message["path"]: message["last_updated_seconds"]})
+            processed.append(message["path"])
+        elif message["type"] == "all_files":
+            MinimaStore.find_removed_files(set(message["existing_file_paths"]), since=message["crawl_started"])
+            processed.append("all_files")
+    return processed
+
+
+def test_purge_keeps_files_stored_during_the_crawl():
+    MinimaStore.check_needs_indexing_batch({"/docs/a.txt": 1, "/docs/deleted.txt": 1})
+
+    processed = asyncio.run(crawl_with_watcher_event())
+
+    # The watcher event is handled ahead of the crawl's aggregate message
+    assert processed == ["/docs/new.txt", "/docs/a.txt", "all_files"]
+    assert stored_paths() == {"/docs/a.txt", "/docs/new.txt"}
+
+
+def test_purge_without_crawl_start_removes_unlisted_files():
+    MinimaStore.check_needs_indexing_batch({"/docs/a.txt": 1, "/docs/b.txt": 1})
+
+    removed = MinimaStore.find_removed_files({"/docs/a.txt"})
+
+    assert removed == ["/docs/b.txt"]
+    assert stored_paths() == {"/docs/a.txt"}
+
+
+def test_purge_removes_files_stored_before_the_added_column():
+    MinimaStore.check_needs_indexing_batch({"/docs/old.txt": 1})
+    with storage.engine.begin() as connection:
+        connection.execute(storage.text("UPDATE minimadoc SET added_seconds = NULL"))
+
+    removed = MinimaStore.find_removed_files(set(), since=time.time())
+
+    assert removed == ["/docs/old.txt"]
@@ -72,7 +72,7 @@ async def poll_firestore():
                         doc_ref.update({
                             'status': 'COMPLETED',
                             'links': response['result']['links'],
-                            'result': response['result']['output']
+                            'result': ". ".join(chunk['text'] for chunk in response['result']['chunks'])
                         })
                     else:
                         logger.error(f"Error in processing request: {response['error']}")
@@ -0,0 +1,141 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_URL = os.environ.get("INDEXER_VERSION_URL", "http://indexer:8000/index_version")
+# How long a fetched index version is trusted before asking the indexer again
+INDEX_VERSION_TTL_SECONDS = float(os.environ.get("INDEX_VERSION_TTL_SECONDS", "5"))
+INDEX_VERSION_TIMEOUT_SECONDS = float(os.environ.get("INDEX_VERSION_TIMEOUT_SECONDS", "2"))
+
+
+def normalize_question(text: str) -> str:
+    """Questions differing only in case, spacing or final punctuation share their entries."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split()).rstrip("?!. ")
+
+
+class TTLCache:
+    """
+    LRU cache with a time to live, keyed by the parts given to get and put (model,
+    normalized question and, for answers, the index version). Expired entries count as
+    misses and are dropped when looked up or when they reach the LRU end.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[bytes, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _key(*parts: str) -> bytes:
+        return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=16).digest()
+
+    def get(self, *parts: str) -> Any | None:
+        if not self.enabled:
+            return None
+        key = self._key(*parts)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, value: Any, *parts: str):
+        if not self.enabled:
+            return
+        key = self._key(*parts)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class IndexVersion:
+    """
+    The indexer's index version, a boot id and a counter of writes and deletes. It is
+    fetched at most every INDEX_VERSION_TTL_SECONDS; None when the indexer cannot be
+    reached, in which case answers are neither cached nor served from the cache.
+    """
+
+    def __init__(self, url: str = INDEX_VERSION_URL, ttl_seconds: float = INDEX_VERSION_TTL_SECONDS):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self._version: str | None = None
+        self._fetched_at = float("-inf")
+        self._client: httpx.AsyncClient | None = None
+        self.fetch_errors = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=INDEX_VERSION_TIMEOUT_SECONDS)
+        return self._client
+
+    async def aget(self) -> str | None:
+        if time.monotonic() - self._fetched_at < self.ttl_seconds:
+            return self._version
+        try:
+            response = await self._get_client().get(self.url)
+            response.raise_for_status()
+            version = response.json()["index_version"]
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            logger.warning(f"Unable to fetch the index version, answers are not cached: {e}")
+            self.fetch_errors += 1
+            version = None
+        if version != self._version:
+            logger.info(f"Index version {self._version} -> {version}")
+        self._version = version
+        self._fetched_at = time.monotonic()
+        return version
+
+    def stats(self) -> dict:
+        return {"index_version": self._version, "fetch_errors": self.fetch_errors}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
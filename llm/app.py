@@ -1,5 +1,6 @@
 import logging
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi import WebSocket
 from llm_chain import LLMChain
@@ -9,11 +10,27 @@ import async_socket_to_chat
 import async_question_to_answer
 import async_answer_to_socket
 
-app = FastAPI()
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("llm")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models are loaded and warmed once, all chats share them
+    app.state.llm_chain = LLMChain()
+    await asyncio.to_thread(app.state.llm_chain.warm_up)
+    yield
+    await app.state.llm_chain.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/metrics")
+async def metrics():
+    return app.state.llm_chain.stats()
+
+
 @app.websocket("/llm/")
 async def chat_client(websocket: WebSocket):
 
@@ -21,11 +38,11 @@ async def chat_client(websocket: WebSocket):
     response_queue = AsyncQueue()
 
     answer_to_socket_promise = async_answer_to_socket.loop(response_queue, websocket)
-    question_to_answer_promise = async_question_to_answer.loop(question_queue, response_queue)
+    question_to_answer_promise = async_question_to_answer.loop(question_queue, response_queue, app.state.llm_chain)
     socket_to_chat_promise = async_socket_to_chat.loop(websocket, question_queue, response_queue)
 
     await asyncio.gather(
         answer_to_socket_promise,
         question_to_answer_promise,
         socket_to_chat_promise,
-    )
\ No newline at end of file
+    )
@@ -1,4 +1,5 @@
 import json
+import uuid
 import logging
 from llm_chain import LLMChain
 from async_queue import AsyncQueue
@@ -10,15 +11,18 @@ logger = logging.getLogger("chat")
 async def loop(
         questions_queue: AsyncQueue,
         response_queue: AsyncQueue,
+        llm_chain: LLMChain,
 ):
 
-    llm_chain = LLMChain()
+    # The chain is shared, only the chat history belongs to this connection
+    thread_id = str(uuid.uuid4())
 
     while True:
         data = await questions_queue.dequeue()
         data = data.replace("\n", "")
 
         if data == cfc.CFC_CLIENT_DISCONNECTED:
+            await llm_chain.adelete_thread(thread_id)
             response_queue.enqueue(
                 json.dumps({
                     "reporter": "output_message",
@@ -44,12 +48,36 @@ async def loop(
             )
             
         elif data:
-            result = llm_chain.invoke(data)
-            response_queue.enqueue(
-                json.dumps({
-                    "reporter": "output_message",
-                    "type": "answer",
-                    "message": result["answer"],
-                    "links": list(result["links"])
-                })
-            )
\ No newline at end of file
+            result = {}
+            async for result in llm_chain.astream(data, thread_id):
+                if "token" in result:
+                    response_queue.enqueue(
+                        json.dumps({
+                            "reporter": "output_message",
+                            "type": "answer",
+                            "message": result["token"],
+                            "links": []
+                        })
+                    )
+            # The full message replaces the partial answer in the chat
+            if "error" in result:
+                response_queue.enqueue(
+                    json.dumps({
+                        "reporter": "output_message",
+                        "type": "full",
+                        "message": f"Error: {result['error']}",
+                        "links": []
+                    })
+                )
+            else:
+                response_queue.enqueue(
+                    json.dumps({
+                        "reporter": "output_message",
+                        "type": "full",
+                        "message": result["answer"],
+                        "links": list(result["links"]),
+                        "ttft_ms": result["ttft_ms"],
+                        "total_ms": result["total_ms"],
+                        "cached": result.get("cached", False)
+                    })
+                )
@@ -0,0 +1,82 @@
+"""
+End-to-end latency of the sequential and the parallel LLM graph.
+
+Builds an LLMChain for each LLM_GRAPH_MODE against the running Ollama, Qdrant and
+indexer, and asks the same questions through both in alternating order, so that both
+see the same load and caches. Every question is followed by a follow-up in the same
+chat, which is where the parallel graph also saves the contextualization call. Reports
+time to first token and total time per mode, for first and follow-up questions.
+
+    docker compose -f docker-compose-ollama.yml exec llm python benchmarks/graph_latency.py --questions 10
+"""
+import os
+import sys
+import uuid
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_chain import GRAPH_MODES, LLMChain, LLMConfig
+
+QUESTIONS = [
+    ("How do I configure the indexer?", "Which settings does it need?"),
+    ("What is the refund policy for annual plans?", "Does it apply to monthly plans too?"),
+    ("Summarize the onboarding checklist", "Who signs it off?"),
+    ("Which services depend on the payments database?", "What happens when it is down?"),
+    ("Where are the quarterly sales numbers?", "How did they change since last year?"),
+    ("Explain the incident response process", "Who is on call for it?"),
+    ("What changed in the latest release notes?", "Are there breaking changes?"),
+    ("Who owns the data retention policy?", "When was it last reviewed?"),
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def ask(chain: LLMChain, question: str, thread_id: str) -> dict:
+    result = {}
+    async for result in chain.astream(question, thread_id):
+        pass
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+async def run(args):
+    chains = {mode: LLMChain(LLMConfig(graph_mode=mode)) for mode in GRAPH_MODES}
+    for chain in chains.values():
+        await asyncio.to_thread(chain.warm_up)
+    timings = {(mode, turn): {"ttft_ms": [], "total_ms": []} for mode in GRAPH_MODES for turn in ("first", "follow-up")}
+    for i in range(args.questions):
+        question, follow_up = QUESTIONS[i % len(QUESTIONS)]
+        # Alternate which mode goes first, so that neither always gets warm caches
+        modes = GRAPH_MODES if i % 2 == 0 else tuple(reversed(GRAPH_MODES))
+        for mode in modes:
+            thread_id = str(uuid.uuid4())
+            for turn, text in (("first", question), ("follow-up", follow_up)):
+                result = await ask(chains[mode], text, thread_id)
+                for key in ("ttft_ms", "total_ms"):
+                    timings[(mode, turn)][key].append(result[key])
+            await chains[mode].adelete_thread(thread_id)
+
+    print(f"{args.questions} questions with a follow-up each")
+    for (mode, turn), values in timings.items():
+        ttft, total = sorted(values["ttft_ms"]), sorted(values["total_ms"])
+        print(
+            f"{mode:>10} {turn:>9}: time to first token mean {statistics.mean(ttft):6.0f} ms  p50 {percentile(ttft, 0.5):6.0f} ms  "
+            f"total mean {statistics.mean(total):6.0f} ms  p50 {percentile(total, 0.5):6.0f} ms"
+        )
+    for chain in chains.values():
+        await chain.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=len(QUESTIONS))
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Connect latency and memory of many open chats on the llm service.
+
+Opens a number of WebSocket connections to /llm/ at once, sends the chat start message
+on each and waits for its reply, which needs the question loop and its LLMChain to be
+ready. Reports connect and first-reply latency percentiles, and with --pid the RSS of
+that process and its children before connecting, with all sockets open and after they
+are closed. Requires websockets (installed with uvicorn[standard]).
+
+    docker compose -f docker-compose-ollama.yml exec llm python benchmarks/websocket_connections.py --sockets 100 --pid 1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import control_flow_commands as cfc
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def tree_rss_mb(pid: int) -> float:
+    """RSS of a process and all its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name in parentheses may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+async def connect(url, timeout, connect_latencies, ready_latencies):
+    start = time.perf_counter()
+    socket = await websockets.connect(url, open_timeout=timeout, max_size=None)
+    connect_latencies.append(time.perf_counter() - start)
+    await socket.send(cfc.CFC_CHAT_STARTED)
+    await asyncio.wait_for(socket.recv(), timeout)
+    ready_latencies.append(time.perf_counter() - start)
+    return socket
+
+
+def report(name, latencies):
+    latencies.sort()
+    print(
+        f"{name} ms: mean {statistics.mean(latencies) * 1000:.0f}  "
+        f"p50 {percentile(latencies, 0.50) * 1000:.0f}  "
+        f"p90 {percentile(latencies, 0.90) * 1000:.0f}  "
+        f"p99 {percentile(latencies, 0.99) * 1000:.0f}  "
+        f"max {latencies[-1] * 1000:.0f}"
+    )
+
+
+async def run(args):
+    rss = {}
+    if args.pid:
+        rss["before"] = tree_rss_mb(args.pid)
+    connect_latencies, ready_latencies = [], []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(connect(args.url, args.timeout, connect_latencies, ready_latencies) for _ in range(args.sockets)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    sockets = [result for result in results if not isinstance(result, BaseException)]
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if args.pid:
+        # Give the server a moment to settle after the burst
+        await asyncio.sleep(args.settle)
+        rss["open"] = tree_rss_mb(args.pid)
+    await asyncio.gather(*(socket.close() for socket in sockets))
+    if args.pid:
+        await asyncio.sleep(args.settle)
+        rss["closed"] = tree_rss_mb(args.pid)
+
+    print(f"{len(sockets)} of {args.sockets} sockets ready in {elapsed:.1f} s, {len(failures)} failed")
+    if failures:
+        print(f"first failure: {failures[0]!r}")
+    if sockets:
+        report("connect", connect_latencies)
+        report("first reply", ready_latencies)
+    if rss:
+        print(
+            f"RSS MB: before {rss['before']:.0f}  {len(sockets)} open {rss['open']:.0f}  closed {rss['closed']:.0f}  "
+            f"per socket {(rss['open'] - rss['before']) / max(len(sockets), 1):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://localhost:8000/llm/")
+    parser.add_argument("--sockets", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--pid", type=int, help="server process to measure RSS of, with its children")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait before measuring RSS")
+    asyncio.run(run(parser.parse_args()))
@@ -1,17 +1,20 @@
 import os
+import time
 import uuid
 import torch
 import datetime
 import logging
 from dataclasses import dataclass
-from typing import Sequence, Optional
+from typing import AsyncIterator, Sequence, Optional
+from concurrent.futures import ThreadPoolExecutor
 from langchain.schema import Document
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from langchain_ollama import ChatOllama
 from minima_embed import MinimaEmbeddings
 from langgraph.graph import START, StateGraph
-from langchain_qdrant import QdrantVectorStore
+from langchain_core.runnables import RunnableLambda
 from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
 from langgraph.graph.message import add_messages
 from typing_extensions import Annotated, TypedDict
 from langgraph.checkpoint.memory import MemorySaver
@@ -19,7 +22,8 @@ from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain.chains.retrieval import create_retrieval_chain
 from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import CrossEncoderReranker
+from answer_cache import IndexVersion, TTLCache, normalize_question
+from qdrant_retriever import BoundedCrossEncoderReranker, QdrantRetriever
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_community.cross_encoders.huggingface import HuggingFaceCrossEncoder
@@ -27,6 +31,14 @@ from langchain.chains.history_aware_retriever import create_history_aware_retrie
 
 logger = logging.getLogger(__name__)
 
+# sequential: enhance the query, then contextualize it and retrieve with it
+# parallel: retrieve with the question while the query is enhanced and retrieved with,
+# then merge both results
+GRAPH_MODES = ("sequential", "parallel")
+
+# Tag of the LLM call that generates the answer, its tokens are the ones streamed to the chat
+ANSWER_TAG = "answer"
+
 CONTEXTUALIZE_Q_SYSTEM_PROMPT = (
     "Given a chat history and the latest user question "
     "which might reference context in the chat history, "
@@ -69,6 +81,15 @@ class LLMConfig:
     ollama_model: str = os.environ.get("OLLAMA_MODEL")
     rerank_model: str = os.environ.get("RERANKER_MODEL")
     temperature: float = 0.5
+    # Cross-encoder reranks running at once, further questions wait for a free worker
+    rerank_workers: int = int(os.environ.get("RERANK_WORKERS", "2"))
+    graph_mode: str = os.environ.get("LLM_GRAPH_MODE", "parallel")
+    # Enhanced queries only depend on the question and the model, answers also on the
+    # indexed content; 0 entries disables a cache
+    enhancement_cache_entries: int = int(os.environ.get("ENHANCEMENT_CACHE_ENTRIES", "1000"))
+    enhancement_cache_ttl_seconds: float = float(os.environ.get("ENHANCEMENT_CACHE_TTL_SECONDS", "86400"))
+    answer_cache_entries: int = int(os.environ.get("ANSWER_CACHE_ENTRIES", "0"))
+    answer_cache_ttl_seconds: float = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
     device: torch.device = torch.device(
         "mps" if torch.backends.mps.is_available() else
         "cuda" if torch.cuda.is_available() else
@@ -89,17 +110,32 @@ class State(TypedDict):
     context: str
     answer: str
     init_query: str
+    # Parallel graph: the question made standalone and the enhanced query, and the chunks
+    # retrieved with each
+    question: str
+    question_context: list
+    enhanced_query: str
+    enhanced_context: list
 
 
 class LLMChain:
-    """A chain for processing LLM queries with context awareness and retrieval capabilities"""
+    """
+    A chain for processing LLM queries with context awareness and retrieval capabilities.
+    One instance is shared by all chats of the process, each chat keeps its history in
+    its own thread of the checkpointer.
+    """
 
     def __init__(self, config: Optional[LLMConfig] = None):
         """Initialize the LLM Chain with optional custom configuration"""
         self.localConfig = LocalConfig()
         self.config = config or LLMConfig()
         self.llm = self._setup_llm()
-        self.document_store = self._setup_document_store()
+        self.retriever = self._setup_retriever()
+        self.reranker = self._setup_reranker()
+        self.checkpointer = MemorySaver()
+        self.enhancement_cache = TTLCache(self.config.enhancement_cache_entries, self.config.enhancement_cache_ttl_seconds)
+        self.answer_cache = TTLCache(self.config.answer_cache_entries, self.config.answer_cache_ttl_seconds)
+        self.index_version = IndexVersion()
         self.chain = self._setup_chain()
         self.graph = self._create_graph()
 
@@ -111,27 +147,33 @@ class LLMChain:
             temperature=self.config.temperature
         )
 
-    def _setup_document_store(self) -> QdrantVectorStore:
-        """Initialize the document store with vector embeddings"""
-        qdrant = QdrantClient(host=self.config.qdrant_host)
-        embed_model = MinimaEmbeddings()
-        return QdrantVectorStore(
-            client=qdrant,
+    def _setup_retriever(self) -> QdrantRetriever:
+        """Initialize the retriever with sync and async Qdrant clients"""
+        return QdrantRetriever(
+            client=QdrantClient(host=self.config.qdrant_host),
+            async_client=AsyncQdrantClient(host=self.config.qdrant_host),
             collection_name=self.config.qdrant_collection,
-            embedding=embed_model
+            embeddings=MinimaEmbeddings()
+        )
+
+    def _setup_reranker(self) -> HuggingFaceCrossEncoder:
+        """Load the cross-encoder weights"""
+        return HuggingFaceCrossEncoder(
+            model_name=self.config.rerank_model,
+            model_kwargs={'device': self.config.device},
         )
 
     def _setup_chain(self):
         """Set up the retrieval and QA chain"""
         # Initialize retriever with reranking
-        base_retriever = self.document_store.as_retriever()
-        reranker = HuggingFaceCrossEncoder(
-            model_name=self.config.rerank_model,
-            model_kwargs={'device': self.config.device},
+        self.compressor = BoundedCrossEncoderReranker(
+            model=self.reranker,
+            top_n=3,
+            executor=ThreadPoolExecutor(max_workers=self.config.rerank_workers, thread_name_prefix="rerank")
         )
         compression_retriever = ContextualCompressionRetriever(
-            base_compressor=CrossEncoderReranker(model=reranker, top_n=3),
-            base_retriever=base_retriever
+            base_compressor=self.compressor,
+            base_retriever=self.retriever
         )
 
         # Create history-aware retriever
@@ -143,6 +185,7 @@ class LLMChain:
         history_aware_retriever = create_history_aware_retriever(
             self.llm, compression_retriever, contextualize_prompt
         )
+        self.contextualize_chain = contextualize_prompt | self.llm | StrOutputParser()
 
         # Create QA chain
         qa_prompt = ChatPromptTemplate.from_messages([
@@ -150,82 +193,371 @@ class LLMChain:
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ])
-        qa_chain = create_stuff_documents_chain(self.llm, qa_prompt)
-        retrieval_chain = create_retrieval_chain(history_aware_retriever, qa_chain)
+        self.qa_chain = create_stuff_documents_chain(self.llm.with_config(tags=[ANSWER_TAG]), qa_prompt)
+        retrieval_chain = create_retrieval_chain(history_aware_retriever, self.qa_chain)
 
         return retrieval_chain
 
     def _create_graph(self) -> StateGraph:
         """Create the processing graph"""
+        if self.config.graph_mode not in GRAPH_MODES:
+            raise ValueError(f"Unsupported graph mode {self.config.graph_mode}, expected one of {GRAPH_MODES}")
         workflow = StateGraph(state_schema=State)
-        workflow.add_node("enhance", self._enhance_query)
-        workflow.add_node("retrieval", self._call_model)
+        # Nodes have a sync and an async implementation, invoke uses the former and
+        # ainvoke/astream the latter
+        if self.config.graph_mode == "parallel":
+            workflow.add_node("enhance", RunnableLambda(self._retrieve_enhanced, afunc=self._aretrieve_enhanced))
+            workflow.add_node("retrieve_question", RunnableLambda(self._retrieve_question, afunc=self._aretrieve_question))
+            workflow.add_node("answer", RunnableLambda(self._answer, afunc=self._aanswer))
+            workflow.add_edge(START, "enhance")
+            workflow.add_edge(START, "retrieve_question")
+            workflow.add_edge(["enhance", "retrieve_question"], "answer")
+            self._final_node = "answer"
+            return workflow.compile(checkpointer=self.checkpointer)
+        workflow.add_node("enhance", RunnableLambda(self._enhance_query, afunc=self._aenhance_query))
+        workflow.add_node("retrieval", RunnableLambda(self._call_model, afunc=self._acall_model))
         workflow.add_edge(START, "enhance")
         workflow.add_edge("enhance", "retrieval")
-        return workflow.compile(checkpointer=MemorySaver())
+        self._final_node = "retrieval"
+        return workflow.compile(checkpointer=self.checkpointer)
 
-    def _enhance_query(self, state: State) -> str:
-        """Enhance the query using the LLM"""
+    def _query_enhancement(self):
         prompt_enhancement = ChatPromptTemplate.from_messages([
             ("system", QUERY_ENHANCEMENT_PROMPT),
             ("human", "{input}"),
         ])
-        query_enhancement = prompt_enhancement | self.llm
-        enhanced_query = query_enhancement.invoke({
-            "input": state["input"]
-        })
+        return prompt_enhancement | self.llm
+
+    def _enhancement_key(self, question: str) -> tuple[str, str]:
+        return self.config.ollama_model or "", normalize_question(question)
+
+    def _enhance(self, question: str) -> str:
+        """The enhanced query of a question, from the cache or the LLM"""
+        key = self._enhancement_key(question)
+        enhanced_query = self.enhancement_cache.get(*key)
+        if enhanced_query is None:
+            enhanced_query = self._query_enhancement().invoke({"input": question}).content
+            self.enhancement_cache.put(enhanced_query, *key)
+        return enhanced_query
+
+    async def _aenhance(self, question: str) -> str:
+        """The enhanced query of a question, from the cache or the LLM"""
+        key = self._enhancement_key(question)
+        enhanced_query = self.enhancement_cache.get(*key)
+        if enhanced_query is None:
+            enhanced_query = (await self._query_enhancement().ainvoke({"input": question})).content
+            self.enhancement_cache.put(enhanced_query, *key)
+        return enhanced_query
+
+    @staticmethod
+    def _enhanced_state(state: State, enhanced_query: str) -> State:
         logger.info(f"Enhanced query: {enhanced_query}")
         state["init_query"] = state["input"]
-        state["input"] = enhanced_query.content
+        state["input"] = enhanced_query
         return state
 
-    def _call_model(self, state: State) -> dict:
-        """Process the query through the model"""
-        logger.info(f"Processing query: {state['init_query']}")
-        logger.info(f"Enhanced query: {state['input']}")
-        response = self.chain.invoke(state)
+    def _enhance_query(self, state: State) -> str:
+        """Enhance the query using the LLM"""
+        return self._enhanced_state(state, self._enhance(state["input"]))
+
+    async def _aenhance_query(self, state: State) -> str:
+        """Enhance the query using the LLM, without blocking the event loop"""
+        return self._enhanced_state(state, await self._aenhance(state["input"]))
+
+    @staticmethod
+    def _answer_update(question: str, response: dict) -> dict:
         logger.info(f"Received response: {response['answer']}")
         return {
             "chat_history": [
-                HumanMessage(state["init_query"]),
+                HumanMessage(question),
                 AIMessage(response["answer"]),
             ],
             "context": response["context"],
             "answer": response["answer"],
         }
-    
-    def invoke(self, message: str) -> dict:
+
+    def _call_model(self, state: State) -> dict:
+        """Process the query through the model"""
+        logger.info(f"Processing query: {state['init_query']}")
+        logger.info(f"Enhanced query: {state['input']}")
+        return self._answer_update(state["init_query"], self.chain.invoke(state))
+
+    async def _acall_model(self, state: State) -> dict:
+        """Process the query through the model, without blocking the event loop"""
+        logger.info(f"Processing query: {state['init_query']}")
+        logger.info(f"Enhanced query: {state['input']}")
+        return self._answer_update(state["init_query"], await self.chain.ainvoke(state))
+
+    def _retrieve_enhanced(self, state: State) -> dict:
+        """Enhance the query and retrieve with it, leaving the question as it is for the retrieval running alongside"""
+        start = time.perf_counter()
+        enhanced_query = self._enhance(state["input"])
+        logger.info(f"Enhanced query in {time.perf_counter() - start:.2f}s: {enhanced_query}")
+        documents = self.retriever.invoke(enhanced_query)
+        logger.info(f"Retrieved {len(documents)} chunks for the enhanced query in {time.perf_counter() - start:.2f}s")
+        return {"enhanced_query": enhanced_query, "enhanced_context": documents}
+
+    async def _aretrieve_enhanced(self, state: State) -> dict:
+        """Enhance the query and retrieve with it, leaving the question as it is for the retrieval running alongside"""
+        start = time.perf_counter()
+        enhanced_query = await self._aenhance(state["input"])
+        logger.info(f"Enhanced query in {time.perf_counter() - start:.2f}s: {enhanced_query}")
+        documents = await self.retriever.ainvoke(enhanced_query)
+        logger.info(f"Retrieved {len(documents)} chunks for the enhanced query in {time.perf_counter() - start:.2f}s")
+        return {"enhanced_query": enhanced_query, "enhanced_context": documents}
+
+    def _retrieve_question(self, state: State) -> dict:
+        """Retrieve with the question, made standalone by the LLM only when there is a chat history"""
+        start = time.perf_counter()
+        question = state["input"]
+        if state.get("chat_history"):
+            question = self.contextualize_chain.invoke({"input": question, "chat_history": state["chat_history"]})
+        documents = self.retriever.invoke(question)
+        logger.info(f"Retrieved {len(documents)} chunks for the question in {time.perf_counter() - start:.2f}s")
+        return {"question": question, "question_context": documents}
+
+    async def _aretrieve_question(self, state: State) -> dict:
+        """Retrieve with the question, made standalone by the LLM only when there is a chat history"""
+        start = time.perf_counter()
+        question = state["input"]
+        if state.get("chat_history"):
+            question = await self.contextualize_chain.ainvoke({"input": question, "chat_history": state["chat_history"]})
+        documents = await self.retriever.ainvoke(question)
+        logger.info(f"Retrieved {len(documents)} chunks for the question in {time.perf_counter() - start:.2f}s")
+        return {"question": question, "question_context": documents}
+
+    @staticmethod
+    def _merge(*results: Sequence[Document]) -> list[Document]:
+        """Chunks of all results, each once, in the order they were first found"""
+        merged = {}
+        for documents in results:
+            for doc in documents:
+                merged.setdefault(doc.metadata.get("_id", doc.page_content), doc)
+        return list(merged.values())
+
+    def _answer(self, state: State) -> dict:
+        """Merge the chunks of the question and of the enhanced query, rerank them and answer"""
+        start = time.perf_counter()
+        documents = self._merge(state["question_context"], state["enhanced_context"])
+        context = list(self.compressor.compress_documents(documents, state["question"]))
+        logger.info(f"Reranked {len(documents)} chunks in {time.perf_counter() - start:.2f}s")
+        answer = self.qa_chain.invoke({
+            "input": state["input"],
+            "chat_history": state["chat_history"],
+            "context": context
+        })
+        return self._answer_update(state["input"], {"answer": answer, "context": context})
+
+    async def _aanswer(self, state: State) -> dict:
+        """Merge the chunks of the question and of the enhanced query, rerank them and answer"""
+        start = time.perf_counter()
+        documents = self._merge(state["question_context"], state["enhanced_context"])
+        context = list(await self.compressor.acompress_documents(documents, state["question"]))
+        logger.info(f"Reranked {len(documents)} chunks in {time.perf_counter() - start:.2f}s")
+        answer = await self.qa_chain.ainvoke({
+            "input": state["input"],
+            "chat_history": state["chat_history"],
+            "context": context
+        })
+        return self._answer_update(state["input"], {"answer": answer, "context": context})
+
+    def warm_up(self):
+        """
+        Run every model once, so that the first question does not pay for loading the
+        reranker, the embedding model of the indexer and the Ollama model
+        """
+        start = time.perf_counter()
+        self.reranker.score([("warm up", "warm up")])
+        for name, warm in (
+            ("embeddings", lambda: self.retriever.embeddings.embed_query("warm up")),
+            ("ollama", lambda: self.llm.invoke("Reply with OK")),
+        ):
+            try:
+                warm()
+            except Exception as e:
+                logger.warning(f"Could not warm up {name}: {e}")
+        logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+    async def adelete_thread(self, thread_id: str):
+        """Forget the chat history of a thread"""
+        await self.checkpointer.adelete_thread(thread_id)
+
+    async def aclose(self):
+        await self.retriever.async_client.close()
+        await self.retriever.embeddings.aclose()
+        await self.index_version.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "enhancement_cache": self.enhancement_cache.stats(),
+            "answer_cache": self.answer_cache.stats(),
+            **self.index_version.stats(),
+        }
+
+    async def _answer_key(self, message: str, config: dict) -> tuple[str, ...] | None:
+        """
+        Key of the cached answer to a message, None when the answer must not be cached:
+        a follow-up depends on the chat history, and without an index version a cached
+        answer could be stale
+        """
+        if not self.answer_cache.enabled:
+            return None
+        state = await self.graph.aget_state(config)
+        if state.values.get("chat_history"):
+            return None
+        version = await self.index_version.aget()
+        if version is None:
+            return None
+        return (
+            self.config.ollama_model or "",
+            self.config.rerank_model or "",
+            self.config.graph_mode,
+            version,
+            normalize_question(message),
+        )
+
+    async def _acached_answer(self, message: str, config: dict, key: tuple[str, ...] | None) -> dict | None:
+        """The cached answer to a message, added to the chat history as if it was generated"""
+        cached = self.answer_cache.get(*key) if key else None
+        if cached is None:
+            return None
+        await self.graph.aupdate_state(
+            config,
+            {"chat_history": [HumanMessage(message), AIMessage(cached["answer"])]},
+            as_node=self._final_node
+        )
+        logger.info(f"Cached answer for: {message}")
+        return {"answer": cached["answer"], "links": set(cached["links"])}
+
+    def _cache_answer(self, key: tuple[str, ...] | None, answer: str, links: set):
+        if key:
+            self.answer_cache.put({"answer": answer, "links": sorted(links)}, *key)
+
+    def _thread_config(self, thread_id: Optional[str] = None) -> dict:
+        return {
+            "configurable": {
+                "thread_id": thread_id or str(uuid.uuid4()),
+                "thread_ts": datetime.datetime.now().isoformat()
+            }
+        }
+
+    def _links(self, context: Sequence[Document]) -> set:
+        links = set()
+        for doc in context:
+            path = doc.metadata["file_path"].replace(
+                self.localConfig.CONTAINER_PATH,
+                self.localConfig.LOCAL_FILES_PATH
+            )
+            links.add(f"file://{path}")
+        return links
+
+    def invoke(self, message: str, thread_id: Optional[str] = None) -> dict:
         """
         Process a user message and return the response
         
         Args:
             message: The user's input message
+            thread_id: Chat whose history the message continues, a new chat when not given
             
         Returns:
             dict: Contains the model's response or error information
         """
         try:
             logger.info(f"Processing query: {message}")
-            config = {
-                "configurable": {
-                    "thread_id": uuid.uuid4(),
-                    "thread_ts": datetime.datetime.now().isoformat()
-                }   
-            }
             result = self.graph.invoke(
+                {"input": message},
+                config=self._thread_config(thread_id)
+            )
+            logger.info(f"OUTPUT: {result}")
+            return {"answer": result["answer"], "links": self._links(result["context"])}
+        except Exception as e:
+            logger.error(f"Error processing query", exc_info=True)
+            return {"error": str(e), "status": "error"}
+
+    async def ainvoke(self, message: str, thread_id: Optional[str] = None) -> dict:
+        """
+        Process a user message and return the response, without blocking the event loop
+
+        Args:
+            message: The user's input message
+            thread_id: Chat whose history the message continues, a new chat when not given
+
+        Returns:
+            dict: Contains the model's response or error information
+        """
+        try:
+            logger.info(f"Processing query: {message}")
+            config = self._thread_config(thread_id)
+            key = await self._answer_key(message, config)
+            cached = await self._acached_answer(message, config, key)
+            if cached is not None:
+                return cached
+            result = await self.graph.ainvoke(
                 {"input": message},
                 config=config
             )
             logger.info(f"OUTPUT: {result}")
-            links = set()
-            for ctx in result["context"]:
-                doc: Document = ctx
-                path = doc.metadata["file_path"].replace(
-                    self.localConfig.CONTAINER_PATH,
-                    self.localConfig.LOCAL_FILES_PATH
-                )
-                links.add(f"file://{path}")
+            links = self._links(result["context"])
+            self._cache_answer(key, result["answer"], links)
             return {"answer": result["answer"], "links": links}
         except Exception as e:
             logger.error(f"Error processing query", exc_info=True)
-            return {"error": str(e), "status": "error"}
\ No newline at end of file
+            return {"error": str(e), "status": "error"}
+
+    async def astream(self, message: str, thread_id: Optional[str] = None) -> AsyncIterator[dict]:
+        """
+        Process a user message, streaming the answer as it is generated
+
+        Args:
+            message: The user's input message
+            thread_id: Chat whose history the message continues, a new chat when not given
+
+        Yields:
+            dict: {"token": ...} for every generated piece of the answer, then the
+            response of invoke with the time to first token, or error information.
+            A cached answer comes as a single token and is marked as cached.
+        """
+        try:
+            logger.info(f"Processing query: {message}")
+            start = time.perf_counter()
+            config = self._thread_config(thread_id)
+            key = await self._answer_key(message, config)
+            cached = await self._acached_answer(message, config, key)
+            if cached is not None:
+                elapsed_ms = round((time.perf_counter() - start) * 1000)
+                yield {"token": cached["answer"]}
+                yield {**cached, "ttft_ms": elapsed_ms, "total_ms": elapsed_ms, "cached": True}
+                return
+            first_token = None
+            result = {}
+            async for mode, chunk in self.graph.astream(
+                {"input": message},
+                config=config,
+                stream_mode=["messages", "values"]
+            ):
+                if mode == "values":
+                    result = chunk
+                    continue
+                token, metadata = chunk
+                # Enhancement and contextualization run through the same LLM, only the
+                # answer is streamed
+                if ANSWER_TAG not in metadata.get("tags", []) or not token.content:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    logger.info(f"Time to first token: {first_token:.2f}s")
+                yield {"token": token.content}
+            total = time.perf_counter() - start
+            logger.info(f"OUTPUT: {result}")
+            logger.info(f"Answered in {total:.2f}s, time to first token: {first_token or total:.2f}s")
+            links = self._links(result["context"])
+            self._cache_answer(key, result["answer"], links)
+            yield {
+                "answer": result["answer"],
+                "links": links,
+                "ttft_ms": round((first_token or total) * 1000),
+                "total_ms": round(total * 1000),
+            }
+        except Exception as e:
+            logger.error(f"Error processing query", exc_info=True)
+            yield {"error": str(e), "status": "error"}
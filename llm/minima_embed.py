@@ -1,49 +1,130 @@
+import os
+import sys
+import json
+import httpx
 import requests
 import logging
+from array import array
 from typing import Any, List
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langchain_core.embeddings import Embeddings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-REQUEST_DATA_URL = "http://indexer:8000/embedding"
+REQUEST_DATA_URL = os.environ.get("INDEXER_EMBEDDINGS_URL", "http://indexer:8000/embeddings")
 REQUEST_HEADERS = {
-    'Accept': 'application/json',
+    'Accept': 'application/octet-stream',
     'Content-Type': 'application/json'
 }
+# Texts per request, must not exceed EMBEDDINGS_MAX_TEXTS of the indexer
+EMBEDDINGS_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_BATCH_SIZE", "64"))
+EMBEDDINGS_POOL_SIZE = int(os.environ.get("EMBEDDINGS_POOL_SIZE", "10"))
+EMBEDDINGS_TIMEOUT_SECONDS = float(os.environ.get("EMBEDDINGS_TIMEOUT_SECONDS", "60"))
+
+
+class MinimaEmbeddingError(Exception):
+    """Raised when the indexer could not embed some of the texts, errors maps their index to the reason."""
+
+    def __init__(self, errors: dict[int, str]):
+        self.errors = errors
+        super().__init__(f"Embedding failed for {len(errors)} texts: {errors}")
+
+
+def _decode(response_headers, content: bytes, offset: int) -> tuple[list[list[float]], dict[int, str]]:
+    count = int(response_headers["X-Embedding-Count"])
+    dimension = int(response_headers["X-Embedding-Dimension"])
+    values = array("f")
+    values.frombytes(content)
+    if sys.byteorder == "big":
+        values.byteswap()
+    if len(values) != count * dimension:
+        raise ValueError(f"Expected {count}x{dimension} floats, received {len(values)}")
+    vectors = [values[i * dimension:(i + 1) * dimension].tolist() for i in range(count)]
+    errors = {int(i) + offset: error for i, error in json.loads(response_headers.get("X-Embedding-Errors", "{}")).items()}
+    return vectors, errors
+
 
 class MinimaEmbeddings(BaseModel, Embeddings):
+    """
+    Embeddings computed by the indexer service, many texts per request. Requests go over
+    pooled keep-alive connections and vectors are transferred as binary float32.
+    """
+
+    _session: requests.Session = PrivateAttr(default=None)
+    _async_client: httpx.AsyncClient = PrivateAttr(default=None)
 
     def __init__(self, **kwargs: Any):
         super().__init__(**kwargs)
+        self._session = requests.Session()
+        # Embedding the same texts again is harmless, so POSTs are retried too
+        retry = Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EMBEDDINGS_POOL_SIZE, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    @staticmethod
+    def _batches(texts: List[str]):
+        for start in range(0, len(texts), EMBEDDINGS_BATCH_SIZE):
+            yield start, texts[start:start + EMBEDDINGS_BATCH_SIZE]
 
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
-        results = []
-        for text in texts:
-            embedding = self.request_data(text)
-            if "error" in embedding:
-                logger.error(f"Error in embedding: {embedding['error']}")
-            else:
-                embedding = embedding["result"]
-                results.append(embedding)
+        results, errors = [], {}
+        for offset, batch in self._batches(texts):
+            logger.info(f"Requesting {len(batch)} embeddings from indexer")
+            response = self._session.post(
+                REQUEST_DATA_URL,
+                headers=REQUEST_HEADERS,
+                json={"texts": batch},
+                timeout=EMBEDDINGS_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            vectors, batch_errors = _decode(response.headers, response.content, offset)
+            results.extend(vectors)
+            errors.update(batch_errors)
+        if errors:
+            logger.error(f"Error in embedding: {errors}")
+            raise MinimaEmbeddingError(errors)
         return results
 
     def embed_query(self, text: str) -> list[float]:
         return self.embed_documents([text])[0]
 
-    def request_data(self, query):
-        payload = {
-            "query": query
-        }
-        try:
-            logger.info(f"Requesting data from indexer with query: {query}")
-            response = requests.post(REQUEST_DATA_URL, headers=REQUEST_HEADERS, json=payload)
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=REQUEST_HEADERS,
+                timeout=EMBEDDINGS_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=EMBEDDINGS_POOL_SIZE, max_keepalive_connections=EMBEDDINGS_POOL_SIZE),
+                transport=httpx.AsyncHTTPTransport(retries=3)
+            )
+        return self._async_client
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        client = self._get_async_client()
+        results, errors = [], {}
+        for offset, batch in self._batches(texts):
+            logger.info(f"Requesting {len(batch)} embeddings from indexer")
+            response = await client.post(REQUEST_DATA_URL, json={"texts": batch})
             response.raise_for_status()
-            data = response.json()
-            logger.info(f"Received data: {data}")
-            return data
+            vectors, batch_errors = _decode(response.headers, response.content, offset)
+            results.extend(vectors)
+            errors.update(batch_errors)
+        if errors:
+            logger.error(f"Error in embedding: {errors}")
+            raise MinimaEmbeddingError(errors)
+        return results
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def close(self):
+        self._session.close()
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"HTTP error: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+    async def aclose(self):
+        self._session.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
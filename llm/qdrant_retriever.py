@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import ConfigDict
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain.retrievers.document_compressors import CrossEncoderReranker
+
+logger = logging.getLogger(__name__)
+
+
+def _to_documents(points) -> List[Document]:
+    documents = []
+    for point in points:
+        payload = point.payload or {}
+        documents.append(Document(
+            page_content=payload.get("page_content", ""),
+            metadata={**(payload.get("metadata") or {}), "_id": point.id, "_score": point.score}
+        ))
+    return documents
+
+
+class QdrantRetriever(BaseRetriever):
+    """
+    Dense search in the indexer's collection. The async path embeds the query through
+    aembed_query and searches with AsyncQdrantClient, so it never blocks the event loop.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    client: QdrantClient
+    async_client: AsyncQdrantClient
+    collection_name: str
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            query=self.embeddings.embed_query(query),
+            limit=self.k,
+            with_payload=True
+        )
+        return _to_documents(response.points)
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        response = await self.async_client.query_points(
+            collection_name=self.collection_name,
+            query=await self.embeddings.aembed_query(query),
+            limit=self.k,
+            with_payload=True
+        )
+        return _to_documents(response.points)
+
+
+class BoundedCrossEncoderReranker(CrossEncoderReranker):
+    """
+    CrossEncoderReranker whose async path scores documents in its own thread pool. The
+    pool bounds how many reranks use the CPU at once, requests beyond it wait in line
+    instead of competing for cores with the running ones.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    executor: ThreadPoolExecutor
+
+    async def acompress_documents(self, documents, query, callbacks=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.compress_documents, documents, query, callbacks)
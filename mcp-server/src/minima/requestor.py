@@ -11,10 +11,16 @@ REQUEST_HEADERS = {
     'Content-Type': 'application/json'
 }
 
-async def request_data(query):
+async def request_data(query, k=None, path_prefix=None, extensions=None, max_bytes=None):
     payload = {
         "query": query
     }
+    if k is not None:
+        payload["k"] = k
+    if max_bytes is not None:
+        payload["max_bytes"] = max_bytes
+    if path_prefix or extensions:
+        payload["filter"] = {"path_prefix": path_prefix, "extensions": extensions}
     async with httpx.AsyncClient() as client:
         try:
             logger.info(f"Requesting data from indexer with query: {query}")
@@ -28,4 +34,9 @@ async def request_data(query):
 
         except Exception as e:
             logger.error(f"HTTP error: {e}")
-            return { "error": str(e) }
\ No newline at end of file
+            return { "error": str(e) }
+
+
+def format_result(result) -> str:
+    """Chunks as text for the model, each under the link of its file."""
+    return "\n\n".join(f"{chunk['link']}\n{chunk['text']}" for chunk in result["chunks"])
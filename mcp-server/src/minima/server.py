@@ -2,7 +2,7 @@ import logging
 import mcp.server.stdio
 from typing import Annotated
 from mcp.server import Server
-from .requestor import request_data
+from .requestor import format_result, request_data
 from pydantic import BaseModel, Field
 from mcp.server.stdio import stdio_server
 from mcp.shared.exceptions import McpError
@@ -36,6 +36,22 @@ class Query(BaseModel):
         str, 
         Field(description="context to find")
     ]
+    k: Annotated[
+        int | None,
+        Field(ge=1, description="number of passages to return")
+    ] = None
+    path_prefix: Annotated[
+        str | None,
+        Field(description="only search files in this folder")
+    ] = None
+    extensions: Annotated[
+        list[str] | None,
+        Field(description="only search files with these extensions, e.g. [\".md\", \".pdf\"]")
+    ] = None
+    max_bytes: Annotated[
+        int | None,
+        Field(ge=1, description="maximum size of the returned text in bytes")
+    ] = None
 
 @server.list_tools()
 async def list_tools() -> list[Tool]:
@@ -82,13 +98,19 @@ async def call_tool(name, arguments: dict) -> list[TextContent]:
         raise McpError(INVALID_PARAMS, "Context is required")
 
     try:
-        output = await request_data(context)
+        output = await request_data(
+            context,
+            k=args.k,
+            path_prefix=args.path_prefix,
+            extensions=args.extensions,
+            max_bytes=args.max_bytes
+        )
         if "error" in output:
             logging.error(output["error"])
             raise McpError(INTERNAL_ERROR, output["error"])
         
         logging.info(f"Get prompt: {output}")    
-        output_text = output['result']['output']
+        output_text = format_result(output['result'])
         # Handle potential Unicode characters
         output_text = output_text.encode('utf-8', errors='replace').decode('utf-8')
         
@@ -123,7 +145,7 @@ async def get_prompt(name: str, arguments: dict | None) -> GetPromptResult:
             )
 
         logging.info(f"Get prompt: {output}")    
-        output_text = output['result']['output']
+        output_text = format_result(output['result'])
         
         # Handle potential Unicode characters
         output_text = output_text.encode('utf-8', errors='replace').decode('utf-8')